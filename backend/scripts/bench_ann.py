@@ -0,0 +1,154 @@
+"""
+bench_ann.py — Recall@k vs latency of approximate FAISS index types against the
+exact Flat index. Run from backend/:
+
+    uv run python scripts/bench_ann.py                      # vectors from data/index
+    uv run python scripts/bench_ann.py --synthetic 200000    # synthetic corpus
+    uv run python scripts/bench_ann.py --embed-test-set     # real queries from data/test_set
+
+Each row of the report is one (index type, search parameter) point on the
+recall/latency curve; pick one and set FAISS_INDEX_TYPE, HNSW_EF_SEARCH or
+IVF_NPROBE accordingly.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Allow imports from backend/src
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def load_vectors(args):
+    """Corpus vectors from the built index, or a clustered synthetic set."""
+    import faiss
+    import numpy as np
+
+    if args.synthetic:
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(max(args.synthetic // 50, 1), args.dim)).astype("float32")
+        labels = rng.integers(0, len(centers), args.synthetic)
+        vecs = centers[labels] + 0.5 * rng.normal(size=(args.synthetic, args.dim)).astype("float32")
+    else:
+        from src.config import settings
+        from src.rag.vectorstore import base_index
+        index = base_index(faiss.read_index(str(settings.index_dir / "faiss.index")))
+        vecs = index.reconstruct_n(0, index.ntotal)
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+
+def load_queries(args, vecs):
+    """Real test-set query embeddings, or perturbed corpus vectors."""
+    import faiss
+    import numpy as np
+
+    if args.embed_test_set:
+        from src.rag.embedder import Embedder
+        files = sorted(args.test_set.glob("*.json"))[: args.queries]
+        texts = [json.loads(f.read_text(encoding="utf-8"))["query"] for f in files]
+        return Embedder().encode(texts, is_query=True)
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(vecs), args.queries)
+    queries = vecs[picks] + 0.3 * rng.normal(size=(args.queries, vecs.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def time_queries(index, queries, k: int) -> tuple[float, "np.ndarray"]:
+    """Per-query latency in ms (one query per call, as in serving) and the result ids."""
+    import numpy as np
+
+    ids = np.empty((len(queries), k), dtype="int64")
+    t0 = time.perf_counter()
+    for i, q in enumerate(queries):
+        _, ids[i] = index.search(q.reshape(1, -1), k)
+    return (time.perf_counter() - t0) / len(queries) * 1000, ids
+
+
+def recall_at_k(approx, exact) -> float:
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx, exact))
+    return hits / exact.size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of data/index")
+    parser.add_argument("--dim", type=int, default=768, help="Synthetic vector dim")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--embed-test-set", action="store_true", help="Embed data/test_set queries")
+    parser.add_argument("--test-set", type=Path, default=Path(__file__).parent.parent.parent / "data" / "test_set")
+    parser.add_argument("-k", type=int, default=25)
+    parser.add_argument("--types", nargs="+", default=["hnsw", "ivf_flat", "ivf_pq"])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    import faiss
+    from src.config import settings
+    from src.rag.vectorstore import make_index
+
+    vecs = load_vectors(args)
+    queries = load_queries(args, vecs)
+    n, dim = vecs.shape
+    logger.info(f"{n} vectors (dim={dim}), {len(queries)} queries, k={args.k}")
+
+    flat = make_index(dim, n, "flat")
+    flat.add(vecs)
+    flat_ms, exact = time_queries(flat, queries, args.k)
+    report = [{"index_type": "flat", "param": None, "recall": 1.0, "ms_per_query": round(flat_ms, 3),
+               "build_s": 0.0, "size_mb": round(vecs.nbytes / 2**20, 1)}]
+
+    for index_type in args.types:
+        t0 = time.perf_counter()
+        index = make_index(dim, n, index_type)
+        if not index.is_trained:
+            index.train(vecs)
+        index.add(vecs)
+        build_s = time.perf_counter() - t0
+        size_mb = len(faiss.serialize_index(index)) / 2**20
+
+        if index_type == "hnsw":
+            sweep = [("efSearch", v) for v in args.ef_search]
+        else:
+            nlist = faiss.extract_index_ivf(index).nlist
+            sweep = [("nprobe", v) for v in args.nprobe if v <= nlist]
+        for name, value in sweep:
+            if name == "efSearch":
+                index.hnsw.efSearch = value
+            else:
+                faiss.extract_index_ivf(index).nprobe = value
+            ms, ids = time_queries(index, queries, args.k)
+            row = {
+                "index_type": index_type,
+                "param": f"{name}={value}",
+                "recall": round(recall_at_k(ids, exact), 4),
+                "ms_per_query": round(ms, 3),
+                "build_s": round(build_s, 2),
+                "size_mb": round(size_mb, 1),
+            }
+            report.append(row)
+            logger.info(json.dumps(row))
+
+    print(f"\nRecall@{args.k} vs latency ({n} vectors, {settings.embed_model if not args.synthetic else 'synthetic'})")
+    print(f"{'type':>9} {'param':>13} {'recall':>7} {'ms/q':>8} {'build s':>8} {'MB':>7}")
+    for row in report:
+        print(
+            f"{row['index_type']:>9} {row['param'] or '—':>13} {row['recall']:>7} "
+            f"{row['ms_per_query']:>8} {row['build_s']:>8} {row['size_mb']:>7}"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
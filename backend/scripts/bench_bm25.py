@@ -0,0 +1,152 @@
+"""
+bench_bm25.py — Query-time scaling of the sparse BM25 engine on synthetic corpora,
+with a ranking parity check against rank_bm25.BM25Okapi. Run from backend/:
+
+    uv run python scripts/bench_bm25.py [--sizes 10000 100000 1000000] [--queries 200]
+
+Documents are Zipf-distributed term ids with protocol-chunk-like lengths, so
+posting-list lengths look like the real corpus. BM25Okapi is only timed up to
+--okapi-max-docs because its full scan gets impractically slow beyond that.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Allow imports from backend/src
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def synthetic_counts(n_docs: int, vocab_size: int, mean_len: int, seed: int):
+    """Term-frequency matrix (n_docs, vocab_size) with Zipfian term usage."""
+    import numpy as np
+    from scipy import sparse
+
+    rng = np.random.default_rng(seed)
+    doc_len = np.clip(rng.normal(mean_len, mean_len / 3, n_docs), 20, mean_len * 2).astype("int64")
+    terms = (rng.zipf(1.2, int(doc_len.sum())) - 1) % vocab_size
+    rows = np.repeat(np.arange(n_docs), doc_len)
+    tf = sparse.csr_matrix(
+        (np.ones(len(terms), dtype="float32"), (rows, terms)), shape=(n_docs, vocab_size)
+    )
+    tf.sum_duplicates()
+    return tf
+
+
+def synthetic_queries(n_queries: int, vocab_size: int, seed: int) -> list[str]:
+    """Symptom-like queries: 8–20 terms drawn from the mid-frequency range."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for _ in range(n_queries):
+        n = rng.integers(8, 21)
+        ids = rng.integers(10, min(vocab_size, 20000), n)
+        queries.append(" ".join(f"w{i}" for i in ids))
+    return queries
+
+
+def check_parity(tf, vocab: dict[str, int], queries: list[str], top_k: int, engine) -> dict:
+    """Compare top-k rankings with BM25Okapi on the same corpus."""
+    import numpy as np
+    from rank_bm25 import BM25Okapi
+
+    terms = {i: t for t, i in vocab.items()}
+    tokenized = []
+    for d in range(tf.shape[0]):
+        lo, hi = tf.indptr[d], tf.indptr[d + 1]
+        doc = []
+        for term, count in zip(tf.indices[lo:hi], tf.data[lo:hi]):
+            doc.extend([terms[term]] * int(count))
+        tokenized.append(doc)
+    okapi = BM25Okapi(tokenized)
+
+    exact = 0
+    same_set = 0
+    okapi_time = 0.0
+    results = engine.search_batch(queries, top_k)
+    for query, hits in zip(queries, results):
+        t0 = time.perf_counter()
+        scores = okapi.get_scores(query.split())
+        top = np.argsort(scores)[::-1][:top_k]
+        okapi_time += time.perf_counter() - t0
+        expected = [int(i) for i in top if scores[i] > 0]
+        got = hits.rows.tolist()
+        # Exactly tied documents may come out in either order; a ranking matches
+        # when every position holds a document with the same Okapi score
+        exact += len(got) == len(expected) and np.allclose(scores[got], scores[expected], rtol=1e-6)
+        same_set += set(got) == set(expected)
+    n = len(queries)
+    return {
+        "okapi_ms_per_query": round(okapi_time / n * 1000, 3),
+        "exact_order_match": round(exact / n, 4),
+        "same_topk_set": round(same_set / n, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=25)
+    parser.add_argument("--vocab", type=int, default=200_000, help="Vocabulary size")
+    parser.add_argument("--doc-len", type=int, default=300, help="Mean chunk length (words)")
+    parser.add_argument("--okapi-max-docs", type=int, default=100_000)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from src.rag.bm25 import BM25Index
+
+    vocab = {f"w{i}": i for i in range(args.vocab)}
+    queries = synthetic_queries(args.queries, args.vocab, args.seed)
+    report = []
+    for n_docs in args.sizes:
+        t0 = time.perf_counter()
+        tf = synthetic_counts(n_docs, args.vocab, args.doc_len, args.seed)
+        engine = BM25Index()
+        engine.fit_counts(tf, vocab)
+        build_s = time.perf_counter() - t0
+
+        engine.search(queries[0], args.top_k)  # warm-up
+        t0 = time.perf_counter()
+        for q in queries:
+            engine.search(q, args.top_k)
+        single_ms = (time.perf_counter() - t0) / len(queries) * 1000
+
+        t0 = time.perf_counter()
+        engine.search_batch(queries, args.top_k)
+        batch_ms = (time.perf_counter() - t0) / len(queries) * 1000
+
+        row = {
+            "n_docs": n_docs,
+            "nnz": int(engine.weights.nnz),
+            "build_s": round(build_s, 2),
+            "sparse_ms_per_query": round(single_ms, 3),
+            "sparse_batch_ms_per_query": round(batch_ms, 3),
+        }
+        if n_docs <= args.okapi_max_docs:
+            row.update(check_parity(tf, vocab, queries, args.top_k, engine))
+        report.append(row)
+        logger.info(json.dumps(row))
+
+    print(f"\n{'docs':>10} {'sparse ms/q':>12} {'batch ms/q':>11} {'okapi ms/q':>11} {'exact':>7} {'set':>7}")
+    for row in report:
+        print(
+            f"{row['n_docs']:>10} {row['sparse_ms_per_query']:>12} {row['sparse_batch_ms_per_query']:>11} "
+            f"{row.get('okapi_ms_per_query', '—'):>11} {row.get('exact_order_match', '—'):>7} "
+            f"{row.get('same_topk_set', '—'):>7}"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+bench_onnx.py — Parity check and CPU benchmark of the ONNX Runtime backend
+against PyTorch, for both the embedder and the cross-encoder. Run from backend/:
+
+    uv sync --extra onnx
+    uv run python scripts/bench_onnx.py                 # export if needed, check, benchmark
+    uv run python scripts/bench_onnx.py --export        # force re-export
+    uv run python scripts/bench_onnx.py --output onnx.json
+
+Parity: cosine between torch and ONNX query/passage embeddings, and Spearman
+rank correlation + top-1 agreement of reranker scores over each query's
+candidate passages. Exits non-zero when a variant falls below --min-cosine or
+--min-spearman.
+
+Benchmark: per-request wall and process-CPU time for one query embedding and
+for re-ranking one query against --passages chunks (the serving shapes).
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Allow imports from backend/src
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def load_texts(args) -> tuple[list[str], list[str]]:
+    """Test-set queries, and passages from the index bundle (or other queries if there is none)."""
+    from src.rag.chunkstore import get_chunkstore
+
+    files = sorted(args.test_set.glob("*.json"))[: args.queries]
+    queries = [json.loads(f.read_text(encoding="utf-8"))["query"] for f in files]
+    store = get_chunkstore()
+    if store is not None and len(store):
+        step = max(1, len(store) // args.passages)
+        passages = [store.text(i) for i in range(0, len(store), step)][: args.passages]
+    else:
+        logger.info("No index bundle — using test-set queries as passages.")
+        passages = (queries * (args.passages // max(len(queries), 1) + 1))[: args.passages]
+    return queries, passages
+
+
+def timed(fn, repeat: int) -> dict:
+    """Mean wall and process-CPU milliseconds per call (after one warm-up call)."""
+    fn()
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    for _ in range(repeat):
+        fn()
+    return {
+        "wall_ms": round((time.perf_counter() - wall0) / repeat * 1000, 2),
+        "cpu_ms": round((time.process_time() - cpu0) / repeat * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test-set", type=Path, default=Path(__file__).parent.parent.parent / "data" / "test_set")
+    parser.add_argument("--queries", type=int, default=32, help="Test-set queries used for parity")
+    parser.add_argument("--passages", type=int, default=25, help="Candidate passages per query (TOP_K)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per measurement")
+    parser.add_argument("--export", action="store_true", help="Re-export even if ONNX files exist")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--min-spearman", type=float, default=0.95)
+    parser.add_argument("--output", type=Path, help="Write results as JSON")
+    args = parser.parse_args()
+
+    import numpy as np
+    from scipy.stats import spearmanr
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+
+    from src.config import settings
+    from src.rag import onnx_backend
+    from src.rag.onnx_backend import OnnxCrossEncoder, OnnxEmbedder
+
+    if args.export:
+        onnx_backend.export(settings.embed_model, "embedder", quantize=True)
+        onnx_backend.export(settings.reranker_model, "reranker", quantize=True)
+
+    queries, passages = load_texts(args)
+    q_texts = ["query: " + q for q in queries]
+    p_texts = ["passage: " + p for p in passages]
+    pairs = [[(q, p) for p in passages] for q in queries]
+    logger.info(f"{len(queries)} queries × {len(passages)} passages")
+
+    st = SentenceTransformer(settings.embed_model, device="cpu")
+    ce = CrossEncoder(settings.reranker_model, device="cpu")
+    ref_q = st.encode(q_texts, normalize_embeddings=True)
+    ref_p = st.encode(p_texts, normalize_embeddings=True)
+    ref_scores = [ce.predict(p, show_progress_bar=False) for p in pairs]
+
+    variants = {
+        "torch": (st, ce),
+        "onnx_fp32": (OnnxEmbedder(settings.embed_model, quantized=False),
+                      OnnxCrossEncoder(settings.reranker_model, quantized=False)),
+        "onnx_int8": (OnnxEmbedder(settings.embed_model, quantized=True),
+                      OnnxCrossEncoder(settings.reranker_model, quantized=True)),
+    }
+
+    report = {"embed_model": settings.embed_model, "reranker_model": settings.reranker_model, "variants": {}}
+    ok = True
+    for name, (embedder, reranker) in variants.items():
+        row: dict = {}
+        if name != "torch":
+            cos_q = np.sum(embedder.encode(q_texts, normalize_embeddings=True) * ref_q, axis=1)
+            cos_p = np.sum(embedder.encode(p_texts, normalize_embeddings=True) * ref_p, axis=1)
+            cos = np.concatenate([cos_q, cos_p])
+            rhos, top1 = [], []
+            for p, ref in zip(pairs, ref_scores):
+                scores = reranker.predict(p, show_progress_bar=False)
+                top1.append(int(np.argmax(scores) == np.argmax(ref)))
+                if np.ptp(ref) > 0:  # rank correlation is undefined for constant scores
+                    rhos.append(spearmanr(scores, ref).statistic)
+            row["parity"] = {
+                "embed_cosine_mean": round(float(cos.mean()), 5),
+                "embed_cosine_min": round(float(cos.min()), 5),
+                "rerank_spearman_mean": round(float(np.mean(rhos)), 4) if rhos else None,
+                "rerank_spearman_min": round(float(np.min(rhos)), 4) if rhos else None,
+                "rerank_top1_agreement": round(float(np.mean(top1)), 4),
+            }
+            passed = row["parity"]["embed_cosine_min"] >= args.min_cosine and (
+                not rhos or row["parity"]["rerank_spearman_mean"] >= args.min_spearman
+            )
+            row["parity"]["passed"] = passed
+            ok &= passed
+
+        row["embed_query"] = timed(lambda: embedder.encode(q_texts[:1], normalize_embeddings=True), args.repeat)
+        row["rerank_request"] = timed(
+            lambda: reranker.predict(pairs[0], batch_size=len(pairs[0]), show_progress_bar=False), args.repeat
+        )
+        report["variants"][name] = row
+        logger.info(f"{name}: {json.dumps(row)}")
+
+    base = report["variants"]["torch"]
+    print(f"\n{'variant':>10} {'embed ms':>9} {'cpu':>8} {'rerank ms':>10} {'cpu':>8} {'speedup':>8} "
+          f"{'cos min':>8} {'rho mean':>9} {'top1':>6}")
+    for name, row in report["variants"].items():
+        cpu_total = row["embed_query"]["cpu_ms"] + row["rerank_request"]["cpu_ms"]
+        speedup = (base["embed_query"]["cpu_ms"] + base["rerank_request"]["cpu_ms"]) / max(cpu_total, 1e-9)
+        row["cpu_speedup_vs_torch"] = round(speedup, 2)
+        parity = row.get("parity", {})
+        print(
+            f"{name:>10} {row['embed_query']['wall_ms']:>9} {row['embed_query']['cpu_ms']:>8} "
+            f"{row['rerank_request']['wall_ms']:>10} {row['rerank_request']['cpu_ms']:>8} {speedup:>7.2f}× "
+            f"{parity.get('embed_cosine_min') or '—':>8} {parity.get('rerank_spearman_mean') or '—':>9} "
+            f"{parity.get('rerank_top1_agreement') or '—':>6}"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        logger.info(f"Results written to {args.output}")
+    if not ok:
+        logger.error("Parity check failed — keep INFERENCE_BACKEND=torch or set ONNX_QUANTIZE=false.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,325 @@
+"""
+bench_retrieval.py — Micro-benchmarks of the retrieval stack on synthetic
+corpora at 1×, 10× and 100× the protocol corpus. Run from backend/:
+
+    uv run python scripts/bench_retrieval.py                         # 1× 10× 100×
+    uv run python scripts/bench_retrieval.py --scales 1 10 --dim 384 -o /tmp/bench.json
+
+For each scale, a full index bundle is written to a scratch directory through
+the production code paths: ChunkStore, VectorStore.build/save and
+BM25Index.fit_counts/save. The script then times:
+
+  * index load       — VectorStore.load (mmap), BM25Index.load, chunk store mapping
+  * dense search     — VectorStore.search, one query per call as in serving
+  * sparse search    — BM25Index.search
+  * fusion           — reciprocal_rank_fusion of the two result lists, per query
+                       and for all queries in one fuse_batch call (ms per query)
+  * aggregation      — aggregate_by_protocol
+  * materialisation  — Candidates.chunks() on the aggregated survivors
+  * prompt           — build_prompt on the aggregated chunks
+
+Corpus shape: protocols have a lognormal number of chunks (mean
+--chunks-per-protocol) and a few ICD codes each. Chunk vectors cluster around
+a per-protocol centre. BM25 term counts are Zipfian, as in bench_bm25.py,
+with --doc-len words per chunk. The stored chunk text is --text-words random
+words; build_prompt truncates context anyway. --base-from-index takes the 1×
+protocol and chunk counts from an existing data/index bundle.
+
+Memory note: 100× of the default base is ~1.2M vectors, which needs ~3.7 GB
+at dim 768 for a flat index. Lower --dim or --scales on small machines.
+
+Results (one entry per scale, with mean/p50/p95/p99 ms per stage) are written
+as JSON to --output.
+"""
+
+import argparse
+import json
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Allow imports from backend/src
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+SYLLABLES = "ба ва га да же зи ко ла ми но пе ро са ти ук фа хи це чу ша ще эн юр ям ост ени ция".split()
+
+
+def corpus_shape(n_protocols: int, chunks_per_protocol: float, seed: int):
+    """Chunk → protocol row and chunk index within the protocol."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    sigma = 0.6
+    mu = np.log(chunks_per_protocol) - sigma ** 2 / 2
+    counts = np.maximum(1, np.round(rng.lognormal(mu, sigma, n_protocols))).astype("int64")
+    protocol = np.repeat(np.arange(n_protocols, dtype="int32"), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    chunk_index = (np.arange(len(protocol)) - starts).astype("int32")
+    return protocol, chunk_index
+
+
+def synthetic_store(protocol, chunk_index, text_words: int, seed: int):
+    """ChunkStore with protocol metadata and random Cyrillic chunk text."""
+    import numpy as np
+    from src.rag.chunkstore import ChunkStore
+
+    rng = np.random.default_rng(seed + 2)
+    n_protocols = int(protocol.max()) + 1 if len(protocol) else 0
+    protocols = []
+    for p in range(n_protocols):
+        letter = chr(65 + p % 26)
+        n_codes = int(rng.integers(1, 8))
+        protocols.append({
+            "protocol_id": f"p{p:07d}",
+            "source_file": f"Протокол {p}.pdf",
+            "title": f"Протокол {p}",
+            "icd_codes": [f"{letter}{(p // 26) % 100:02d}.{k}" for k in range(n_codes)],
+        })
+
+    # Text = a random run of words from a shared pool, so generation stays cheap at 100×
+    vocab = np.array([
+        "".join(rng.choice(SYLLABLES, int(rng.integers(2, 5)))).encode("utf-8") + b" " for _ in range(5000)
+    ], dtype=object)
+    pool_words = vocab[(rng.zipf(1.3, 200_000) - 1) % len(vocab)]
+    word_start = np.zeros(len(pool_words) + 1, dtype="int64")
+    np.cumsum([len(w) for w in pool_words], out=word_start[1:])
+    pool = np.frombuffer(b"".join(pool_words), dtype="uint8")
+
+    first = rng.integers(0, len(pool_words) - text_words, len(protocol))
+    lo, hi = word_start[first], word_start[first + text_words]
+    offsets = np.zeros(len(protocol) + 1, dtype="int64")
+    np.cumsum(hi - lo, out=offsets[1:])
+    text = np.concatenate([pool[a:b] for a, b in zip(lo, hi)]) if len(protocol) else np.empty(0, dtype="uint8")
+    return ChunkStore(text, offsets, protocol, chunk_index, protocols)
+
+
+def synthetic_vectors(protocol, dim: int, seed: int, block: int = 100_000):
+    """Unit vectors clustered by protocol (generated in blocks to cap peak memory)."""
+    import faiss
+    import numpy as np
+
+    rng = np.random.default_rng(seed + 3)
+    centers = rng.normal(size=(int(protocol.max()) + 1, dim)).astype("float32")
+    vecs = np.empty((len(protocol), dim), dtype="float32")
+    for start in range(0, len(protocol), block):
+        rows = protocol[start:start + block]
+        vecs[start:start + len(rows)] = centers[rows] + 0.6 * rng.normal(size=(len(rows), dim)).astype("float32")
+    faiss.normalize_L2(vecs)
+    return vecs, centers
+
+
+def dense_queries(centers, n: int, seed: int):
+    import faiss
+    import numpy as np
+
+    rng = np.random.default_rng(seed + 4)
+    picks = rng.integers(0, len(centers), n)
+    q = centers[picks] + 0.8 * rng.normal(size=(n, centers.shape[1])).astype("float32")
+    q = np.ascontiguousarray(q, dtype="float32")
+    faiss.normalize_L2(q)
+    return q
+
+
+def stats_ms(samples: list[float]) -> dict:
+    import numpy as np
+
+    a = np.asarray(samples) * 1000
+    return {
+        "mean_ms": round(float(a.mean()), 4),
+        "p50_ms": round(float(np.percentile(a, 50)), 4),
+        "p95_ms": round(float(np.percentile(a, 95)), 4),
+        "p99_ms": round(float(np.percentile(a, 99)), 4),
+    }
+
+
+def timed_calls(fn, inputs: list, warmup: int = 3) -> tuple[dict, list]:
+    """Per-call latency stats of fn over inputs, and the outputs."""
+    for x in inputs[:warmup]:
+        fn(x)
+    samples, outputs = [], []
+    for x in inputs:
+        t0 = time.perf_counter()
+        outputs.append(fn(x))
+        samples.append(time.perf_counter() - t0)
+    return stats_ms(samples), outputs
+
+
+def reset_singletons():
+    """Forget cached bundle objects so each load is measured from scratch."""
+    from src.rag import bm25, chunk_tokens, chunkstore, vectorstore
+
+    chunkstore._store = None
+    vectorstore._store = None
+    bm25._bm25 = None
+    chunk_tokens._tokens, chunk_tokens._loaded = None, False
+
+
+def dir_mb(path: Path) -> float:
+    return round(sum(f.stat().st_size for f in path.iterdir() if f.is_file()) / 2**20, 1)
+
+
+def bench_scale(scale: int, args, base_protocols: int, chunks_per_protocol: float, work_dir: Path) -> dict:
+    from bench_bm25 import synthetic_counts, synthetic_queries
+    from src.config import settings
+    from src.rag.bm25 import BM25Index
+    from src.rag.chunkstore import get_chunkstore
+    from src.rag.prompt import build_prompt
+    from src.rag.retriever import aggregate_by_protocol, fuse_batch, reciprocal_rank_fusion
+    from src.rag.vectorstore import VectorStore
+
+    n_protocols = base_protocols * scale
+    index_dir = work_dir / f"scale_{scale}x"
+    shutil.rmtree(index_dir, ignore_errors=True)
+    index_dir.mkdir(parents=True)
+    settings.index_dir = index_dir
+    reset_singletons()
+
+    # Build the bundle through the production code paths
+    t0 = time.perf_counter()
+    protocol, chunk_index = corpus_shape(n_protocols, chunks_per_protocol, args.seed)
+    store = synthetic_store(protocol, chunk_index, args.text_words, args.seed)
+    store.save(index_dir)
+    vecs, centers = synthetic_vectors(protocol, args.dim, args.seed)
+    vs = VectorStore()
+    vs.build(vecs, store, index_type=args.index_type)
+    vs.save()
+    del vs, vecs
+    tf = synthetic_counts(len(store), args.vocab, args.doc_len, args.seed)
+    bm25 = BM25Index()
+    bm25.fit_counts(tf, {f"w{i}": i for i in range(args.vocab)})
+    bm25.save()
+    del bm25, tf, store
+    build_s = time.perf_counter() - t0
+    n_chunks = len(protocol)
+    logger.info(f"{scale}×: {n_protocols} protocols, {n_chunks} chunks built in {build_s:.1f}s")
+
+    # Index load (mapped bundle, as at server start-up)
+    reset_singletons()
+    t0 = time.perf_counter()
+    store = get_chunkstore()
+    load_chunks_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    vs = VectorStore()
+    vs.load()
+    load_faiss_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    bm25 = BM25Index()
+    bm25.load()
+    load_bm25_s = time.perf_counter() - t0
+
+    k = args.top_k
+    q_vecs = dense_queries(centers, args.queries, args.seed)
+    q_texts = synthetic_queries(args.queries, args.vocab, args.seed)
+    stages = {}
+    stages["dense_search"], dense = timed_calls(lambda q: vs.search(q, k), list(q_vecs))
+    stages["sparse_search"], sparse = timed_calls(lambda q: bm25.search(q, k), q_texts)
+    pairs = list(zip(dense, sparse))
+    stages["rrf_fusion"], fused = timed_calls(
+        lambda p: reciprocal_rank_fusion(p[0], p[1], top_k=k, k=settings.rrf_k), pairs
+    )
+    # All queries fused in one call, as /diagnose/batch does; reported per query
+    stages["rrf_fusion_batch"], _ = timed_calls(
+        lambda _: fuse_batch(dense, sparse, top_k=k, k=settings.rrf_k), [None] * 10
+    )
+    stages["rrf_fusion_batch"] = {name: round(v / len(dense), 4) for name, v in stages["rrf_fusion_batch"].items()}
+    stages["aggregate_by_protocol"], aggregated = timed_calls(
+        lambda f: aggregate_by_protocol(f, top_protocols=5), fused
+    )
+    stages["materialize_chunks"], aggregated = timed_calls(lambda c: c.chunks(), aggregated)
+    inputs = list(zip(q_texts, aggregated))
+    stages["build_prompt"], prompts = timed_calls(lambda x: build_prompt(x[0], x[1], top_n=5), inputs)
+
+    row = {
+        "scale": scale,
+        "n_protocols": n_protocols,
+        "n_chunks": n_chunks,
+        "dim": args.dim,
+        "index_type": args.index_type or settings.faiss_index_type,
+        "bm25_nnz": int(bm25.weights.nnz),
+        "bundle_mb": dir_mb(index_dir),
+        "build_s": round(build_s, 2),
+        "load_s": {
+            "chunk_store": round(load_chunks_s, 4),
+            "faiss": round(load_faiss_s, 4),
+            "bm25": round(load_bm25_s, 4),
+        },
+        "stages": stages,
+        "mean_prompt_chars": round(sum(len(p) for p in prompts) / len(prompts)),
+    }
+    del vs, bm25, store
+    reset_singletons()
+    if not args.keep:
+        shutil.rmtree(index_dir, ignore_errors=True)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval micro-benchmarks on scaled synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--base-protocols", type=int, default=1000, help="Protocols at 1×")
+    parser.add_argument("--chunks-per-protocol", type=float, default=12.0, help="Mean chunks per protocol")
+    parser.add_argument("--base-from-index", action="store_true",
+                        help="Take 1× protocol/chunk counts from the data/index bundle")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--index-type", help="FAISS index type (default: FAISS_INDEX_TYPE)")
+    parser.add_argument("--vocab", type=int, default=200_000, help="BM25 vocabulary size")
+    parser.add_argument("--doc-len", type=int, default=300, help="Mean BM25 words per chunk")
+    parser.add_argument("--text-words", type=int, default=200, help="Stored words per chunk text")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=25)
+    parser.add_argument("--work-dir", type=Path, help="Where bundles are built (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the built bundles")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path,
+                        default=Path(__file__).parent.parent / "data" / "evals" / "bench_retrieval.json")
+    args = parser.parse_args()
+
+    from src.config import settings
+    from src.rag.chunkstore import read_manifest
+
+    base_protocols, chunks_per_protocol = args.base_protocols, args.chunks_per_protocol
+    if args.base_from_index:
+        manifest = read_manifest()
+        if manifest is None or "chunks" not in manifest:
+            sys.exit(f"No index bundle in {settings.index_dir}")
+        base_protocols = manifest["chunks"]["n_protocols"]
+        chunks_per_protocol = manifest["chunks"]["n_chunks"] / base_protocols
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="bench_retrieval_"))
+    report = []
+    try:
+        for scale in args.scales:
+            row = bench_scale(scale, args, base_protocols, chunks_per_protocol, work_dir)
+            report.append(row)
+            logger.info(json.dumps(row))
+    finally:
+        if not args.keep and args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    names = list(report[0]["stages"]) if report else []
+    print(f"\n{'scale':>6} {'chunks':>9} {'load s':>7} " + " ".join(f"{n[:14]:>14}" for n in names))
+    for row in report:
+        load = sum(row["load_s"].values())
+        p50s = " ".join(f"{row['stages'][n]['p50_ms']:>14.3f}" for n in names)
+        print(f"{row['scale']:>5}× {row['n_chunks']:>9} {load:>7.3f} {p50s}")
+    print("(p50 ms per call)")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({
+        "base_protocols": base_protocols,
+        "chunks_per_protocol": round(chunks_per_protocol, 2),
+        "top_k": args.top_k,
+        "queries": args.queries,
+        "results": report,
+    }, indent=2), encoding="utf-8")
+    logger.info(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
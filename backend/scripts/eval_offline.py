@@ -0,0 +1,234 @@
+"""
+eval_offline.py — Run the data/test_set evaluation in-process, without HTTP.
+Run from backend/:
+
+    uv run python scripts/eval_offline.py -n FCB
+    uv run python scripts/eval_offline.py -n FCB_retrieval --retrieval-only
+    uv run python scripts/eval_offline.py -n FCB -b 64 -c 16 --no-llm-cache
+    uv run python scripts/eval_offline.py -n FCB_compressed --prompt-compression on
+
+Test files are streamed through RAGPipeline in batches: each batch is embedded,
+searched and re-ranked in one vectorised pass (RAGPipeline.retrieve_batch),
+then its LLM calls run concurrently. Output files use the same formats as
+../evaluate.py (<name>.jsonl and <name>_metrics.json), so results are directly
+comparable with HTTP runs.
+
+Per-case latency is the batch retrieval time divided by the batch size plus
+the case's own LLM time — the CPU cost of a case, not the wall time an HTTP
+client would see.
+
+LLM runs with prompt compression on (or with --prompt-tokens) also report
+prompt size: mean tokens of the full prompt and of the prompt actually sent
+(after query-aware compression, see src/rag/compression.py), counted with the
+embedding model's tokenizer and stored as "prompt_tokens" in the metrics
+file. Compare the accuracy of an `--prompt-compression off` and an `on` run
+to see what the reduction costs.
+
+Results go to backend/data/evals, next to the HTTP runs of ../evaluate.py.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+# Allow imports from backend/src and the repo-root evaluate.py
+BACKEND = Path(__file__).parent.parent
+ROOT = BACKEND.parent
+sys.path.insert(0, str(BACKEND))
+sys.path.insert(1, str(ROOT))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+def load_cases(dataset_dir: Path) -> list[dict]:
+    cases = []
+    for path in sorted(dataset_dir.glob("*.json")):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if data["gt"] not in data["icd_codes"]:
+            raise ValueError(f"Dataset error in {path.name}: gt '{data['gt']}' not in icd_codes")
+        cases.append(data)
+    return cases
+
+
+class PromptTokens:
+    """Prompt size per case with and without compression (embedding-model tokenizer)."""
+
+    def __init__(self, pipeline):
+        from transformers import AutoTokenizer
+        from src.config import settings
+
+        self.pipeline = pipeline
+        self.tokenizer = AutoTokenizer.from_pretrained(settings.embed_model)
+        self.full: list[int] = []
+        self.sent: list[int] = []
+
+    def _count(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+
+    def add(self, query: str, q_vec, chunks: list[dict], top_n: int):
+        from src.rag.prompt import build_prompt
+
+        self.full.append(self._count(build_prompt(query, chunks, top_n=top_n)))
+        prompt_chunks = self.pipeline.prompt_chunks(q_vec, chunks)
+        self.sent.append(self._count(build_prompt(query, prompt_chunks, top_n=top_n)))
+
+    def summary(self) -> dict:
+        full, sent = sum(self.full), sum(self.sent)
+        n = max(len(self.full), 1)
+        return {
+            "compression": self.pipeline.compressor is not None,
+            "mean_full": round(full / n, 1),
+            "mean_sent": round(sent / n, 1),
+            "reduction_percent": round(100 * (1 - sent / full), 2) if full else 0.0,
+        }
+
+
+def score_case(case: dict, response: dict, latency_s: float):
+    """Same scoring as evaluate.evaluate_single."""
+    from evaluate import EvaluationResult
+
+    diagnoses = sorted(response["diagnoses"], key=lambda x: x["rank"])
+    top_3_predictions = [d["icd10_code"] for d in diagnoses[:3]]
+    top_prediction = diagnoses[0]["icd10_code"] if diagnoses else ""
+    valid_icd_codes = set(case["icd_codes"])
+    return EvaluationResult(
+        protocol_id=case["protocol_id"],
+        accuracy_at_1=1 if top_prediction == case["gt"] else 0,
+        recall_at_3=1 if any(code in valid_icd_codes for code in top_3_predictions) else 0,
+        latency_s=latency_s,
+        ground_truth=case["gt"],
+        top_prediction=top_prediction,
+        top_3_predictions=top_3_predictions,
+        response_json=response,
+    )
+
+
+async def evaluate_batch(pipeline, cases: list[dict], args, semaphore: asyncio.Semaphore, prompt_tokens=None):
+    """Vectorised retrieval for the batch, then concurrent LLM calls. Returns (results, errors)."""
+    from src.rag.pipeline import retrieval_diagnoses
+
+    queries = [c["query"] for c in cases]
+    t0 = time.perf_counter()
+    q_vecs, chunk_lists = await pipeline.retrieve_batch(queries)
+    retrieval_s = (time.perf_counter() - t0) / len(cases)
+
+    if args.retrieval_only:
+        return [
+            score_case(case, retrieval_diagnoses(case["query"], chunks).model_dump(), retrieval_s)
+            for case, chunks in zip(cases, chunk_lists)
+        ], []
+
+    results, errors = [], []
+
+    async def _one(case: dict, q_vec, chunks: list[dict]):
+        if prompt_tokens is not None:
+            prompt_tokens.add(case["query"], q_vec, chunks, args.top_n)
+        async with semaphore:
+            t1 = time.perf_counter()
+            try:
+                response = await pipeline.answer(
+                    case["query"], q_vec, chunks, top_n=args.top_n, use_cache=not args.no_llm_cache
+                )
+            except Exception as e:
+                errors.append((case["protocol_id"], e))
+                return
+            results.append(score_case(case, response.model_dump(), retrieval_s + time.perf_counter() - t1))
+
+    await asyncio.gather(*[_one(c, v, ch) for c, v, ch in zip(cases, q_vecs, chunk_lists)])
+    return results, errors
+
+
+async def run(args) -> tuple[list, list, dict | None]:
+    from tqdm import tqdm
+    from src.config import settings
+    from src.rag.pipeline import RAGPipeline
+
+    if args.prompt_compression:
+        settings.prompt_compression = args.prompt_compression == "on"
+    pipeline = RAGPipeline()
+    if not pipeline.load_indexes():
+        raise SystemExit("Indexes not loaded — run scripts/index_corpus.py first.")
+    pipeline.cache.max_entries = 0  # every case goes through retrieval + LLM
+    if settings.prompt_compression and pipeline.compressor is None:
+        raise SystemExit("Prompt compression needs the sentence index — run scripts/index_corpus.py --sentences.")
+    # Loading the tokenizer is only worth it when there is a reduction to report, or on request
+    count_tokens = settings.prompt_compression or args.prompt_tokens
+    prompt_tokens = PromptTokens(pipeline) if count_tokens and not args.retrieval_only else None
+
+    cases = load_cases(args.dataset_dir)[: args.limit or None]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results, errors = [], []
+    with tqdm(total=len(cases), desc="Evaluating") as bar:
+        for start in range(0, len(cases), args.batch_size):
+            batch = cases[start:start + args.batch_size]
+            batch_results, batch_errors = await evaluate_batch(pipeline, batch, args, semaphore, prompt_tokens)
+            results.extend(batch_results)
+            errors.extend(batch_errors)
+            bar.update(len(batch))
+    return results, errors, prompt_tokens.summary() if prompt_tokens is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process evaluation over data/test_set")
+    parser.add_argument("-n", "--name", required=True, help="Run name (used for output file naming)")
+    parser.add_argument("-d", "--dataset-dir", type=Path, default=ROOT / "data" / "test_set")
+    parser.add_argument("-o", "--output-dir", type=Path, default=BACKEND / "data" / "evals")
+    parser.add_argument("-b", "--batch-size", type=int, default=32, help="Cases per retrieval batch")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="Concurrent LLM calls")
+    parser.add_argument("--top-n", type=int, default=5, help="Diagnoses requested per case")
+    parser.add_argument("--limit", type=int, default=0, help="Only the first N test files")
+    parser.add_argument("--retrieval-only", action="store_true",
+                        help="Skip the LLM; rank ICD codes from retrieval alone (the deadline fallback)")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Bypass the persistent LLM cache")
+    parser.add_argument("--prompt-compression", choices=["on", "off"],
+                        help="Override PROMPT_COMPRESSION (query-aware sentence selection) for this run")
+    parser.add_argument("--prompt-tokens", action="store_true",
+                        help="Report prompt tokens even with compression off (loads the embedding tokenizer)")
+    args = parser.parse_args()
+
+    from evaluate import compute_metrics, write_jsonl, write_metrics_json
+
+    if not args.dataset_dir.is_dir():
+        logger.error(f"Dataset directory '{args.dataset_dir}' does not exist")
+        return 1
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    results, errors, prompt_tokens = asyncio.run(run(args))
+    wall_s = time.perf_counter() - t0
+
+    for protocol_id, err in errors[:5]:
+        logger.warning(f"{protocol_id}: {err}")
+    if errors:
+        logger.warning(f"{len(errors)} cases failed")
+    if not results:
+        logger.error("No results")
+        return 1
+
+    results.sort(key=lambda r: r.protocol_id)
+    output_jsonl = args.output_dir / f"{args.name}.jsonl"
+    output_json = args.output_dir / f"{args.name}_metrics.json"
+    metrics = compute_metrics(results)
+    if prompt_tokens is not None:
+        metrics["prompt_tokens"] = prompt_tokens
+    write_jsonl(results, output_jsonl)
+    write_metrics_json(args.name, metrics, output_json)
+
+    print(f"\n{args.name}: {metrics['total_protocols']} cases in {wall_s:.1f}s"
+          f"{' (retrieval only)' if args.retrieval_only else ''}")
+    print(f"  Accuracy@1 {metrics['accuracy_at_1_percent']:.2f}%   Recall@3 {metrics['recall_at_3_percent']:.2f}%")
+    print(f"  latency p50 {metrics['latency_p50_s']:.3f}s  p95 {metrics['latency_p95_s']:.3f}s")
+    if prompt_tokens is not None:
+        print(f"  prompt tokens {prompt_tokens['mean_full']:.0f} full → {prompt_tokens['mean_sent']:.0f} sent"
+              f" ({prompt_tokens['reduction_percent']:.1f}% fewer)")
+    print(f"  → {output_jsonl}\n  → {output_json}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -3,12 +3,15 @@ index_corpus.py — One-time script to parse protocols, chunk, embed, and build
 FAISS + BM25 indexes. Run from the backend/ directory:
 
     uv run python scripts/index_corpus.py [--corpus data/corpus] [--chunk-size 600]
+    uv run python scripts/index_corpus.py --incremental   # only new/changed protocols
+    uv run python scripts/index_corpus.py --sentences     # + sentence index for prompt compression
 
 For GPU-accelerated indexing, run on Colab/Kaggle and upload the index files
 via GitHub Releases (see README).
 """
 
 import argparse
+import hashlib
 import json
 import logging
 import re
@@ -148,37 +151,54 @@ def load_protocols(corpus_path: Path) -> list[dict]:
     return protocols
 
 
-# ── Main ───────────────────────────────────────────────────────────────────────
+# ── Fingerprints (incremental mode) ───────────────────────────────────────────
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--corpus", default="data/corpus", help="Corpus directory")
-    parser.add_argument("--chunk-size", type=int, default=600, help="Chunk size (words)")
-    parser.add_argument("--overlap", type=int, default=100, help="Overlap (words)")
-    args = parser.parse_args()
+# Bump when chunking, filtering or enrichment logic changes, to invalidate every fingerprint
+CHUNKER_VERSION = 1
+FINGERPRINTS_FILE = "fingerprints.json"
 
-    from src.config import settings
-    import faiss
-    import numpy as np
-    import torch
-    from sentence_transformers import SentenceTransformer
-    from rank_bm25 import BM25Okapi
-    import pickle
-    
-    corpus_path = Path(args.corpus)
-    if not corpus_path.exists():
-        corpus_path = settings.corpus_dir
-    if not corpus_path.exists():
-        logger.error(f"Corpus path not found: {corpus_path}")
-        sys.exit(1)
 
-    # Load protocols
-    protocols = load_protocols(corpus_path)
-    if not protocols:
-        logger.error("No protocols found! Check corpus path and file format.")
-        sys.exit(1)
+def protocol_fingerprint(protos: list[dict], chunk_size: int, overlap: int, embed_model: str) -> str:
+    """Hash of everything that determines a protocol's chunks and their embeddings."""
+    payload = json.dumps(
+        [
+            CHUNKER_VERSION, chunk_size, overlap, embed_model,
+            [
+                [p.get("source_file", ""), p.get("title", ""), sorted(p.get("icd_codes", [])), p.get("text", "")]
+                for p in protos
+            ],
+        ],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    # Chunk all protocols
+
+def fingerprint_corpus(protocols: list[dict], chunk_size: int, overlap: int, embed_model: str) -> dict[str, str]:
+    """protocol_id → fingerprint (records sharing a protocol_id are hashed together)."""
+    groups: dict[str, list[dict]] = {}
+    for proto in protocols:
+        groups.setdefault(proto.get("protocol_id", ""), []).append(proto)
+    return {pid: protocol_fingerprint(protos, chunk_size, overlap, embed_model) for pid, protos in groups.items()}
+
+
+def read_fingerprints(index_dir: Path) -> dict[str, str] | None:
+    path = index_dir / FINGERPRINTS_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_fingerprints(index_dir: Path, fingerprints: dict[str, str]):
+    from src.rag.chunkstore import update_manifest, write_text
+
+    write_text(index_dir / FINGERPRINTS_FILE, json.dumps(fingerprints, ensure_ascii=False))
+    update_manifest("fingerprints", {"file": FINGERPRINTS_FILE, "chunker_version": CHUNKER_VERSION}, index_dir)
+
+
+# ── Build ──────────────────────────────────────────────────────────────────────
+
+def chunk_protocols(protocols: list[dict], chunk_size: int, overlap: int) -> list[dict]:
+    """Chunk protocols into the dicts stored in the index (plus 'enriched_chunk' for embedding)."""
     all_chunks: list[dict] = []
     skipped_questionnaire = 0
     for proto in protocols:
@@ -193,7 +213,7 @@ def main():
         all_icds = list(set(icds + found_icds))
 
         idx = 0
-        for chunk in chunk_by_sections(text, args.chunk_size, args.overlap):
+        for chunk in chunk_by_sections(text, chunk_size, overlap):
             if is_questionnaire_chunk(chunk):
                 skipped_questionnaire += 1
                 continue
@@ -212,40 +232,213 @@ def main():
             idx += 1
 
     logger.info(f"Total chunks: {len(all_chunks)} (filtered {skipped_questionnaire} questionnaire chunks)")
+    return all_chunks
+
 
-    # Embed enriched chunks (with protocol metadata for better retrieval)
-    logger.info("Embedding chunks (may take several minutes on CPU)...")
-    from src.rag.embedder import Embedder
-    embedder = Embedder()
-    texts = [c["enriched_chunk"] for c in all_chunks]
-    embeddings = embedder.encode(texts, batch_size=64, is_query=False)
+def embed_chunks(chunks: list[dict]):
+    """Embed enriched chunks (with protocol metadata for better retrieval)."""
+    from src.rag.embedder import get_embedder
+
+    logger.info(f"Embedding {len(chunks)} chunks (may take several minutes on CPU)...")
+    embeddings = get_embedder().encode([c["enriched_chunk"] for c in chunks], batch_size=64, is_query=False)
     logger.info(f"Embeddings shape: {embeddings.shape}")
+    return embeddings
 
-    # Build & save FAISS index
-    index_dir = settings.index_dir
+
+def build_rerank_tokens(store, index_dir: Path, existing: bool):
+    """
+    Tokenize every chunk once with the reranker's tokenizer (see
+    src/rag/chunk_tokens.py). A bundle that already had reranker tokens
+    (`existing`, from the manifest read before the build) is always kept in
+    step, even with the reranker off.
+    """
+    from src.config import settings
+    if not (settings.use_reranker or existing):
+        return
+    from transformers import AutoTokenizer
+    from src.rag.chunk_tokens import ChunkTokens
+
+    tokenizer = AutoTokenizer.from_pretrained(settings.reranker_model)
+    ChunkTokens.build(store, tokenizer, settings.reranker_model).save(index_dir)
+    logger.info("✅ Reranker tokens saved")
+
+
+def build_sentence_index(store, index_dir: Path, args, existing: bool, reuse=None):
+    """
+    Split chunks into sentences and embed them for prompt compression (see
+    src/rag/compression.py). `reuse` holds the sentences of the store's first
+    rows from a previous build, so only the rows after them are embedded; a
+    bundle that already had a sentence index (`existing`) is always kept in step.
+    """
+    from src.config import settings
+    if reuse is None and not (settings.prompt_compression or args.sentences or existing):
+        return
+    from transformers import AutoTokenizer
+    from src.rag.compression import SentenceIndex
+    from src.rag.embedder import get_embedder
+
+    start = len(reuse) if reuse is not None else 0
+    logger.info(f"Embedding sentences of {len(store) - start} chunks for prompt compression...")
+    tokenizer = AutoTokenizer.from_pretrained(settings.embed_model)
+    texts = [store.text(i) for i in range(start, len(store))]
+    built = SentenceIndex.build(texts, get_embedder(), tokenizer, settings.embed_model)
+    (SentenceIndex.concat([reuse, built]) if reuse is not None else built).save(store.signature(), index_dir)
+    logger.info("✅ Sentence index saved")
+
+
+def full_build(protocols: list[dict], args, index_dir: Path):
+    from src.rag.bm25 import BM25Index
+    from src.rag.chunkstore import MANIFEST_FILE, ChunkStore, read_manifest
+    from src.rag.vectorstore import VectorStore
+
+    all_chunks = chunk_protocols(protocols, args.chunk_size, args.overlap)
+    embeddings = embed_chunks(all_chunks)
+
+    # Start a fresh bundle; legacy pickles are superseded by the columnar chunk store.
+    # The old manifest says which optional sections to keep in step, so read it first
+    previous = read_manifest(index_dir) or {}
     index_dir.mkdir(parents=True, exist_ok=True)
-    
+    for stale in (MANIFEST_FILE, FINGERPRINTS_FILE, "metadata.pkl", "bm25.pkl"):
+        (index_dir / stale).unlink(missing_ok=True)
+
+    # Save chunk metadata once, as columns shared by FAISS and BM25
+    store = ChunkStore.from_chunks(all_chunks)
+    store.save(index_dir)
+    logger.info("✅ Chunk store saved")
+    build_rerank_tokens(store, index_dir, existing="rerank_tokens" in previous)
+    build_sentence_index(store, index_dir, args, existing="sentences" in previous)
+
+    # Build & save FAISS index
     logger.info("Building FAISS index...")
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings)
-    faiss.write_index(index, str(index_dir / "faiss.index"))
-    logger.info(f"✅ FAISS index saved: {index.ntotal} vectors (dim={dim})")
+    vs = VectorStore()
+    vs.build(embeddings, store, index_type=args.index_type)
+    vs.save()
+    logger.info(f"✅ FAISS index saved: {vs.index.ntotal} vectors (dim={vs.index.d})")
 
     # Build & save BM25 index
     logger.info("Building BM25 index...")
-    from src.rag.bm25 import _tokenize
-    tokenized = [_tokenize(c.get("chunk", c.get("text", ""))) for c in all_chunks]
-    bm25 = BM25Okapi(tokenized)
-    
-    with open(index_dir / "bm25.pkl", "wb") as f:
-        pickle.dump({"bm25": bm25, "metadata": all_chunks}, f)
-    logger.info(f"✅ BM25 index saved: {len(all_chunks)} documents")
-
-    # Save metadata
-    with open(index_dir / "metadata.pkl", "wb") as f:
-        pickle.dump(all_chunks, f)
-    logger.info("✅ Metadata saved")
+    bm25 = BM25Index()
+    bm25.build(store)
+    bm25.save()
+    logger.info(f"✅ BM25 index saved: {len(store)} documents")
+
+
+def incremental_update(protocols: list[dict], fingerprints: dict[str, str], index_dir: Path, args) -> bool:
+    """
+    Re-embed only new or changed protocols, delete the vectors of changed and
+    removed ones by chunk id, and rewrite chunk metadata and BM25 from the
+    stored chunk text. Returns False when the existing bundle cannot be
+    updated and a full build is needed.
+    """
+    import numpy as np
+    from src.config import settings
+    from src.rag.bm25 import BM25Index
+    from src.rag.chunkstore import ChunkStore, read_manifest
+    from src.rag.compression import SentenceIndex
+    from src.rag.vectorstore import VectorStore
+
+    old = read_fingerprints(index_dir)
+    manifest = read_manifest(index_dir)
+    if old is None or manifest is None or not manifest.get("faiss", {}).get("id_map"):
+        logger.info("No incremental-capable index bundle found — doing a full build.")
+        return False
+    if args.index_type:
+        logger.warning("--index-type is ignored in incremental mode (the existing index is updated).")
+
+    changed = {pid for pid, fp in fingerprints.items() if old.get(pid) != fp}
+    removed = set(old) - set(fingerprints)
+    if not changed and not removed:
+        logger.info("✅ Index is up to date — nothing to re-embed.")
+        return True
+    logger.info(f"Incremental update: {len(changed)} new/changed, {len(removed)} removed protocols")
+
+    # Read into memory rather than through the process-wide mapped ChunkStore:
+    # these files are rewritten below
+    store = ChunkStore.load(index_dir, mmap=False)
+    vs = VectorStore()
+    if not vs.load(mmap=False, store=store):
+        return False
+
+    stale = changed | removed
+    stale_rows = [r for r, p in enumerate(store.protocols) if p["protocol_id"] in stale]
+    keep = ~np.isin(store.protocol, stale_rows)
+    remove_ids = np.asarray(store.ids)[~keep]
+    kept_chunks = [store[i] for i in np.flatnonzero(keep)]
+    kept_ids = np.array(store.ids[keep], dtype="int64")
+    next_id = int(store.ids[-1]) + 1 if len(store) else 0
+    # Kept chunks keep their sentence embeddings (copied out of the mapped files).
+    # A sentence index that does not match the old store is not loaded, and is rebuilt in full.
+    old_sentences = SentenceIndex.load(settings.embed_model, index_dir)
+    kept_sentences = old_sentences.subset(np.flatnonzero(keep)) if old_sentences is not None else None
+    del store, old_sentences
+
+    new_chunks = chunk_protocols([p for p in protocols if p.get("protocol_id", "") in changed], args.chunk_size, args.overlap)
+    embeddings = embed_chunks(new_chunks) if new_chunks else np.empty((0, vs.index.d), dtype="float32")
+    new_ids = np.arange(next_id, next_id + len(new_chunks), dtype="int64")
+
+    store = ChunkStore.from_chunks(kept_chunks + new_chunks, ids=np.concatenate([kept_ids, new_ids]))
+    vs.update(remove_ids, embeddings, new_ids, store)
+
+    store.save(index_dir)
+    vs.save()
+    logger.info(f"✅ FAISS index updated: {vs.index.ntotal} vectors")
+    # Row numbers shift with every update, so token ids are rebuilt for all chunks (no inference)
+    build_rerank_tokens(store, index_dir, existing="rerank_tokens" in manifest)
+    build_sentence_index(store, index_dir, args, existing="sentences" in manifest, reuse=kept_sentences)
+
+    # IDF and average document length are corpus-wide, so BM25 is re-fit from
+    # the stored chunk text — tokenisation only, no model inference
+    bm25 = BM25Index()
+    bm25.build(store)
+    bm25.save()
+    logger.info(f"✅ BM25 index updated: {len(store)} documents")
+    return True
+
+
+# ── Main ───────────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="data/corpus", help="Corpus directory")
+    parser.add_argument("--chunk-size", type=int, default=600, help="Chunk size (words)")
+    parser.add_argument("--overlap", type=int, default=100, help="Overlap (words)")
+    parser.add_argument(
+        "--index-type",
+        choices=["flat", "hnsw", "ivf_flat", "ivf_pq"],
+        help="FAISS index type (default: FAISS_INDEX_TYPE from config)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-embed new/changed protocols and drop removed ones (falls back to a full build)",
+    )
+    parser.add_argument(
+        "--sentences",
+        action="store_true",
+        help="Build the sentence index for prompt compression even if PROMPT_COMPRESSION is off",
+    )
+    args = parser.parse_args()
+
+    from src.config import settings
+
+    corpus_path = Path(args.corpus)
+    if not corpus_path.exists():
+        corpus_path = settings.corpus_dir
+    if not corpus_path.exists():
+        logger.error(f"Corpus path not found: {corpus_path}")
+        sys.exit(1)
+
+    # Load protocols
+    protocols = load_protocols(corpus_path)
+    if not protocols:
+        logger.error("No protocols found! Check corpus path and file format.")
+        sys.exit(1)
+
+    index_dir = settings.index_dir
+    fingerprints = fingerprint_corpus(protocols, args.chunk_size, args.overlap, settings.embed_model)
+    if not (args.incremental and incremental_update(protocols, fingerprints, index_dir, args)):
+        full_build(protocols, args, index_dir)
+    write_fingerprints(index_dir, fingerprints)
 
     logger.info(f"\n✅ Indexing complete! Indexes saved to {index_dir}")
     for f in index_dir.iterdir():
@@ -0,0 +1,247 @@
+"""
+loadgen.py — Open-loop load generator for /diagnose: throughput vs latency
+percentiles at controlled arrival rates. Run from backend/:
+
+    uv run python scripts/loadgen.py --rate 2 --duration 60
+    uv run python scripts/loadgen.py --ramp 0.5:8:6 --duration 30 -o ../data/evals/load_ramp.json
+    uv run python scripts/loadgen.py --concurrency 1 2 4 8 16 --duration 30
+
+Unlike ../evaluate.py, which is closed-loop (a fixed number of requests in
+flight), arrivals here follow a schedule that does not wait for responses:
+Poisson (exponential gaps) or constant spacing at --rate req/s. That is how
+real traffic behaves, so queueing delay and shedding (429/503) show up once the
+rate passes capacity. Latency is measured from each request's *scheduled* send
+time, so a stalled client cannot hide queueing (no coordinated omission).
+
+--ramp START:END:STEPS runs one step per rate, from START to END. --concurrency
+runs closed-loop steps with N back-to-back clients each, for comparison. For a
+run without network, point GPT_OSS_URL at scripts/mock_llm.py.
+
+Queries come from data/test_set/*.json. By default every request sends
+`X-LLM-Cache: bypass` so caches do not flatter the numbers (--cache to allow them).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parent.parent.parent
+
+
+def load_queries(dataset_dir: Path, limit: int | None = None) -> list[str]:
+    queries = []
+    for path in sorted(dataset_dir.glob("*.json")):
+        query = json.loads(path.read_text(encoding="utf-8")).get("query")
+        if query and query.strip():
+            queries.append(query)
+    if not queries:
+        raise SystemExit(f"No test cases found in {dataset_dir}")
+    return queries[:limit] if limit else queries
+
+
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[k - 1]
+
+
+def _ms(seconds: float | None) -> float | None:
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def arrival_times(rate: float, duration_s: float, arrival: str, rng: random.Random) -> list[float]:
+    """Send offsets (seconds from step start) for an open-loop step."""
+    times, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+        if t >= duration_s:
+            return times
+        times.append(t)
+
+
+class Step:
+    """Outcomes of one load step."""
+
+    def __init__(self, label: dict):
+        self.label = label
+        self.latencies: list[float] = []  # successful requests only
+        self.status: dict[str, int] = {}
+        self.degraded = 0
+        self.sent = 0
+        self.t_start = 0.0
+        self.t_end = 0.0
+
+    def record(self, status: str, latency_s: float, degraded: bool = False):
+        self.status[status] = self.status.get(status, 0) + 1
+        if status == "200":
+            self.latencies.append(latency_s)
+            self.degraded += degraded
+
+    def summary(self) -> dict:
+        lat = sorted(self.latencies)
+        wall = max(self.t_end - self.t_start, 1e-9)
+        return {
+            **self.label,
+            "sent": self.sent,
+            "ok": len(lat),
+            "errors": self.sent - len(lat),
+            "status": dict(sorted(self.status.items())),
+            "degraded": self.degraded,
+            "throughput_rps": round(len(lat) / wall, 3),
+            "wall_s": round(wall, 2),
+            "p50_ms": _ms(percentile(lat, 50)),
+            "p95_ms": _ms(percentile(lat, 95)),
+            "p99_ms": _ms(percentile(lat, 99)),
+            "max_ms": _ms(lat[-1] if lat else None),
+        }
+
+
+async def send(client, args, query: str, scheduled: float, step: Step):
+    """One request; latency counts from the scheduled send time."""
+    headers = {} if args.cache else {"X-LLM-Cache": "bypass"}
+    if args.priority:
+        headers["X-Priority"] = args.priority
+    step.sent += 1
+    try:
+        resp = await client.post(args.endpoint, json={"symptoms": query}, headers=headers, timeout=args.timeout)
+        latency = time.perf_counter() - scheduled
+        degraded = False
+        if resp.status_code == 200:
+            degraded = bool(resp.json().get("degraded", False))
+        step.record(str(resp.status_code), latency, degraded)
+    except Exception as e:
+        name = "timeout" if "Timeout" in e.__class__.__name__ else e.__class__.__name__
+        step.record(name, time.perf_counter() - scheduled)
+
+
+async def open_loop_step(client, args, queries: list[str], rate: float, rng: random.Random) -> Step:
+    step = Step({"mode": "open", "arrival": args.arrival, "offered_rps": rate})
+    offsets = arrival_times(rate, args.duration, args.arrival, rng)
+    tasks: set[asyncio.Task] = set()
+    step.t_start = t0 = time.perf_counter()
+    for offset in offsets:
+        delay = t0 + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= args.max_outstanding:
+            step.record("client_overload", 0.0)  # the generator itself is saturated
+            step.sent += 1
+            continue
+        task = asyncio.create_task(send(client, args, rng.choice(queries), t0 + offset, step))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    step.t_end = time.perf_counter()
+    return step
+
+
+async def closed_loop_step(client, args, queries: list[str], concurrency: int, rng: random.Random) -> Step:
+    step = Step({"mode": "closed", "concurrency": concurrency})
+    step.t_start = time.perf_counter()
+    stop_at = step.t_start + args.duration
+
+    async def user():
+        while time.perf_counter() < stop_at:
+            await send(client, args, rng.choice(queries), time.perf_counter(), step)
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    step.t_end = time.perf_counter()
+    return step
+
+
+def print_table(rows: list[dict]):
+    header = f"{'load':>12} {'sent':>6} {'ok':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  non-200"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        load = f"{r['offered_rps']:g} rps" if r["mode"] == "open" else f"{r['concurrency']} users"
+        p50, p95, p99 = ("—" if r[k] is None else f"{r[k]:.0f}" for k in ("p50_ms", "p95_ms", "p99_ms"))
+        bad = {k: v for k, v in r["status"].items() if k != "200"}
+        print(
+            f"{load:>12} {r['sent']:>6} {r['ok']:>6} {r['throughput_rps']:>8.2f} "
+            f"{p50:>9} {p95:>9} {p99:>9}  {bad or ''}"
+        )
+
+
+async def run(args) -> list[dict]:
+    import httpx
+
+    queries = load_queries(Path(args.dataset_dir), args.limit)
+    rng = random.Random(args.seed)
+    if args.concurrency:
+        steps = [("closed", c) for c in args.concurrency]
+    elif args.ramp:
+        start, end, n = args.ramp.split(":")
+        start, end, n = float(start), float(end), int(n)
+        steps = [("open", start + (end - start) * i / max(1, n - 1)) for i in range(n)]
+    else:
+        steps = [("open", args.rate)]
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=args.max_outstanding)
+    results = []
+    async with httpx.AsyncClient(limits=limits) as client:
+        if args.warmup:
+            logger.info(f"Warm-up: {args.warmup} sequential requests")
+            warm = Step({})
+            for q in queries[: args.warmup]:
+                await send(client, args, q, time.perf_counter(), warm)
+        for i, (mode, load) in enumerate(steps):
+            desc = f"{load:g} req/s ({args.arrival})" if mode == "open" else f"{load} concurrent clients"
+            logger.info(f"Step {i + 1}/{len(steps)}: {desc} for {args.duration:g}s")
+            if mode == "open":
+                step = await open_loop_step(client, args, queries, load, rng)
+            else:
+                step = await closed_loop_step(client, args, queries, int(load), rng)
+            results.append(step.summary())
+            s = results[-1]
+            logger.info(f"  → {s['throughput_rps']} req/s ok, p50 {s['p50_ms']} / p95 {s['p95_ms']} / p99 {s['p99_ms']} ms, status {s['status']}")
+            if args.pause and i + 1 < len(steps):
+                await asyncio.sleep(args.pause)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator: throughput vs p50/p95/p99 latency")
+    parser.add_argument("-e", "--endpoint", default="http://127.0.0.1:8080/diagnose")
+    parser.add_argument("-d", "--dataset-dir", default=str(ROOT / "data" / "test_set"))
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--rate", type=float, default=1.0, help="Arrival rate for a single open-loop step (req/s)")
+    load.add_argument("--ramp", help="Open-loop rate ramp START:END:STEPS, e.g. 0.5:8:6")
+    load.add_argument("--concurrency", type=int, nargs="+", help="Closed-loop sweep over client counts")
+    parser.add_argument("--arrival", choices=["poisson", "constant"], default="poisson")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of arrivals per step")
+    parser.add_argument("--pause", type=float, default=2.0, help="Idle seconds between steps")
+    parser.add_argument("--warmup", type=int, default=3, help="Sequential requests before the first step")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request client timeout (s)")
+    parser.add_argument("--max-outstanding", type=int, default=2000,
+                        help="Cap on in-flight requests; arrivals beyond it count as client_overload")
+    parser.add_argument("--priority", choices=["interactive", "bulk"], help="Send X-Priority with every request")
+    parser.add_argument("--cache", action="store_true", help="Allow LLM/response cache hits (default: bypass)")
+    parser.add_argument("--limit", type=int, help="Use only the first N test cases as queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the per-step results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print()
+    print_table(results)
+    if args.output:
+        out = Path(args.output)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"endpoint": args.endpoint, "steps": results}, indent=2), encoding="utf-8")
+        logger.info(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
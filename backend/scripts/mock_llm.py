@@ -0,0 +1,204 @@
+"""
+mock_llm.py — Local OpenAI-compatible chat-completions server for load tests
+without network access. Run from backend/:
+
+    uv run python scripts/mock_llm.py --port 9000 --ttft-ms 800 --ttft-dist lognormal --itl-ms 10
+    GPT_OSS_URL=http://127.0.0.1:9000/v1 GPT_OSS_API_KEY=mock uv run python -m src.serve
+
+Serves POST /chat/completions and /v1/chat/completions, both plain and
+`stream: true` (SSE). Latency is modelled as a time to first token drawn from
+--ttft-dist, plus --itl-ms per output token, so a streamed and a
+non-streamed call take the same time. The answer is valid diagnosis JSON. It
+takes the ICD-10 codes the prompt lists under each retrieved protocol, in
+prompt order, so end-to-end runs behave like a retrieval-only baseline.
+Pad explanations with --output-tokens to model longer generations.
+
+--error-rate injects upstream failures. --max-concurrency returns 429 above a
+concurrency limit, like a rate-limited provider. Given the same --seed, the
+sequence of sampled latencies is reproducible.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+import uuid
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+PROTOCOL_RE = re.compile(r"### Протокол: (?P<name>[^\n]*)\nКоды МКБ-10: (?P<codes>[^\n]*)")
+TOP_N_RE = re.compile(r"до (\d+) наиболее вероятных")
+CHARS_PER_TOKEN = 4  # rough, for usage counts and stream chunking
+
+
+def answer_from_prompt(prompt: str, output_tokens: int) -> str:
+    """Diagnosis JSON built from the protocols and codes listed in the prompt."""
+    m = TOP_N_RE.search(prompt)
+    top_n = int(m.group(1)) if m else 3
+    diagnoses = []
+    seen: set[str] = set()
+    for p in PROTOCOL_RE.finditer(prompt):
+        for code in (c.strip() for c in p.group("codes").split(",")):
+            if code and code != "—" and code not in seen:
+                seen.add(code)
+                diagnoses.append({
+                    "rank": len(diagnoses) + 1,
+                    "diagnosis": p.group("name").strip(),
+                    "icd10_code": code,
+                    "explanation": "[Mock LLM] Код из найденного протокола.",
+                })
+                break  # one code per protocol, in retrieval order
+        if len(diagnoses) >= top_n:
+            break
+    content = json.dumps({"diagnoses": diagnoses}, ensure_ascii=False)
+    missing = output_tokens * CHARS_PER_TOKEN - len(content)
+    if missing > 0 and diagnoses:
+        diagnoses[-1]["explanation"] += " " + "ж" * missing
+        content = json.dumps({"diagnoses": diagnoses}, ensure_ascii=False)
+    return content
+
+
+class LatencyModel:
+    def __init__(self, dist: str, ttft_ms: float, sigma: float, itl_ms: float, seed: int):
+        import numpy as np
+
+        self.dist = dist
+        self.ttft_s = ttft_ms / 1000.0
+        self.sigma = sigma
+        self.itl_s = itl_ms / 1000.0
+        self._rng = np.random.default_rng(seed)
+
+    def ttft(self) -> float:
+        if self.dist == "fixed":
+            return self.ttft_s
+        if self.dist == "exponential":
+            return float(self._rng.exponential(self.ttft_s))
+        # lognormal with median ttft_s
+        return float(self.ttft_s * self._rng.lognormal(0.0, self.sigma))
+
+
+def create_app(args):
+    import random
+
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI(title="Mock OpenAI-compatible LLM")
+    latency = LatencyModel(args.ttft_dist, args.ttft_ms, args.ttft_sigma, args.itl_ms, args.seed)
+    errors = random.Random(args.seed + 1)
+    state = {"in_flight": 0, "requests": 0, "errors": 0, "rate_limited": 0}
+
+    def usage(prompt: str, content: str) -> dict:
+        p, c = len(prompt) // CHARS_PER_TOKEN, len(content) // CHARS_PER_TOKEN
+        return {"prompt_tokens": p, "completion_tokens": c, "total_tokens": p + c}
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state["requests"] += 1
+        if args.max_concurrency and state["in_flight"] >= args.max_concurrency:
+            state["rate_limited"] += 1
+            return JSONResponse({"error": {"message": "Rate limit exceeded", "type": "rate_limit"}},
+                                status_code=429, headers={"Retry-After": "1"})
+        if errors.random() < args.error_rate:
+            state["errors"] += 1
+            return JSONResponse({"error": {"message": "Injected upstream error", "type": "server_error"}},
+                                status_code=args.error_status)
+
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        content = answer_from_prompt(prompt, args.output_tokens)
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        ttft = latency.ttft()
+
+        if not body.get("stream"):
+            state["in_flight"] += 1
+            try:
+                await asyncio.sleep(ttft + latency.itl_s * (len(content) / CHARS_PER_TOKEN))
+            finally:
+                state["in_flight"] -= 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage(prompt, content),
+            }
+
+        def chunk(delta: dict, finish_reason: str | None = None) -> str:
+            return "data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }, ensure_ascii=False) + "\n\n"
+
+        async def events():
+            state["in_flight"] += 1
+            try:
+                await asyncio.sleep(ttft)
+                yield chunk({"role": "assistant", "content": ""})
+                for start in range(0, len(content), CHARS_PER_TOKEN):
+                    if latency.itl_s:
+                        await asyncio.sleep(latency.itl_s)
+                    yield chunk({"content": content[start:start + CHARS_PER_TOKEN]})
+                yield chunk({}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+            finally:
+                state["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    for path in ("/chat/completions", "/v1/chat/completions"):
+        app.add_api_route(path, chat_completions, methods=["POST"])
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def stats():
+        return state
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server with configurable latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft-dist", choices=["fixed", "exponential", "lognormal"], default="lognormal",
+                        help="Distribution of time to first token")
+    parser.add_argument("--ttft-ms", type=float, default=800.0,
+                        help="Fixed value, exponential mean, or lognormal median (ms)")
+    parser.add_argument("--ttft-sigma", type=float, default=0.5, help="Lognormal shape (σ of log latency)")
+    parser.add_argument("--itl-ms", type=float, default=10.0, help="Inter-token latency (ms per output token)")
+    parser.add_argument("--output-tokens", type=int, default=0,
+                        help="Pad answers to at least this many tokens (0 = natural length)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Answer 429 above this many in-flight requests (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logger.info(
+        f"Mock LLM on http://{args.host}:{args.port}/v1 — ttft {args.ttft_dist} {args.ttft_ms:.0f}ms, "
+        f"itl {args.itl_ms:.0f}ms, error rate {args.error_rate:.1%}"
+    )
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,25 @@ class Settings(BaseSettings):
     gpt_oss_model: str = "oss-120b"
     mock_llm: bool = False  # Set to true for retrieval-only fallback
 
+    # Upstream LLM HTTP client (one pooled client per process)
+    llm_max_connections: int = 32
+    llm_max_keepalive: int = 16
+    llm_keepalive_expiry_s: float = 60.0
+    llm_http2: bool = True
+    llm_connect_timeout_s: float = 5.0
+    llm_read_timeout_s: float = 120.0  # above the slowest observed completion (~64 s)
+    llm_max_retries: int = 2  # on connection errors and 408/429/5xx; read timeouts only when opening a stream
+    llm_retry_base_s: float = 0.5
+    llm_retry_max_s: float = 8.0
+    # Hedged requests: a completion still pending at the llm_hedge_percentile of
+    # recent upstream latency gets a duplicate; the first to finish wins
+    llm_hedge: bool = False
+    llm_hedge_percentile: float = 0.95
+    llm_hedge_min_delay_s: float = 2.0  # floor on the percentile-based delay
+    llm_hedge_cold_delay_s: float = 30.0  # delay until llm_hedge_min_samples are seen (completions take ~14–64 s)
+    llm_hedge_min_samples: int = 20
+    llm_hedge_max_ratio: float = 0.05  # hedges per upstream call, at most (extra load cap)
+
     # Paths
     index_dir: Path = BASE_DIR / "data" / "index"
     corpus_dir: Path = BASE_DIR / "data" / "corpus"
@@ -22,18 +41,101 @@ class Settings(BaseSettings):
     # Embedding model (multilingual-e5-base: ~1.1GB, strong multilingual retrieval)
     embed_model: str = "intfloat/multilingual-e5-base"
     
+    # Inference backend for embedder + reranker: torch | onnx (falls back to torch)
+    inference_backend: str = "torch"
+    onnx_dir: Path = BASE_DIR / "data" / "onnx"  # exported models, created on first use
+    onnx_quantize: bool = True  # dynamic int8 weights
+    onnx_intra_op_threads: int = 0  # 0 → ONNX Runtime default (one per physical core)
+    onnx_inter_op_threads: int = 1
+
+    # Query micro-batching (concurrent /diagnose calls share one encode call)
+    embed_batch_max_size: int = 16
+    embed_batch_max_wait_ms: float = 5.0
+
     # Chunking parameters
     chunk_size: int = 512  # tokens (words)
     chunk_overlap: int = 80
     
+    # Dense index type: flat (exact) | hnsw | ivf_flat | ivf_pq
+    faiss_index_type: str = "flat"
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 128
+    ivf_nlist: int = 0  # 0 → ~4·sqrt(n_vectors), capped by training set size
+    ivf_nprobe: int = 16
+    pq_m: int = 16  # sub-quantizers for ivf_pq (must divide the embedding dim)
+    pq_nbits: int = 8
+
     # Retrieval parameters
     top_k: int = 25  # chunks per retriever (more candidates for better protocol coverage)
     top_n_diag: int = 5  # diagnoses returned
     rrf_k: int = 60  # RRF constant
+    # Dense + sparse fusion: rrf (ranks) | minmax | zscore (per-query normalised scores)
+    fusion_mode: str = "rrf"
+    fusion_dense_weight: float = 1.0
+    fusion_sparse_weight: float = 1.0
+    # Chunk → protocol score pooling: max | sum | mean_top_m
+    protocol_pooling: str = "max"
+    protocol_pool_top_m: int = 3
+
+    # Query-aware prompt compression: only the context sentences closest to the
+    # query (sentence embeddings from the index bundle) within a token budget
+    prompt_compression: bool = False
+    prompt_token_budget: int = 1200  # context tokens, embedding-model tokenizer
+    prompt_min_sentences_per_protocol: int = 2
     
     # Reranker (cross-encoder for improved Accuracy@1)
     use_reranker: bool = True  # Enable cross-encoder reranker
     reranker_model: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    rerank_batch_pairs: int = 64  # max (query, chunk) pairs per cross-encoder forward pass
+    rerank_max_requests: int = 8  # in-flight requests merged into one scheduler dispatch
+    rerank_max_wait_ms: float = 10.0
+
+    # Response cache in front of /diagnose (0 entries disables it)
+    response_cache_size: int = 1024
+    response_cache_ttl_s: float = 3600.0
+    response_cache_similarity: float = 0.0  # >0 enables near-duplicate hits, e.g. 0.97 cosine
+
+    # Persistent LLM completion cache (SQLite/WAL, shared by all workers)
+    llm_cache_enabled: bool = True
+    llm_cache_path: Path = BASE_DIR / "data" / "cache" / "llm_cache.sqlite"
+    llm_cache_max_mb: float = 256.0
+
+    # Observability
+    timing_log: bool = False  # log one JSON line of per-stage timings per request
+
+    # Per-request deadline (X-Deadline-S header overrides; 0 = none). When the LLM
+    # misses it, /diagnose* answer from retrieval only and flag `degraded`. Off by
+    # default so evaluation runs always measure the LLM; deployments opt in.
+    request_deadline_s: float = 0.0
+    # LLM calls that may keep running past their deadline so their answer still
+    # warms the caches. They hold no admission slot, so keep this small; 0 cancels
+    # every call at its deadline.
+    request_deadline_late_llm_max: int = 0
+
+    # Admission control for /diagnose* (0 in-flight disables it). Requests beyond
+    # the limit wait in a bounded queue per lane; full queue → 429, waited too
+    # long → 503, both with Retry-After. Lane via `X-Priority: interactive|bulk`.
+    admission_max_in_flight: int = 32
+    admission_bulk_max_in_flight: int = 16  # bulk never takes every slot
+    admission_queue_interactive: int = 64
+    admission_queue_bulk: int = 256
+    admission_queue_timeout_interactive_s: float = 10.0
+    admission_queue_timeout_bulk_s: float = 120.0
+
+    # /diagnose/batch
+    batch_max_items: int = 512
+    batch_llm_concurrency: int = 8  # concurrent upstream LLM calls per batch
+
+    # Multi-worker serving (python -m src.serve): load once in the master, then fork
+    serve_host: str = "0.0.0.0"
+    serve_port: int = 8080
+    serve_workers: int = 1  # 0 → one per CPU core
+    torch_threads_per_worker: int = 0  # 0 → CPU cores ÷ workers
+
+    # Executors (keep torch/FAISS/BM25 work off the asyncio event loop)
+    cpu_workers: int = 4  # thread pool for GIL-releasing torch/FAISS calls
+    bm25_process_workers: int = 0  # >0 moves BM25 scoring into a process pool
 
     class Config:
         env_file = ".env"
@@ -1,16 +1,25 @@
 """FastAPI application: POST /diagnose + serves Astro static build."""
+import json
 import logging
 import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from src.config import settings
-from src.models import DiagnoseRequest, DiagnoseResponse
-from src.rag import pipeline
+from src.models import (
+    DiagnoseBatchItem,
+    DiagnoseBatchRequest,
+    DiagnoseBatchResponse,
+    DiagnoseRequest,
+    DiagnoseResponse,
+)
+from src.rag import executor, llm, pipeline, timing
+from src.rag.admission import AdmissionRejected, get_admission, lane_for
 from src.rag.embedder import get_embedder
 from src.rag.vectorstore import get_vectorstore
 from src.rag.bm25 import get_bm25
@@ -34,6 +43,9 @@ async def lifespan(app: FastAPI):
     get_embedder()
     get_vectorstore()
     get_bm25()
+    # Start executors so the first request does not pay for pool start-up
+    executor.get_thread_pool()
+    executor.get_process_pool()
     # Try to initialize pipeline
     ok = pipeline_instance.load_indexes()
     if not ok:
@@ -45,6 +57,8 @@ async def lifespan(app: FastAPI):
     logger.info(f"Startup complete in {elapsed:.1f}s")
     yield
     logger.info("Shutting down.")
+    executor.shutdown()
+    await llm.aclose()
 
 
 app = FastAPI(
@@ -54,6 +68,16 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -62,6 +86,23 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """Per-request stage timings → Server-Timing header, latency histogram, optional JSON log."""
+    timings = timing.start_request()
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - t0
+    # Route template rather than raw path, so static files don't explode label cardinality
+    route = request.scope.get("route")
+    path = getattr(route, "path", "other")
+    # For streaming responses this covers the stages done before the first byte
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    timing.request_seconds.observe(total, method=request.method, path=path, status=response.status_code)
+    timing.log_request(request.method, path, response.status_code, total, timings)
+    return response
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint with pipeline status."""
@@ -71,16 +112,43 @@ async def health():
     }
 
 
+@app.get("/stats")
+async def stats():
+    """Batching queue depths, admission queues and throughput counters."""
+    return {**pipeline_instance.stats(), "admission": get_admission().stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of latency histograms and admission queue metrics."""
+    body = timing.render_metrics() + "\n".join(get_admission().render_metrics()) + "\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.post("/diagnose", response_model=DiagnoseResponse)
-async def diagnose(request: DiagnoseRequest):
-    """Diagnose endpoint - uses class-based pipeline if ready, falls back to function-based."""
+async def diagnose(
+    request: DiagnoseRequest,
+    x_llm_cache: str | None = Header(default=None),
+    x_deadline_s: float | None = Header(default=None),
+    x_priority: str | None = Header(default=None),
+):
+    """Diagnose endpoint - uses class-based pipeline if ready, falls back to function-based.
+
+    Send `X-LLM-Cache: bypass` to force a fresh LLM call (the new completion is still cached).
+    `X-Deadline-S` overrides the request deadline (0 disables it).
+    `X-Priority: bulk` queues the request behind interactive traffic."""
     if not request.symptoms or not request.symptoms.strip():
         raise HTTPException(status_code=422, detail="symptoms field must not be empty.")
-    
+    use_cache = (x_llm_cache or "").lower() != "bypass"
+    async with get_admission().slot(lane_for(x_priority)):
+        return await _diagnose(request.symptoms, use_cache, x_deadline_s)
+
+
+async def _diagnose(symptoms: str, use_cache: bool, deadline_s: float | None) -> DiagnoseResponse:
     # Use class-based pipeline if ready
     if pipeline_instance.is_ready():
         try:
-            return await pipeline_instance.diagnose(request.symptoms)
+            return await pipeline_instance.diagnose(symptoms, use_cache=use_cache, deadline_s=deadline_s)
         except RuntimeError as e:
             raise HTTPException(status_code=503, detail=str(e))
         except Exception as e:
@@ -89,7 +157,105 @@ async def diagnose(request: DiagnoseRequest):
     else:
         # Fallback to function-based pipeline
         logger.warning("Using function-based pipeline fallback")
-    return await pipeline.diagnose(request.symptoms)
+    return await pipeline.diagnose(symptoms, use_cache=use_cache)
+
+
+@app.post("/diagnose/batch", response_model=DiagnoseBatchResponse)
+async def diagnose_batch(
+    request: DiagnoseBatchRequest,
+    x_llm_cache: str | None = Header(default=None),
+    x_deadline_s: float | None = Header(default=None),
+    x_priority: str | None = Header(default=None),
+):
+    """Triage many cases in one call: vectorised retrieval, then LLM calls under a concurrency limit.
+
+    Admitted in the bulk lane unless `X-Priority: interactive` is sent."""
+    if not request.symptoms:
+        raise HTTPException(status_code=422, detail="symptoms list must not be empty.")
+    if len(request.symptoms) > settings.batch_max_items:
+        raise HTTPException(
+            status_code=422, detail=f"At most {settings.batch_max_items} cases per batch."
+        )
+    if not pipeline_instance.is_ready():
+        raise HTTPException(status_code=503, detail="Pipeline not initialized — indexes not loaded.")
+    use_cache = (x_llm_cache or "").lower() != "bypass"
+
+    try:
+        async with get_admission().slot(lane_for(x_priority, default="bulk")):
+            outcomes = await pipeline_instance.diagnose_batch(
+                request.symptoms, use_cache=use_cache, deadline_s=x_deadline_s
+            )
+    except AdmissionRejected:
+        raise
+    except Exception:
+        logger.exception("Unhandled error in /diagnose/batch")
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+    results = []
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            results.append(DiagnoseBatchItem(index=i, error=str(outcome) or outcome.__class__.__name__))
+        else:
+            results.append(DiagnoseBatchItem(index=i, response=outcome))
+    return DiagnoseBatchResponse(results=results)
+
+
+@app.post("/diagnose/stream")
+async def diagnose_stream(
+    request: DiagnoseRequest,
+    x_llm_cache: str | None = Header(default=None),
+    x_deadline_s: float | None = Header(default=None),
+    x_priority: str | None = Header(default=None),
+):
+    """NDJSON stream: retrieval candidates first, then each diagnosis as soon as the LLM emits it.
+
+    Past the request deadline (`X-Deadline-S` overrides it) a `degraded` event is
+    sent and the remaining diagnoses come from retrieval only."""
+    if not request.symptoms or not request.symptoms.strip():
+        raise HTTPException(status_code=422, detail="symptoms field must not be empty.")
+    use_cache = (x_llm_cache or "").lower() != "bypass"
+    # Admit before the 200 goes out, so a shed request still gets a real 429/503;
+    # the slot is then held until the stream finishes
+    admission = get_admission()
+    lane = lane_for(x_priority)
+    await admission.acquire(lane)
+    t0 = time.perf_counter()
+    released = False
+
+    def release():
+        # From the generator's finally, or the background task if the stream never started
+        nonlocal released
+        if not released:
+            released = True
+            admission.release(lane, time.perf_counter() - t0)
+
+    async def events():
+        try:
+            if pipeline_instance.is_ready():
+                async for event in pipeline_instance.diagnose_stream(
+                    request.symptoms, use_cache=use_cache, deadline_s=x_deadline_s
+                ):
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+            else:
+                logger.warning("Using function-based pipeline fallback")
+                response = await pipeline.diagnose(request.symptoms, use_cache=use_cache)
+                diagnoses = [d.model_dump() for d in response.diagnoses]
+                for d in diagnoses:
+                    yield json.dumps({"event": "diagnosis", "diagnosis": d}, ensure_ascii=False) + "\n"
+                done = {"event": "done", "diagnoses": diagnoses, "cached": False, "degraded": False}
+                yield json.dumps(done, ensure_ascii=False) + "\n"
+        except Exception:
+            logger.exception("Unhandled error in /diagnose/stream")
+            yield json.dumps({"event": "error", "detail": "Internal server error."}) + "\n"
+        finally:
+            release()
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release),
+    )
 
 
 # Serve Astro static build
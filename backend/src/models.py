@@ -12,3 +12,15 @@ class Diagnosis(BaseModel):
 
 class DiagnoseResponse(BaseModel):
     diagnoses: list[Diagnosis]
+    degraded: bool = False  # True when answered from retrieval only (LLM missed the deadline)
+
+class DiagnoseBatchRequest(BaseModel):
+    symptoms: list[str]
+
+class DiagnoseBatchItem(BaseModel):
+    index: int
+    response: Optional[DiagnoseResponse] = None
+    error: Optional[str] = None
+
+class DiagnoseBatchResponse(BaseModel):
+    results: list[DiagnoseBatchItem]
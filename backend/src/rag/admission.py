@@ -0,0 +1,233 @@
+"""Admission control and load shedding for the diagnosis endpoints.
+
+At most `admission_max_in_flight` requests run at once. Further requests wait
+in a bounded FIFO queue per priority lane:
+
+  * interactive — frontend traffic (default); always served first
+  * bulk        — /diagnose/batch and evaluation runs (`X-Priority: bulk`);
+                  capped at `admission_bulk_max_in_flight` running requests so
+                  interactive traffic keeps headroom under a bulk burst
+
+A request is shed instead of queued when its lane's queue is full (429), and
+gives up when it has waited longer than the lane's max queue time (503). Both
+carry a `Retry-After` estimated from recent service times, so clients back off
+instead of piling more work behind requests that will time out anyway.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "bulk")
+
+
+class AdmissionRejected(Exception):
+    """Request shed by admission control; main.py maps it to an HTTP error with Retry-After."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class _LaneStats:
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0  # admitted after waiting
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.abandoned = 0  # client went away while queued
+        self.max_queue_depth = 0
+        self.queue_wait_s = 0.0
+
+
+class AdmissionController:
+    """Bounded in-flight limit with per-lane wait queues (single event loop)."""
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        bulk_max_in_flight: int,
+        queue_limits: dict[str, int],
+        queue_timeouts_s: dict[str, float],
+    ):
+        self.max_in_flight = max_in_flight  # 0 disables admission control
+        self.bulk_max_in_flight = min(bulk_max_in_flight, max_in_flight) if bulk_max_in_flight > 0 else max_in_flight
+        self.queue_limits = queue_limits
+        self.queue_timeouts_s = queue_timeouts_s
+
+        self._queues: dict[str, deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        # Live waiters per lane. A waiter that times out or is cancelled stays in
+        # the deque until _dispatch skips it, so len(queue) overcounts
+        self._waiting: dict[str, int] = {lane: 0 for lane in LANES}
+        self._running: dict[str, int] = {lane: 0 for lane in LANES}
+        self._lanes: dict[str, _LaneStats] = {lane: _LaneStats() for lane in LANES}
+        self._service_s = 1.0  # EWMA of how long an admitted request holds its slot
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._running.values())
+
+    def _has_slot(self, lane: str) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        return lane != "bulk" or self._running["bulk"] < self.bulk_max_in_flight
+
+    def _start(self, lane: str):
+        self._running[lane] += 1
+        self._lanes[lane].admitted += 1
+
+    def _dispatch(self):
+        """Hand free slots to waiters: interactive first, then bulk up to its cap."""
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self._has_slot(lane):
+                fut = queue.popleft()
+                if fut.done():  # timed out or cancelled, not yet removed
+                    continue
+                self._waiting[lane] -= 1
+                self._start(lane)
+                fut.set_result(None)
+
+    def retry_after(self) -> int:
+        """Seconds until a retry has a fair chance: queued work ÷ slots × recent service time."""
+        queued = sum(self._waiting.values())
+        estimate = self._service_s * (queued + 1) / max(1, self.max_in_flight)
+        return min(60, max(1, math.ceil(estimate)))
+
+    async def acquire(self, lane: str = "interactive"):
+        """Take a slot, waiting in the lane's queue; raises AdmissionRejected when shed."""
+        if self.max_in_flight <= 0:
+            return
+        stats = self._lanes[lane]
+        queue = self._queues[lane]
+        if not self._waiting[lane] and self._has_slot(lane):
+            self._start(lane)
+            return
+        if self._waiting[lane] >= self.queue_limits[lane]:
+            stats.rejected_queue_full += 1
+            raise AdmissionRejected(429, f"Server busy: {lane} queue is full.", self.retry_after())
+
+        while queue and queue[0].done():  # drop abandoned waiters at the head
+            queue.popleft()
+        fut = asyncio.get_running_loop().create_future()
+        queue.append(fut)
+        self._waiting[lane] += 1
+        stats.max_queue_depth = max(stats.max_queue_depth, self._waiting[lane])
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait({fut}, timeout=self.queue_timeouts_s[lane])
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(lane, 0.0)  # granted just as the client went away
+            else:
+                fut.cancel()
+                self._waiting[lane] -= 1
+                stats.abandoned += 1
+            raise
+        finally:
+            stats.queue_wait_s += time.perf_counter() - t0
+        if not fut.done():
+            fut.cancel()  # skipped by _dispatch; no need for an O(n) removal
+            self._waiting[lane] -= 1
+            stats.rejected_timeout += 1
+            raise AdmissionRejected(
+                503, f"Server busy: waited {self.queue_timeouts_s[lane]:.0f}s in the {lane} queue.",
+                self.retry_after(),
+            )
+        stats.queued += 1
+
+    def release(self, lane: str = "interactive", held_s: float | None = None):
+        if self.max_in_flight <= 0:
+            return
+        self._running[lane] -= 1
+        if held_s:
+            self._service_s = 0.8 * self._service_s + 0.2 * held_s
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str = "interactive"):
+        """`async with admission.slot(lane):` — hold a slot for the body of a request."""
+        await self.acquire(lane)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(lane, time.perf_counter() - t0)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.max_in_flight > 0,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "service_time_ewma_s": round(self._service_s, 3),
+            "lanes": {
+                lane: {
+                    "running": self._running[lane],
+                    "queue_depth": self._waiting[lane],
+                    "queue_limit": self.queue_limits[lane],
+                    "max_queue_depth": s.max_queue_depth,
+                    "admitted": s.admitted,
+                    "admitted_after_wait": s.queued,
+                    "rejected_queue_full": s.rejected_queue_full,
+                    "rejected_timeout": s.rejected_timeout,
+                    "abandoned": s.abandoned,
+                    "queue_wait_s_total": round(s.queue_wait_s, 3),
+                }
+                for lane, s in self._lanes.items()
+            },
+        }
+
+    def render_metrics(self) -> list[str]:
+        """Queue depth and rejection counters in Prometheus text exposition format."""
+        s = self.stats()
+        lines = [
+            "# HELP admission_in_flight Requests currently holding an admission slot.",
+            "# TYPE admission_in_flight gauge",
+            f"admission_in_flight {s['in_flight']}",
+            "# HELP admission_queue_depth Requests waiting for an admission slot.",
+            "# TYPE admission_queue_depth gauge",
+        ]
+        lines += [f'admission_queue_depth{{lane="{lane}"}} {v["queue_depth"]}' for lane, v in s["lanes"].items()]
+        lines += [
+            "# HELP admission_rejected_total Requests shed by admission control.",
+            "# TYPE admission_rejected_total counter",
+        ]
+        for lane, v in s["lanes"].items():
+            lines.append(f'admission_rejected_total{{lane="{lane}",reason="queue_full"}} {v["rejected_queue_full"]}')
+            lines.append(f'admission_rejected_total{{lane="{lane}",reason="timeout"}} {v["rejected_timeout"]}')
+        return lines
+
+
+def lane_for(priority: str | None, default: str = "interactive") -> str:
+    """Lane from an `X-Priority` header value (unknown values fall back to the default)."""
+    priority = (priority or "").strip().lower()
+    return priority if priority in LANES else default
+
+
+_controller: AdmissionController | None = None
+
+
+def get_admission() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            max_in_flight=settings.admission_max_in_flight,
+            bulk_max_in_flight=settings.admission_bulk_max_in_flight,
+            queue_limits={
+                "interactive": settings.admission_queue_interactive,
+                "bulk": settings.admission_queue_bulk,
+            },
+            queue_timeouts_s={
+                "interactive": settings.admission_queue_timeout_interactive_s,
+                "bulk": settings.admission_queue_timeout_bulk_s,
+            },
+        )
+    return _controller
@@ -0,0 +1,116 @@
+"""Request coalescing: merge concurrent single-item calls into one batched model call."""
+import asyncio
+import logging
+from typing import Any, Callable
+
+from src.rag.executor import run_in_thread
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent coroutines and runs them through a
+    blocking `batch_fn(items) -> results` on the CPU thread pool.
+
+    A batch is dispatched as soon as `max_batch_size` items are queued or
+    `max_wait_ms` has passed since the first item arrived, whichever comes first.
+    Each caller gets back the result at its own position.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[list[Any]], list[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        name: str = "batcher",
+    ):
+        self._batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._has_items: asyncio.Event | None = None
+        self._full: asyncio.Event | None = None
+        self._worker: asyncio.Task | None = None
+
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+        self.max_queue_depth = 0
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or a new event loop (e.g. a fresh asyncio.run in a script)
+            self._loop = loop
+            self._has_items = asyncio.Event()
+            self._full = asyncio.Event()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run(), name=f"{self.name}-worker")
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result."""
+        self._ensure_worker()
+        fut = self._loop.create_future()
+        self._pending.append((item, fut))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await fut
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if len(self._pending) < self.max_batch_size and self.max_wait_s > 0:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.max_wait_s)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            if len(self._pending) < self.max_batch_size:
+                self._full.clear()
+            if not self._pending:
+                self._has_items.clear()
+
+            # Drop callers that gave up while waiting
+            batch = [(item, fut) for item, fut in batch if not fut.done()]
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            try:
+                results = await run_in_thread(self._batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                logger.warning(f"[{self.name}] batch of {len(batch)} failed: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        """Counters for /stats and metrics export."""
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size_seen": self.max_batch_seen,
+        }
@@ -1,13 +1,38 @@
-"""BM25 sparse retriever for exact medical terminology matching."""
+"""BM25 sparse retriever for exact medical terminology matching.
+
+Scoring is BM25Okapi (same parameters and IDF flooring as rank_bm25), but the
+index is stored as term-major posting lists in a CSR matrix whose values are
+precomputed per-(term, doc) BM25 weights. A query is one sparse row-vector
+product that only touches documents containing a query term, and top-k uses
+`argpartition` instead of a full sort of the corpus.
+"""
+import json
 import logging
 import pickle
 import re
 
-from rank_bm25 import BM25Okapi
+import numpy as np
+from scipy import sparse
+
 from src.config import settings
+from src.rag.candidates import Candidates
+from src.rag.chunkstore import ChunkStore, get_chunkstore, read_manifest, save_array, update_manifest, write_text
 
 logger = logging.getLogger(__name__)
 
+# BM25Okapi defaults from rank_bm25 — keep identical for ranking parity
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+BM25_FILES = {
+    "data": "bm25_data.npy",
+    "indices": "bm25_indices.npy",
+    "indptr": "bm25_indptr.npy",
+    "idf": "bm25_idf.npy",
+    "vocab": "bm25_vocab.json",
+}
+
 
 def _tokenize(text: str) -> list[str]:
     """Simple whitespace + lowercase tokenizer; keeps ICD codes intact."""
@@ -17,57 +42,183 @@ def _tokenize(text: str) -> list[str]:
     return [t.strip(".,;:!?()[]") for t in tokens if t.strip(".,;:!?()[]")]
 
 
+def _top_k_row(scores: np.ndarray, docs: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k (docs, scores) of one sparse result row, best first; ties → higher doc index first."""
+    keep = scores > 0
+    scores, docs = scores[keep], docs[keep]
+    if len(scores) > top_k:
+        part = np.argpartition(-scores, top_k - 1)[:top_k]
+        scores, docs = scores[part], docs[part]
+    order = np.lexsort((-docs, -scores))
+    return docs[order], scores[order]
+
+
 class BM25Index:
     def __init__(self):
-        self.bm25 = None
-        self.chunks: list[dict] = []  # parallel to BM25 corpus
+        self.vocab: dict[str, int] = {}
+        self.weights: sparse.csr_matrix | None = None  # (n_terms, n_docs) BM25 weights
+        self.idf: np.ndarray | None = None
+        self.chunks: ChunkStore | None = None  # parallel to BM25 corpus
 
-    def build(self, chunks: list[dict]):
+    def is_loaded(self) -> bool:
+        return self.weights is not None
+
+    def build(self, chunks: ChunkStore | list[dict]):
         """Build BM25 index from chunks."""
         tokenized = [_tokenize(c.get("chunk", c.get("text", ""))) for c in chunks]
-        self.bm25 = BM25Okapi(tokenized)
-        self.chunks = chunks
-        logger.info(f"BM25 index built: {len(chunks)} documents")
+        self.fit(tokenized)
+        self.chunks = chunks if isinstance(chunks, ChunkStore) else ChunkStore.from_chunks(chunks)
+        logger.info(f"BM25 index built: {len(chunks)} documents, {len(self.vocab)} terms")
 
-    def save(self):
-        """Save BM25 index to disk."""
-        bm25_path = settings.index_dir / "bm25.pkl"
-        bm25_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(bm25_path, "wb") as f:
-            pickle.dump({"bm25": self.bm25, "metadata": self.chunks}, f)
-        logger.info(f"BM25 index saved → {bm25_path}")
+    def fit(self, tokenized: list[list[str]]):
+        """Build posting lists from pre-tokenized documents."""
+        vocab: dict[str, int] = {}
+        rows: list[int] = []
+        cols: list[int] = []
+        for doc_id, tokens in enumerate(tokenized):
+            for token in tokens:
+                cols.append(vocab.setdefault(token, len(vocab)))
+            rows.extend([doc_id] * len(tokens))
+        tf = sparse.csr_matrix(
+            (np.ones(len(cols), dtype="float32"), (np.array(rows, dtype="int64"), np.array(cols, dtype="int64"))),
+            shape=(len(tokenized), len(vocab)),
+        )
+        tf.sum_duplicates()
+        self.fit_counts(tf, vocab)
 
-    def load(self) -> bool:
-        """Load BM25 index from disk."""
-        bm25_path = settings.index_dir / "bm25.pkl"
-        if not bm25_path.exists():
-            return False
-        with open(bm25_path, "rb") as f:
-            data = pickle.load(f)
-        self.bm25 = data["bm25"]
-        self.chunks = data.get("metadata", data.get("chunks", []))
-        logger.info(f"BM25 index loaded: {len(self.chunks)} documents")
-        return True
+    def fit_counts(self, tf: sparse.csr_matrix, vocab: dict[str, int]):
+        """
+        Build the weight matrix from a (n_docs, n_terms) term-frequency matrix.
+
+        IDF and document-length normalisation match BM25Okapi: negative IDFs are
+        floored to EPSILON * mean IDF.
+        """
+        tf = sparse.csr_matrix(tf, dtype="float32")
+        n_docs, n_terms = tf.shape
+        doc_len = np.asarray(tf.sum(axis=1), dtype="float64").ravel()
+        avgdl = doc_len.sum() / max(n_docs, 1)
 
-    def search(self, query: str, top_k: int) -> list[dict]:
-        """Search BM25 index and return top_k results."""
-        if self.bm25 is None:
+        df = np.bincount(tf.indices, minlength=n_terms)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if n_terms:
+            idf[idf < 0] = EPSILON * idf.mean()
+
+        norm = K1 * (1 - B + B * doc_len / avgdl) if avgdl > 0 else np.full(n_docs, K1)
+        coo = tf.tocoo()
+        w = idf[coo.col] * coo.data * (K1 + 1) / (coo.data + norm[coo.row])
+        self.weights = sparse.csr_matrix(
+            (w.astype("float32"), (coo.col, coo.row)), shape=(n_terms, n_docs)
+        )
+        self.idf = idf.astype("float32")
+        self.vocab = vocab
+
+    @classmethod
+    def from_okapi(cls, bm25, chunks: list[dict]) -> "BM25Index":
+        """Convert a legacy pickled rank_bm25.BM25Okapi into the sparse engine."""
+        vocab: dict[str, int] = {}
+        rows: list[int] = []
+        cols: list[int] = []
+        data: list[int] = []
+        for doc_id, freqs in enumerate(bm25.doc_freqs):
+            for token, count in freqs.items():
+                cols.append(vocab.setdefault(token, len(vocab)))
+                rows.append(doc_id)
+                data.append(count)
+        tf = sparse.csr_matrix((data, (rows, cols)), shape=(len(bm25.doc_freqs), len(vocab)))
+        index = cls()
+        index.fit_counts(tf, vocab)
+        index.chunks = ChunkStore.from_chunks(chunks)
+        return index
+
+    def _query_matrix(self, queries: list[str]) -> sparse.csr_matrix:
+        """(n_queries, n_terms) query term counts; repeated query terms count repeatedly, as in BM25Okapi."""
+        rows: list[int] = []
+        cols: list[int] = []
+        for q, query in enumerate(queries):
+            for token in _tokenize(query):
+                term = self.vocab.get(token)
+                if term is not None:
+                    rows.append(q)
+                    cols.append(term)
+        return sparse.csr_matrix(
+            (np.ones(len(cols), dtype="float32"), (rows, cols)),
+            shape=(len(queries), len(self.vocab)),
+        )
+
+    def search_rows(self, queries: list[str], top_k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """(chunk rows, scores) per query, best first, from one sparse matrix product."""
+        if self.weights is None:
             raise RuntimeError("BM25 index not loaded. Call load() first.")
-        tokens = _tokenize(query)
-        scores = self.bm25.get_scores(tokens)
-        # Get top-k indices
-        import numpy as np
-        top_indices = np.argsort(scores)[::-1][:top_k]
+        scores = (self._query_matrix(queries) @ self.weights).tocsr()
         results = []
-        for rank, idx in enumerate(top_indices):
-            if scores[idx] <= 0:
-                break
-            chunk = dict(self.chunks[idx])
-            chunk["sparse_score"] = float(scores[idx])
-            chunk["sparse_rank"] = rank
-            results.append(chunk)
+        for q in range(len(queries)):
+            lo, hi = scores.indptr[q], scores.indptr[q + 1]
+            results.append(_top_k_row(scores.data[lo:hi], scores.indices[lo:hi], top_k))
         return results
 
+    def search_batch(self, queries: list[str], top_k: int) -> list[Candidates]:
+        """Score a batch of queries with one sparse matrix product."""
+        return [
+            Candidates(self.chunks, docs, {"sparse": doc_scores})
+            for docs, doc_scores in self.search_rows(queries, top_k)
+        ]
+
+    def save(self):
+        """Save BM25 arrays into the index bundle (chunk metadata is saved by ChunkStore)."""
+        index_dir = settings.index_dir
+        index_dir.mkdir(parents=True, exist_ok=True)
+        save_array(index_dir / BM25_FILES["data"], self.weights.data)
+        save_array(index_dir / BM25_FILES["indices"], self.weights.indices)
+        save_array(index_dir / BM25_FILES["indptr"], self.weights.indptr)
+        save_array(index_dir / BM25_FILES["idf"], self.idf)
+        terms = sorted(self.vocab, key=self.vocab.get)
+        write_text(index_dir / BM25_FILES["vocab"], json.dumps(terms, ensure_ascii=False))
+        update_manifest("bm25", {
+            "n_docs": int(self.weights.shape[1]),
+            "n_terms": int(self.weights.shape[0]),
+            "nnz": int(self.weights.nnz),
+            "k1": K1, "b": B, "epsilon": EPSILON,
+            "files": BM25_FILES,
+        })
+        logger.info(f"BM25 index saved → {index_dir}")
+
+    def load(self) -> bool:
+        """Load BM25 index from the index bundle (memory-mapped), or a legacy bm25.pkl."""
+        index_dir = settings.index_dir
+        manifest = read_manifest()
+        if manifest is not None and "bm25" in manifest:
+            n_terms, n_docs = manifest["bm25"]["n_terms"], manifest["bm25"]["n_docs"]
+            self.weights = sparse.csr_matrix(
+                (
+                    np.load(index_dir / BM25_FILES["data"], mmap_mode="r"),
+                    np.load(index_dir / BM25_FILES["indices"], mmap_mode="r"),
+                    np.load(index_dir / BM25_FILES["indptr"], mmap_mode="r"),
+                ),
+                shape=(n_terms, n_docs),
+                copy=False,
+            )
+            self.idf = np.load(index_dir / BM25_FILES["idf"], mmap_mode="r")
+            terms = json.loads((index_dir / BM25_FILES["vocab"]).read_text(encoding="utf-8"))
+            self.vocab = {t: i for i, t in enumerate(terms)}
+            self.chunks = get_chunkstore()
+        else:
+            bm25_path = index_dir / "bm25.pkl"
+            if not bm25_path.exists():
+                return False
+            with open(bm25_path, "rb") as f:
+                data = pickle.load(f)
+            logger.info("Legacy BM25Okapi pickle found — converting to sparse index.")
+            legacy = BM25Index.from_okapi(data["bm25"], data.get("metadata", data.get("chunks", [])))
+            self.weights, self.vocab, self.idf, self.chunks = (
+                legacy.weights, legacy.vocab, legacy.idf, legacy.chunks
+            )
+        logger.info(f"BM25 index loaded: {len(self.chunks)} documents, {len(self.vocab)} terms")
+        return True
+
+    def search(self, query: str, top_k: int) -> Candidates:
+        """Top-k chunk rows with their 'sparse' BM25 scores."""
+        return self.search_batch([query], top_k)[0]
+
 
 _bm25: BM25Index | None = None
 
@@ -0,0 +1,153 @@
+"""In-process response cache in front of the RAG pipeline.
+
+Entries are keyed on normalised symptom text and the number of diagnoses
+asked for (a top_n=3 answer must not serve a top_n=5 request). Optionally, a miss on the exact
+key falls back to a near-duplicate lookup: cosine similarity between the query
+embedding and the embeddings of cached queries (E5 vectors are L2-normalised,
+so this is a dot product). Eviction is LRU, bounded by size, plus a TTL.
+
+Every request looks up the exact key first (`get`, counted as a hit or a
+miss), and only exact misses go on to `get_similar` (a semantic hit or a
+semantic miss). So `hit_rate` is the share of lookups served from the cache:
+(hits + semantic_hits) / (hits + misses).
+"""
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.config import settings
+from src.models import DiagnoseResponse
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_symptoms(text: str) -> str:
+    """Cache key: NFC, lower-case, single spaces, no trailing punctuation."""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(".,;:!? ")
+
+
+def cache_key(symptoms: str, top_n: int) -> str:
+    return f"{top_n}:{normalize_symptoms(symptoms)}"
+
+
+@dataclass
+class _Entry:
+    response: DiagnoseResponse
+    embedding: np.ndarray | None
+    expires_at: float
+    top_n: int
+
+
+class ResponseCache:
+    """Bounded LRU + TTL cache of final DiagnoseResponse objects."""
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        ttl_s: float | None = None,
+        similarity: float | None = None,
+    ):
+        self.max_entries = settings.response_cache_size if max_entries is None else max_entries
+        self.ttl_s = settings.response_cache_ttl_s if ttl_s is None else ttl_s
+        self.similarity = settings.response_cache_similarity if similarity is None else similarity
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._matrix: np.ndarray | None = None  # stacked embeddings for near-duplicate lookup
+        self._matrix_keys: list[str] = []
+        self._matrix_top_n: np.ndarray | None = None
+
+        self.hits = 0
+        self.misses = 0  # exact-key misses, some of which become semantic hits
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _live(self, key: str) -> _Entry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            del self._entries[key]
+            self._matrix = None
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, symptoms: str, top_n: int) -> DiagnoseResponse | None:
+        """Exact lookup on normalised text."""
+        if not self.enabled:
+            return None
+        entry = self._live(cache_key(symptoms, top_n))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.response.model_copy(deep=True)
+
+    def get_similar(self, embedding: np.ndarray, top_n: int) -> DiagnoseResponse | None:
+        """Near-duplicate lookup by cosine similarity among entries with the same top_n
+        (for exact misses; see the module docstring for how lookups are counted)."""
+        if not self.enabled or self.similarity <= 0:
+            return None
+        if not self._entries:
+            self.semantic_misses += 1
+            return None
+        if self._matrix is None:
+            self._matrix_keys = [k for k, e in self._entries.items() if e.embedding is not None]
+            self._matrix = (
+                np.stack([self._entries[k].embedding for k in self._matrix_keys])
+                if self._matrix_keys else np.empty((0, len(embedding)), dtype="float32")
+            )
+            self._matrix_top_n = np.array([self._entries[k].top_n for k in self._matrix_keys], dtype="int64")
+        if len(self._matrix_keys):
+            sims = np.where(self._matrix_top_n == top_n, self._matrix @ embedding, -np.inf)
+            best = int(np.argmax(sims))
+            if sims[best] >= self.similarity:
+                entry = self._live(self._matrix_keys[best])
+                if entry is not None:
+                    self.semantic_hits += 1
+                    return entry.response.model_copy(deep=True)
+        self.semantic_misses += 1
+        return None
+
+    def put(self, symptoms: str, top_n: int, embedding: np.ndarray | None, response: DiagnoseResponse):
+        if not self.enabled:
+            return
+        key = cache_key(symptoms, top_n)
+        self._entries[key] = _Entry(
+            response=response.model_copy(deep=True),
+            embedding=None if embedding is None else np.asarray(embedding, dtype="float32"),
+            expires_at=time.monotonic() + self.ttl_s,
+            top_n=top_n,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._matrix = None
+
+    def clear(self):
+        self._entries.clear()
+        self._matrix = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "semantic_hits": self.semantic_hits,
+            "semantic_misses": self.semantic_misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,75 @@
+"""Ranked retrieval candidates as compact arrays, materialised lazily.
+
+Retrieval stages pass each other a `Candidates` instead of lists of chunk
+dicts. It holds an int64 array of chunk-store rows plus one array per stage
+score ("dense", "sparse", "rrf" or "fused", "reranker", "protocol_rank").
+Text and protocol metadata stay in the memory-mapped ChunkStore. `chunks()` builds
+dicts, in the shape the prompt, fallback and streaming code expect, only for
+the few candidates left after re-ranking and protocol aggregation.
+"""
+import numpy as np
+
+from src.rag.chunkstore import ChunkStore
+
+# Score array name → key of the materialised chunk dict
+SCORE_FIELDS = {
+    "dense": "dense_score",
+    "sparse": "sparse_score",
+    "rrf": "rrf_score",
+    "fused": "fusion_score",
+    "reranker": "reranker_score",
+    "protocol_rank": "protocol_rank_score",
+}
+
+
+class Candidates:
+    """One query's ranked chunk rows (best first) with their per-stage scores."""
+
+    __slots__ = ("store", "rows", "scores")
+
+    def __init__(self, store: ChunkStore, rows: np.ndarray, scores: dict[str, np.ndarray] | None = None):
+        self.store = store
+        self.rows = np.asarray(rows, dtype="int64")
+        self.scores = scores or {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __repr__(self) -> str:
+        return f"Candidates(n={len(self)}, scores={list(self.scores)})"
+
+    def __getitem__(self, key: slice) -> "Candidates":
+        """Slice (e.g. `cands[:top_k]`); score arrays are sliced alongside the rows."""
+        return Candidates(self.store, self.rows[key], {k: v[key] for k, v in self.scores.items()})
+
+    def take(self, order) -> "Candidates":
+        """Subset / reorder by positions; every score array follows."""
+        order = np.asarray(order, dtype="int64")
+        return Candidates(self.store, self.rows[order], {k: v[order] for k, v in self.scores.items()})
+
+    def with_score(self, name: str, values: np.ndarray) -> "Candidates":
+        return Candidates(self.store, self.rows, {**self.scores, name: np.asarray(values)})
+
+    def rank_scores(self) -> np.ndarray:
+        """The score the current order is based on: cross-encoder if re-ranked, else fusion."""
+        for name in ("reranker", "rrf", "fused", "dense", "sparse"):
+            if name in self.scores:
+                return self.scores[name]
+        return np.zeros(len(self), dtype="float64")
+
+    def protocols(self) -> np.ndarray:
+        """Protocol row (index into store.protocols) of each candidate."""
+        return np.asarray(self.store.protocol[self.rows])
+
+    def text(self, i: int) -> str:
+        return self.store.text(int(self.rows[i]))
+
+    def chunks(self) -> list[dict]:
+        """Chunk dicts with their scores attached (e.g. 'rrf_score'), in candidate order."""
+        out = []
+        for i, row in enumerate(self.rows.tolist()):
+            chunk = self.store[row]
+            for name, values in self.scores.items():
+                chunk[SCORE_FIELDS.get(name, f"{name}_score")] = float(values[i])
+            out.append(chunk)
+        return out
@@ -0,0 +1,196 @@
+"""Cross-encoder token ids for every chunk, precomputed at index time.
+
+Chunks never change between requests, so index_corpus.py tokenizes them once
+with the reranker's tokenizer and stores the ids in the index bundle:
+
+    rerank_tokens.npy    int32 — token ids of all chunks, concatenated (no special tokens)
+    rerank_offsets.npy   int64 (n_chunks + 1) — offsets into rerank_tokens.npy
+
+At request time only the query is tokenized; `PairTemplate` adds the model's
+special tokens around (query, chunk) ids the same way the tokenizer would for
+a text pair, including longest-first truncation.
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from src.config import settings
+from src.rag.chunkstore import ChunkStore, matches_chunks, read_manifest, save_array, update_manifest
+
+logger = logging.getLogger(__name__)
+
+TOKEN_FILES = {
+    "ids": "rerank_tokens.npy",
+    "offsets": "rerank_offsets.npy",
+}
+
+
+def max_pair_length(tokenizer, model_max_length: int | None = None) -> int:
+    # Tokenizers without a limit report a huge sentinel value
+    limit = model_max_length or getattr(tokenizer, "model_max_length", 512) or 512
+    return min(int(limit), 512)
+
+
+def truncate_pair(len_a: int, len_b: int, budget: int) -> tuple[int, int]:
+    """
+    Lengths after the fast tokenizer's 'longest_first' truncation: only the
+    longer side is cut while the shorter fits in half the budget; otherwise
+    each side gets half, the odd token going to the longer one (to the second
+    on a tie).
+    """
+    if len_a + len_b <= budget:
+        return len_a, len_b
+    short, long = min(len_a, len_b), max(len_a, len_b)
+    if 2 * short <= budget:
+        long = budget - short
+    else:
+        short, long = budget // 2, budget - budget // 2
+    return (long, short) if len_a > len_b else (short, long)
+
+
+class PairTemplate:
+    """
+    Special-token layout of a text pair, learned by encoding a probe pair:
+    prefix + A + middle + B + suffix (with token type ids, if the model uses them).
+    Works across tokenizer families (BERT [CLS]/[SEP], XLM-R <s>/</s></s>).
+    """
+
+    def __init__(self, prefix: list[int], middle: list[int], suffix: list[int], types: tuple[int, ...] | None):
+        self.prefix = prefix
+        self.middle = middle
+        self.suffix = suffix
+        self.types = types  # (prefix, A, middle, B, suffix) token types, or None
+        self.n_special = len(prefix) + len(middle) + len(suffix)
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer) -> "PairTemplate":
+        a = tokenizer("a", add_special_tokens=False)["input_ids"]
+        b = tokenizer("b", add_special_tokens=False)["input_ids"]
+        enc = tokenizer("a", "b")
+        ids = list(enc["input_ids"])
+        ia = next(i for i in range(len(ids)) if ids[i:i + len(a)] == a)
+        ib = next(i for i in range(ia + len(a), len(ids)) if ids[i:i + len(b)] == b)
+        types = None
+        if "token_type_ids" in enc:
+            tt = list(enc["token_type_ids"])
+            mid = ia + len(a)
+            end = ib + len(b)
+            types = (
+                tt[0] if ia else tt[ia],           # prefix
+                tt[ia],                            # A
+                tt[mid] if ib > mid else tt[ib],   # middle
+                tt[ib],                            # B
+                tt[end] if len(tt) > end else tt[ib],  # suffix
+            )
+        return cls(ids[:ia], ids[ia + len(a):ib], ids[ib + len(b):], types)
+
+    def build(self, a: list[int], b, max_length: int) -> tuple[list[int], list[int] | None]:
+        """Input ids (and token type ids) for the pair (a, b), truncated to max_length."""
+        len_a, len_b = truncate_pair(len(a), len(b), max_length - self.n_special)
+        b = [int(t) for t in b[:len_b]]
+        ids = self.prefix + a[:len_a] + self.middle + b + self.suffix
+        if self.types is None:
+            return ids, None
+        tp, ta, tm, tb, ts = self.types
+        types = (
+            [tp] * len(self.prefix) + [ta] * len_a + [tm] * len(self.middle)
+            + [tb] * len(b) + [ts] * len(self.suffix)
+        )
+        return ids, types
+
+
+def pad_batch(
+    seqs: list[list[int]], types: list[list[int] | None], pad_id: int, input_names: list[str]
+) -> dict[str, np.ndarray]:
+    """Right-pad a batch to its own longest sequence."""
+    width = max(len(s) for s in seqs)
+    input_ids = np.full((len(seqs), width), pad_id, dtype="int64")
+    attention_mask = np.zeros((len(seqs), width), dtype="int64")
+    token_type_ids = np.zeros((len(seqs), width), dtype="int64")
+    for i, (s, t) in enumerate(zip(seqs, types)):
+        input_ids[i, :len(s)] = s
+        attention_mask[i, :len(s)] = 1
+        if t is not None:
+            token_type_ids[i, :len(t)] = t
+    features = {"input_ids": input_ids, "attention_mask": attention_mask, "token_type_ids": token_type_ids}
+    return {name: features[name] for name in input_names if name in features}
+
+
+class ChunkTokens:
+    """Read-only, memory-mapped token ids per chunk row."""
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, model: str, chunks_signature: str | None = None):
+        self.ids = ids
+        self.offsets = offsets
+        self.model = model
+        self.chunks_signature = chunks_signature  # ChunkStore.signature() of the rows they were built from
+
+    @classmethod
+    def build(cls, store: ChunkStore, tokenizer, model: str, batch_size: int = 1024) -> "ChunkTokens":
+        max_len = max_pair_length(tokenizer)
+        pieces: list[np.ndarray] = []
+        for start in range(0, len(store), batch_size):
+            texts = [store.text(i) for i in range(start, min(start + batch_size, len(store)))]
+            enc = tokenizer(texts, add_special_tokens=False, truncation=False, verbose=False)
+            pieces.extend(np.asarray(ids[:max_len], dtype="int32") for ids in enc["input_ids"])
+        offsets = np.zeros(len(pieces) + 1, dtype="int64")
+        np.cumsum([len(p) for p in pieces], out=offsets[1:])
+        ids = np.concatenate(pieces) if pieces else np.empty(0, dtype="int32")
+        logger.info(f"Reranker tokens built: {len(pieces)} chunks, {len(ids)} tokens")
+        return cls(ids, offsets, model, store.signature())
+
+    def save(self, index_dir: Path | None = None):
+        index_dir = index_dir or settings.index_dir
+        save_array(index_dir / TOKEN_FILES["ids"], self.ids)
+        save_array(index_dir / TOKEN_FILES["offsets"], self.offsets)
+        update_manifest("rerank_tokens", {
+            "model": self.model,
+            "chunks_signature": self.chunks_signature,
+            "n_chunks": len(self),
+            "n_tokens": int(self.offsets[-1]),
+            "files": TOKEN_FILES,
+        }, index_dir)
+
+    @classmethod
+    def load(cls, model: str, index_dir: Path | None = None) -> "ChunkTokens | None":
+        """Mapped token ids, or None if the bundle has none for this reranker model and chunk store."""
+        index_dir = index_dir or settings.index_dir
+        manifest = read_manifest(index_dir)
+        section = (manifest or {}).get("rerank_tokens")
+        if section is None:
+            return None
+        if section["model"] != model:
+            logger.warning(f"Reranker tokens were built for '{section['model']}', not '{model}' — ignoring them.")
+            return None
+        if not matches_chunks(section, index_dir):
+            logger.warning("Reranker tokens do not match the current chunk store — ignoring them. "
+                           "Re-run scripts/index_corpus.py.")
+            return None
+        return cls(
+            np.load(index_dir / TOKEN_FILES["ids"], mmap_mode="r"),
+            np.load(index_dir / TOKEN_FILES["offsets"], mmap_mode="r"),
+            model,
+            section["chunks_signature"],
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, row: int) -> np.ndarray:
+        return self.ids[self.offsets[row]:self.offsets[row + 1]]
+
+
+_tokens: ChunkTokens | None = None
+_loaded = False
+
+
+def get_chunk_tokens() -> ChunkTokens | None:
+    """Singleton token store for settings.reranker_model (None → tokenize chunks per request)."""
+    global _tokens, _loaded
+    if not _loaded:
+        _tokens = ChunkTokens.load(settings.reranker_model)
+        _loaded = True
+        if _tokens is not None:
+            logger.info(f"Reranker tokens mapped: {len(_tokens)} chunks")
+    return _tokens
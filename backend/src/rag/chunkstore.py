@@ -0,0 +1,243 @@
+"""Columnar, memory-mapped chunk metadata shared by the dense and sparse indexes.
+
+Index bundle layout (inside settings.index_dir):
+
+    manifest.json        format version, model, counts and per-component files
+    faiss.index          FAISS index, read with IO_FLAG_MMAP
+    chunks_text.npy      uint8 — UTF-8 chunk texts, concatenated
+    chunks_offsets.npy   int64 (n_chunks + 1) — byte offsets into chunks_text.npy
+    chunks_protocol.npy  int32 — row in protocols.json for each chunk
+    chunks_index.npy     int32 — chunk index within its protocol
+    chunks_id.npy        int64 — stable chunk id (FAISS IndexIDMap2 id), strictly increasing
+    protocols.json       protocol_id, source_file, title, icd_codes per protocol
+    bm25_*.npy/.json     sparse BM25 index (see bm25.py)
+    rerank_*.npy         cross-encoder token ids per chunk (see chunk_tokens.py)
+    sent_*.npy           sentence spans and embeddings per chunk (see compression.py)
+
+Arrays are opened with mmap_mode="r", so loading is near-instant and the OS
+pages chunk text in on demand instead of every worker holding it in Python dicts.
+Files are written to a temporary name and renamed into place (`replacing`), so
+a process that still maps the old file keeps reading the old, intact inode.
+
+Components derived from chunk rows (rerank tokens, sentences) record the chunk
+store's `signature()` and are ignored when it no longer matches.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+CHUNK_FILES = {
+    "text": "chunks_text.npy",
+    "offsets": "chunks_offsets.npy",
+    "protocol": "chunks_protocol.npy",
+    "chunk_index": "chunks_index.npy",
+    "id": "chunks_id.npy",
+    "protocols": "protocols.json",
+}
+
+
+def read_manifest(index_dir: Path | None = None) -> dict | None:
+    """Return the bundle manifest, or None when the index dir has no (supported) bundle."""
+    path = (index_dir or settings.index_dir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    manifest = json.loads(path.read_text(encoding="utf-8"))
+    version = manifest.get("format_version")
+    if version != BUNDLE_VERSION:
+        logger.warning(f"Index bundle version {version} not supported (expected {BUNDLE_VERSION}).")
+        return None
+    return manifest
+
+
+@contextmanager
+def replacing(path: Path):
+    """Yield a temporary path next to `path`; on success it is renamed over `path`."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def save_array(path: Path, array: np.ndarray):
+    """np.save, replacing the file atomically (never truncating a mapped file)."""
+    with replacing(path) as tmp, open(tmp, "wb") as f:
+        np.save(f, array)
+
+
+def write_text(path: Path, text: str):
+    with replacing(path) as tmp:
+        tmp.write_text(text, encoding="utf-8")
+
+
+def matches_chunks(section: dict, index_dir: Path | None = None) -> bool:
+    """Whether a chunk-derived manifest section was built from the bundle's current chunk store."""
+    chunks = (read_manifest(index_dir) or {}).get("chunks", {})
+    signature = section.get("chunks_signature")
+    return signature is not None and signature == chunks.get("signature")
+
+
+def update_manifest(section: str, data: dict, index_dir: Path | None = None):
+    """Write one component's section into manifest.json, keeping the others."""
+    index_dir = index_dir or settings.index_dir
+    index_dir.mkdir(parents=True, exist_ok=True)
+    path = index_dir / MANIFEST_FILE
+    manifest = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+    manifest.update({
+        "format_version": BUNDLE_VERSION,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "embed_model": settings.embed_model,
+        section: data,
+    })
+    write_text(path, json.dumps(manifest, indent=2, ensure_ascii=False))
+
+
+class ChunkStore:
+    """Read-only, list-like view over chunk metadata stored as columns."""
+
+    def __init__(
+        self,
+        text: np.ndarray,
+        offsets: np.ndarray,
+        protocol: np.ndarray,
+        chunk_index: np.ndarray,
+        protocols: list[dict],
+        ids: np.ndarray | None = None,
+    ):
+        self._text = text
+        self.offsets = offsets
+        self.protocol = protocol
+        self.chunk_index = chunk_index
+        self.protocols = protocols
+        # Stable ids survive incremental updates; rows are renumbered, ids are not
+        self.ids = np.arange(len(offsets) - 1, dtype="int64") if ids is None else ids
+
+    @classmethod
+    def from_chunks(cls, chunks: list[dict], ids: np.ndarray | None = None) -> "ChunkStore":
+        """Build columns from the chunk dicts produced by index_corpus.py (ids default to row numbers)."""
+        protocol_rows: dict[str, int] = {}
+        protocols: list[dict] = []
+        encoded: list[bytes] = []
+        protocol = np.empty(len(chunks), dtype="int32")
+        chunk_index = np.empty(len(chunks), dtype="int32")
+        for i, c in enumerate(chunks):
+            pid = c["protocol_id"]
+            if pid not in protocol_rows:
+                protocol_rows[pid] = len(protocols)
+                protocols.append({
+                    "protocol_id": pid,
+                    "source_file": c.get("source_file", ""),
+                    "title": c.get("title", ""),
+                    "icd_codes": list(c.get("icd_codes", [])),
+                })
+            protocol[i] = protocol_rows[pid]
+            chunk_index[i] = c.get("chunk_index", c.get("chunk_idx", 0))
+            encoded.append(c.get("chunk", c.get("text", "")).encode("utf-8"))
+
+        offsets = np.zeros(len(chunks) + 1, dtype="int64")
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        text = np.frombuffer(b"".join(encoded), dtype="uint8")
+        return cls(text, offsets, protocol, chunk_index, protocols, ids)
+
+    def save(self, index_dir: Path | None = None):
+        index_dir = index_dir or settings.index_dir
+        index_dir.mkdir(parents=True, exist_ok=True)
+        save_array(index_dir / CHUNK_FILES["text"], self._text)
+        save_array(index_dir / CHUNK_FILES["offsets"], self.offsets)
+        save_array(index_dir / CHUNK_FILES["protocol"], self.protocol)
+        save_array(index_dir / CHUNK_FILES["chunk_index"], self.chunk_index)
+        save_array(index_dir / CHUNK_FILES["id"], self.ids)
+        write_text(index_dir / CHUNK_FILES["protocols"], json.dumps(self.protocols, ensure_ascii=False))
+        update_manifest("chunks", {
+            "n_chunks": len(self),
+            "n_protocols": len(self.protocols),
+            "text_bytes": int(self.offsets[-1]),
+            "signature": self.signature(),
+            "files": CHUNK_FILES,
+        }, index_dir)
+        logger.info(f"Chunk store saved: {len(self)} chunks, {len(self.protocols)} protocols")
+
+    @classmethod
+    def load(cls, index_dir: Path | None = None, mmap: bool = True) -> "ChunkStore":
+        """Chunk store from the bundle; mmap=False reads it into memory (for a store about to be rewritten)."""
+        index_dir = index_dir or settings.index_dir
+        mode = "r" if mmap else None
+        id_path = index_dir / CHUNK_FILES["id"]
+        store = cls(
+            np.load(index_dir / CHUNK_FILES["text"], mmap_mode=mode),
+            np.load(index_dir / CHUNK_FILES["offsets"], mmap_mode=mode),
+            np.load(index_dir / CHUNK_FILES["protocol"], mmap_mode=mode),
+            np.load(index_dir / CHUNK_FILES["chunk_index"], mmap_mode=mode),
+            json.loads((index_dir / CHUNK_FILES["protocols"]).read_text(encoding="utf-8")),
+            np.load(id_path, mmap_mode=mode) if id_path.exists() else None,  # bundles before incremental updates
+        )
+        logger.info(f"Chunk store {'mapped' if mmap else 'loaded'}: {len(store)} chunks, {len(store.protocols)} protocols")
+        return store
+
+    def signature(self) -> str:
+        """Content hash of the rows: chunk ids, text offsets and text."""
+        digest = hashlib.sha256(np.ascontiguousarray(self.ids, dtype="int64").tobytes())
+        digest.update(np.ascontiguousarray(self.offsets, dtype="int64").tobytes())
+        digest.update(memoryview(np.ascontiguousarray(self._text)))
+        return digest.hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def rows(self, ids: np.ndarray) -> np.ndarray:
+        """Map FAISS ids to row numbers (ids are sorted); -1 (no result) stays -1."""
+        n = len(self)
+        if n == 0 or self.ids[-1] == n - 1:  # ids are still 0..n-1
+            return ids
+        return np.where(ids >= 0, np.searchsorted(self.ids, ids), -1)
+
+    def protocol_id(self, i: int) -> str:
+        return self.protocols[self.protocol[i]]["protocol_id"]
+
+    def text(self, i: int) -> str:
+        return bytes(self._text[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __getitem__(self, i: int) -> dict:
+        """Materialise one chunk as the dict shape used across the pipeline."""
+        i = int(i)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        proto = self.protocols[self.protocol[i]]
+        text = self.text(i)
+        idx = int(self.chunk_index[i])
+        return {
+            "protocol_id": proto["protocol_id"],
+            "source_file": proto["source_file"],
+            "title": proto["title"],
+            "icd_codes": proto["icd_codes"],
+            "chunk": text,
+            "text": text,
+            "chunk_idx": idx,
+            "chunk_index": idx,
+            "chunk_row": i,  # row in this bundle (e.g. for precomputed reranker tokens)
+        }
+
+
+_store: ChunkStore | None = None
+
+
+def get_chunkstore() -> ChunkStore | None:
+    """Get the singleton ChunkStore mapped from the index bundle (None if there is no bundle)."""
+    global _store
+    if _store is None and read_manifest() is not None:
+        _store = ChunkStore.load()
+    return _store
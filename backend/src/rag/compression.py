@@ -0,0 +1,270 @@
+"""Query-aware prompt compression: keep the context sentences closest to the query.
+
+`build_context` used to pack whole chunks up to a character limit, so most of
+the LLM's input was text that has nothing to do with the patient's symptoms.
+The chunks are split into sentences at index time (index_corpus.py). Each
+sentence is embedded with the retrieval embedder and stored in the index
+bundle:
+
+    sent_spans.npy       int32 (n_sentences, 2) — character span of each sentence in its chunk
+    sent_offsets.npy     int64 (n_chunks + 1) — sentence range of each chunk row
+    sent_tokens.npy      int32 — token count of each sentence (embedding-model tokenizer)
+    sent_vectors.npy     float16 (n_sentences, dim) — normalised 'passage:' embeddings
+
+At request time the query embedding the pipeline already has is dotted with
+the sentences of the aggregated chunks. Each protocol first keeps its best
+`prompt_min_sentences_per_protocol` sentences, so no candidate protocol
+drops out of the prompt. The rest of `prompt_token_budget` is then filled
+with the best remaining sentences. Kept sentences stay in document order,
+and gaps are marked with " … ".
+"""
+import logging
+import re
+from pathlib import Path
+
+import numpy as np
+
+from src.config import settings
+from src.rag.chunkstore import matches_chunks, read_manifest, save_array, update_manifest
+
+logger = logging.getLogger(__name__)
+
+SENTENCE_FILES = {
+    "spans": "sent_spans.npy",
+    "offsets": "sent_offsets.npy",
+    "tokens": "sent_tokens.npy",
+    "vectors": "sent_vectors.npy",
+}
+
+# Sentence end followed by whitespace, or a line break. Decimal points and
+# dotted ICD codes (2.5 мг, J45.0) have no space after the dot and stay intact.
+BOUNDARY_RE = re.compile(r"(?<=[.!?…])\s+|\s*\n\s*")
+WORD_RE = re.compile(r"\S+")
+MIN_SENTENCE_CHARS = 25  # shorter pieces (headings, list markers) join the next sentence
+MAX_SENTENCE_WORDS = 60  # run-on text (tables, lists without punctuation) is cut into windows
+GAP = " … "
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """Character spans of the sentences of one chunk."""
+    pieces, start = [], 0
+    for m in BOUNDARY_RE.finditer(text):
+        if m.start() > start:
+            pieces.append((start, m.start()))
+        start = m.end()
+    if start < len(text):
+        pieces.append((start, len(text)))
+
+    merged: list[tuple[int, int]] = []
+    pending = None  # start of short pieces waiting to be joined to the next one
+    for lo, hi in pieces:
+        lo = lo if pending is None else pending
+        pending = lo if hi - lo < MIN_SENTENCE_CHARS else None
+        if pending is None:
+            merged.append((lo, hi))
+    if pending is not None:
+        end = pieces[-1][1]
+        merged[-1:] = [(merged[-1][0], end)] if merged else [(pending, end)]
+
+    spans: list[tuple[int, int]] = []
+    for lo, hi in merged:
+        words = [(w.start(), w.end()) for w in WORD_RE.finditer(text, lo, hi)]
+        for i in range(0, len(words), MAX_SENTENCE_WORDS):
+            window = words[i:i + MAX_SENTENCE_WORDS]
+            spans.append((window[0][0], window[-1][1]))
+    return spans
+
+
+class SentenceIndex:
+    """Per-chunk sentence spans, token counts and embeddings (memory-mapped when loaded)."""
+
+    def __init__(self, spans: np.ndarray, offsets: np.ndarray, tokens: np.ndarray, vectors: np.ndarray, model: str):
+        self.spans = spans
+        self.offsets = offsets
+        self.tokens = tokens
+        self.vectors = vectors
+        self.model = model
+
+    @classmethod
+    def build(cls, texts: list[str], embedder, tokenizer, model: str, batch_size: int = 1024) -> "SentenceIndex":
+        """Split, count and embed the sentences of `texts` (one entry per chunk row)."""
+        spans: list[tuple[int, int]] = []
+        counts = np.zeros(len(texts) + 1, dtype="int64")
+        sentences: list[str] = []
+        for i, text in enumerate(texts):
+            chunk_spans = split_sentences(text)
+            spans.extend(chunk_spans)
+            sentences.extend(text[lo:hi] for lo, hi in chunk_spans)
+            counts[i + 1] = len(chunk_spans)
+        tokens = np.zeros(len(sentences), dtype="int32")
+        for start in range(0, len(sentences), batch_size):
+            enc = tokenizer(sentences[start:start + batch_size], add_special_tokens=False, verbose=False)
+            tokens[start:start + len(enc["input_ids"])] = [len(ids) for ids in enc["input_ids"]]
+        if sentences:
+            vectors = embedder.encode(sentences, is_query=False).astype("float16")
+        else:
+            vectors = np.empty((0, 0), dtype="float16")
+        logger.info(f"Sentence index built: {len(sentences)} sentences, {int(tokens.sum())} tokens")
+        return cls(np.asarray(spans, dtype="int32").reshape(-1, 2), np.cumsum(counts), tokens, vectors, model)
+
+    def subset(self, rows: np.ndarray) -> "SentenceIndex":
+        """In-memory copy restricted to the given chunk rows (in that order)."""
+        rows = np.asarray(rows, dtype="int64")
+        sent = np.concatenate(
+            [np.arange(self.offsets[r], self.offsets[r + 1]) for r in rows] or [np.empty(0, dtype="int64")]
+        ).astype("int64")
+        counts = np.zeros(len(rows) + 1, dtype="int64")
+        counts[1:] = self.offsets[rows + 1] - self.offsets[rows]
+        return SentenceIndex(
+            np.array(self.spans[sent]), np.cumsum(counts), np.array(self.tokens[sent]),
+            np.array(self.vectors[sent]), self.model,
+        )
+
+    @classmethod
+    def concat(cls, parts: list["SentenceIndex"]) -> "SentenceIndex":
+        """Sentence indexes of consecutive chunk-row ranges, joined."""
+        counts = np.concatenate([[0]] + [np.diff(p.offsets) for p in parts]).astype("int64")
+        filled = [p for p in parts if len(p.tokens)]  # an empty build has no embedding dim
+        if not filled:
+            return cls(np.empty((0, 2), dtype="int32"), np.cumsum(counts), np.empty(0, dtype="int32"),
+                       np.empty((0, 0), dtype="float16"), parts[0].model if parts else settings.embed_model)
+        return cls(
+            np.concatenate([p.spans for p in filled]),
+            np.cumsum(counts),
+            np.concatenate([p.tokens for p in filled]),
+            np.concatenate([p.vectors for p in filled]),
+            filled[0].model,
+        )
+
+    def save(self, chunks_signature: str, index_dir: Path | None = None):
+        """Write the arrays; chunks_signature is the ChunkStore.signature() of the rows they belong to."""
+        index_dir = index_dir or settings.index_dir
+        for name, array in (("spans", self.spans), ("offsets", self.offsets),
+                            ("tokens", self.tokens), ("vectors", self.vectors)):
+            save_array(index_dir / SENTENCE_FILES[name], array)
+        update_manifest("sentences", {
+            "model": self.model,
+            "chunks_signature": chunks_signature,
+            "n_chunks": len(self),
+            "n_sentences": len(self.tokens),
+            "n_tokens": int(np.asarray(self.tokens).sum()),
+            "files": SENTENCE_FILES,
+        }, index_dir)
+
+    @classmethod
+    def load(cls, model: str, index_dir: Path | None = None) -> "SentenceIndex | None":
+        """Mapped sentence index, or None if the bundle has none for this embedding model and chunk store."""
+        index_dir = index_dir or settings.index_dir
+        section = (read_manifest(index_dir) or {}).get("sentences")
+        if section is None:
+            return None
+        if section["model"] != model:
+            logger.warning(f"Sentence embeddings were built with '{section['model']}', not '{model}' — ignoring them.")
+            return None
+        if not matches_chunks(section, index_dir):
+            logger.warning("Sentence embeddings do not match the current chunk store — ignoring them.")
+            return None
+        arrays = {name: np.load(index_dir / f, mmap_mode="r") for name, f in SENTENCE_FILES.items()}
+        return cls(arrays["spans"], arrays["offsets"], arrays["tokens"], arrays["vectors"], model)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+class PromptCompressor:
+    """Selects query-relevant sentences of the aggregated chunks within a token budget."""
+
+    def __init__(self, index: SentenceIndex, token_budget: int | None = None, min_per_protocol: int | None = None):
+        self.index = index
+        self.token_budget = settings.prompt_token_budget if token_budget is None else token_budget
+        self.min_per_protocol = (
+            settings.prompt_min_sentences_per_protocol if min_per_protocol is None else min_per_protocol
+        )
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def compress(self, query_vec: np.ndarray, chunks: list[dict]) -> list[dict]:
+        """Chunks with their text cut down to the selected sentences; chunks left empty are dropped."""
+        rows = [c.get("chunk_row") for c in chunks]
+        if not chunks or any(r is None or r >= len(self.index) for r in rows):
+            return chunks
+        offsets = self.index.offsets
+        starts = np.array([offsets[r] for r in rows], dtype="int64")
+        counts = np.array([offsets[r + 1] for r in rows], dtype="int64") - starts
+        owner = np.repeat(np.arange(len(chunks)), counts)
+        sent = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + starts[owner]
+        if not len(sent):
+            return chunks
+
+        sims = np.asarray(self.index.vectors[sent], dtype="float32") @ np.asarray(query_vec, dtype="float32")
+        tokens = np.asarray(self.index.tokens[sent], dtype="int64")
+        _, protocol = np.unique([c["protocol_id"] for c in chunks], return_inverse=True)
+        protocol = protocol.ravel()[owner]
+
+        # Every protocol's best sentences go first, then everything else by similarity
+        by_protocol = np.lexsort((-sims, protocol))
+        rank_in_protocol = np.empty(len(sent), dtype="int64")
+        group_start = np.searchsorted(protocol[by_protocol], protocol[by_protocol])
+        rank_in_protocol[by_protocol] = np.arange(len(sent)) - group_start
+        reserved = rank_in_protocol < self.min_per_protocol
+        order = np.lexsort((-sims, ~reserved))
+
+        keep = np.zeros(len(sent), dtype=bool)
+        used = 0
+        for i in order.tolist():
+            # A protocol's single best sentence is kept even over budget
+            if used + tokens[i] <= self.token_budget or rank_in_protocol[i] == 0:
+                keep[i] = True
+                used += int(tokens[i])
+
+        out = []
+        for j, chunk in enumerate(chunks):
+            picked = np.flatnonzero(keep[owner == j])
+            if not len(picked):
+                continue
+            spans = self.index.spans[starts[j] + picked]
+            text = chunk.get("chunk", chunk.get("text", ""))
+            parts, last, prev_hi = [], None, 0
+            for k, (lo, hi) in zip(picked.tolist(), spans.tolist()):
+                if last is not None:
+                    # Adjacent sentences keep their original separator
+                    parts.append(text[prev_hi:lo] if k == last + 1 else GAP)
+                parts.append(text[lo:hi])
+                last, prev_hi = k, hi
+            compressed = "".join(parts)
+            out.append({**chunk, "chunk": compressed, "text": compressed})
+
+        self.requests += 1
+        self.tokens_in += int(tokens.sum())
+        self.tokens_out += used
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "token_budget": self.token_budget,
+            "context_tokens_in": self.tokens_in,
+            "context_tokens_out": self.tokens_out,
+            "reduction": round(1 - self.tokens_out / self.tokens_in, 4) if self.tokens_in else 0.0,
+        }
+
+
+_compressor: PromptCompressor | None = None
+_loaded = False
+
+
+def get_prompt_compressor() -> PromptCompressor | None:
+    """Singleton compressor, or None when compression is off or the bundle has no sentence index."""
+    global _compressor, _loaded
+    if not _loaded:
+        _loaded = True
+        if settings.prompt_compression:
+            index = SentenceIndex.load(settings.embed_model)
+            if index is None:
+                logger.warning("PROMPT_COMPRESSION is on but the index has no sentence embeddings "
+                               "— re-run scripts/index_corpus.py. Prompts are not compressed.")
+            else:
+                _compressor = PromptCompressor(index)
+                logger.info(f"Sentence index mapped: {len(index.tokens)} sentences in {len(index)} chunks")
+    return _compressor
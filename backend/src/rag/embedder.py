@@ -17,16 +17,26 @@ logger = logging.getLogger(__name__)
 class Embedder:
     def __init__(self):
         self._model = None
+        self.backend: str | None = None  # "torch" | "onnx" once loaded
 
     def _load(self):
         if self._model is not None:
             return
+        if settings.inference_backend == "onnx":
+            try:
+                from src.rag.onnx_backend import OnnxEmbedder
+                self._model = OnnxEmbedder(settings.embed_model)
+                self.backend = "onnx"
+                return
+            except Exception as e:
+                logger.warning(f"ONNX embedder unavailable ({e}); falling back to PyTorch.")
         import torch
         from sentence_transformers import SentenceTransformer
 
         device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Loading embedding model '{settings.embed_model}' on device={device}")
         self._model = SentenceTransformer(settings.embed_model, device=device)
+        self.backend = "torch"
         logger.info("Embedding model loaded.")
 
     def encode(self, texts: list[str] | str, batch_size: int = 64, is_query: bool = False) -> np.ndarray:
@@ -56,11 +66,55 @@ class Embedder:
         return self.encode([query], is_query=True)[0]
 
 
+class QueryBatcher:
+    """
+    Coalesces concurrent `encode_query` calls into one SentenceTransformer
+    `encode` call. On CPU a batch of 8–16 short queries costs little more than
+    a single one, so throughput under concurrent load scales much better.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        max_batch_size: int | None = None,
+        max_wait_ms: float | None = None,
+    ):
+        from src.rag.batching import MicroBatcher
+
+        self.embedder = embedder
+        self._batcher = MicroBatcher(
+            self._encode_batch,
+            max_batch_size=max_batch_size or settings.embed_batch_max_size,
+            max_wait_ms=settings.embed_batch_max_wait_ms if max_wait_ms is None else max_wait_ms,
+            name="embed",
+        )
+
+    def _encode_batch(self, queries: list[str]) -> list[np.ndarray]:
+        vecs = self.embedder.encode(queries, batch_size=len(queries), is_query=True)
+        return list(vecs)
+
+    async def encode_query(self, query: str) -> np.ndarray:
+        """Embed one query, sharing the model call with other in-flight queries."""
+        return await self._batcher.submit(query)
+
+    def stats(self) -> dict:
+        return self._batcher.stats()
+
+
 _embedder: Embedder | None = None
+_query_batcher: QueryBatcher | None = None
 
 def get_embedder() -> Embedder:
     """Get singleton Embedder instance."""
     global _embedder
     if _embedder is None:
         _embedder = Embedder()
-    return _embedder
\ No newline at end of file
+    return _embedder
+
+
+def get_query_batcher() -> QueryBatcher:
+    """Get singleton QueryBatcher wrapping the singleton Embedder."""
+    global _query_batcher
+    if _query_batcher is None:
+        _query_batcher = QueryBatcher(get_embedder())
+    return _query_batcher
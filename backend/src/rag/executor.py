@@ -0,0 +1,91 @@
+"""Executor layer that keeps blocking model and index work off the asyncio event loop.
+
+Torch forward passes and FAISS searches release the GIL, so they run on a shared
+thread pool. Pure-Python BM25 scoring holds the GIL; it can optionally be sent to
+a small process pool whose workers load their own copy of the BM25 index.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Get the shared thread pool used for torch/FAISS work."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=settings.cpu_workers,
+            thread_name_prefix="rag-cpu",
+        )
+        logger.info(f"CPU thread pool started ({settings.cpu_workers} workers)")
+    return _thread_pool
+
+
+def _bm25_worker_init():
+    """Load the BM25 index once per worker process."""
+    from src.rag.bm25 import get_bm25
+    get_bm25()
+
+
+def _bm25_worker_search(query: str, top_k: int):
+    # Only the (rows, scores) arrays cross the process boundary, never chunk data
+    from src.rag.bm25 import get_bm25
+    return get_bm25().search_rows([query], top_k)[0]
+
+
+def get_process_pool() -> ProcessPoolExecutor | None:
+    """Get the BM25 process pool, or None when it is disabled (bm25_process_workers=0)."""
+    global _process_pool
+    if _process_pool is None and settings.bm25_process_workers > 0:
+        # spawn, not fork: the parent may already hold torch/OpenMP thread state
+        _process_pool = ProcessPoolExecutor(
+            max_workers=settings.bm25_process_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_bm25_worker_init,
+        )
+        logger.info(f"BM25 process pool started ({settings.bm25_process_workers} workers)")
+    return _process_pool
+
+
+async def run_in_thread(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking callable on the shared CPU thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(fn, *args, **kwargs))
+
+
+async def run_bm25_search(bm25, query: str, top_k: int):
+    """
+    Run a BM25 search off the event loop.
+
+    Uses the process pool when enabled (workers search their own copy of the
+    on-disk index), otherwise searches `bm25` on the thread pool.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return await run_in_thread(bm25.search, query, top_k)
+    from src.rag.candidates import Candidates
+
+    loop = asyncio.get_running_loop()
+    rows, scores = await loop.run_in_executor(pool, _bm25_worker_search, query, top_k)
+    return Candidates(bm25.chunks, rows, {"sparse": scores})
+
+
+def shutdown():
+    """Stop all executors (called from the FastAPI lifespan on shutdown)."""
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -0,0 +1,91 @@
+"""Retrieval-only diagnoses, used when the LLM misses the request deadline.
+
+Ranks ICD-10 codes from the evidence the pipeline already has:
+
+  * protocol relevance — the protocol's aggregate score from
+    `aggregate_by_protocol` (cross-encoder score when re-ranking is on, RRF
+    otherwise), relative to the best protocol;
+  * code evidence — how often the code appears in the protocol's retrieved
+    chunks, whether the query itself names it, and whether it is a specific
+    (dotted) code rather than a whole category;
+  * diversity — each further code from the same protocol is discounted, so
+    the top ranks cover several protocols instead of one protocol's code list.
+"""
+import logging
+import re
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+ICD_RE = re.compile(r"\b[A-Z]\d{2}(?:\.\d{1,2})?\b")
+
+MENTION_WEIGHT = 0.15  # per mention of the code in retrieved chunk text (capped)
+MAX_MENTIONS = 4
+QUERY_CODE_BONUS = 1.0  # the query names this exact code
+SPECIFIC_BONUS = 0.1  # dotted code, e.g. J45.0 over J45
+SAME_PROTOCOL_DECAY = 0.5  # n-th code of one protocol is multiplied by DECAY**n
+
+
+def _chunk_score(c: dict) -> float:
+    return c.get("reranker_score", c.get("rrf_score", c.get("fusion_score", 0.0)))
+
+
+def rank_icd_codes(symptoms: str, chunks: list[dict], top_n: int = 5) -> list[dict]:
+    """
+    Diagnosis dicts (rank, diagnosis, icd10_code, explanation, score) ranked
+    from protocol-aggregated chunks, best first.
+    """
+    protocols: dict[str, dict] = {}
+    for c in chunks:
+        pid = c["protocol_id"]
+        p = protocols.setdefault(pid, {
+            "name": (c.get("source_file") or c.get("title") or pid).replace(".pdf", ""),
+            "icd_codes": list(c.get("icd_codes", [])),
+            "score": c.get("protocol_rank_score", _chunk_score(c)),
+            "mentions": defaultdict(int),
+        })
+        for code in ICD_RE.findall(c.get("chunk", c.get("text", ""))):
+            p["mentions"][code] += 1
+    if not protocols:
+        return []
+
+    scores = [p["score"] for p in protocols.values()]
+    lo, hi = min(scores), max(scores)
+    query_codes = set(ICD_RE.findall(symptoms.upper()))
+
+    candidates: list[tuple[float, str, str, float]] = []  # (score, code, protocol name, relevance)
+    for p in protocols.values():
+        # Min-max over the candidate protocols: RRF and cross-encoder scores live on different scales
+        relevance = 1.0 if hi == lo else 0.1 + 0.9 * (p["score"] - lo) / (hi - lo)
+        code_scores = []
+        for code in dict.fromkeys(p["icd_codes"]):
+            evidence = (
+                1.0
+                + MENTION_WEIGHT * min(p["mentions"].get(code, 0), MAX_MENTIONS)
+                + (QUERY_CODE_BONUS if code in query_codes else 0.0)
+                + (SPECIFIC_BONUS if "." in code else 0.0)
+            )
+            code_scores.append((evidence, code))
+        code_scores.sort(key=lambda x: (-x[0], x[1]))
+        for n, (evidence, code) in enumerate(code_scores):
+            candidates.append((relevance * evidence * SAME_PROTOCOL_DECAY ** n, code, p["name"], relevance))
+
+    best: dict[str, tuple[float, str, str, float]] = {}
+    for cand in candidates:  # a code shared by several protocols keeps its best score
+        if cand[1] not in best or cand[0] > best[cand[1]][0]:
+            best[cand[1]] = cand
+    ranked = sorted(best.values(), key=lambda x: (-x[0], x[1]))[:top_n]
+
+    return [
+        {
+            "rank": i + 1,
+            "diagnosis": name,
+            "icd10_code": code,
+            "explanation": (
+                f"Определено по найденным протоколам без LLM: протокол «{name}», "
+                f"релевантность {relevance:.2f}."
+            ),
+            "score": round(score, 4),
+        }
+        for i, (score, code, name, relevance) in enumerate(ranked)
+    ]
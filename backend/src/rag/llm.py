@@ -1,18 +1,265 @@
+import asyncio
 import json
 import logging
-from openai import AsyncOpenAI
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
 from src.config import settings
+from src.rag.executor import run_in_thread
+from src.rag.llm_cache import get_llm_cache, make_key
 
 logger = logging.getLogger(__name__)
 
+TEMPERATURE = 0.1
+MAX_TOKENS = 1024
+
+
+# Status codes worth retrying: rate limiting and transient upstream failures.
+# 409 is a conflict, not a transient failure, and is not retried.
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+HEDGE_BURST = 2.0  # hedges that may be sent back to back before the ratio cap applies
+
+
+class UpstreamStats:
+    """Rolling window of upstream LLM latencies plus request/retry/error counters."""
+
+    def __init__(self, window: int = 512):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0  # the duplicate answered first
+        self.hedges_over_budget = 0  # slow calls left unhedged by the load cap
+
+    def record(self, latency_s: float):
+        self.latencies.append(latency_s)
+
+    def percentile(self, q: float) -> float | None:
+        """q in [0, 1]; None until at least one latency has been recorded."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        def _p(q):
+            v = self.percentile(q)
+            return None if v is None else round(v, 3)
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "latency_p50_s": _p(0.5),
+            "latency_p95_s": _p(0.95),
+            "latency_max_s": _p(1.0),
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "hedges_over_budget": self.hedges_over_budget,
+        }
+
+
+upstream_stats = UpstreamStats()
+
+
+class HedgeBudget:
+    """
+    Token bucket that caps hedged requests at `ratio` per upstream call.
+
+    Every call earns `ratio` tokens (up to `burst`); a hedge spends one. So at
+    most ~ratio extra load reaches the upstream, however slow it gets, and a
+    run of slow calls cannot turn into a duplicate for every request.
+    """
+
+    def __init__(self, ratio: float, burst: float = HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+
+    def earn(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+_hedge_budget = HedgeBudget(settings.llm_hedge_max_ratio)
+
+
+def hedge_delay() -> float:
+    """
+    Time to wait before hedging: the configured percentile of recent upstream
+    latency, or the conservative llm_hedge_cold_delay_s until enough latencies
+    have been seen.
+    """
+    p = upstream_stats.percentile(settings.llm_hedge_percentile)
+    if p is None or len(upstream_stats.latencies) < settings.llm_hedge_min_samples:
+        return settings.llm_hedge_cold_delay_s
+    return max(settings.llm_hedge_min_delay_s, p)
+
+
+async def _hedged(call: Callable[[bool], Awaitable]):
+    """
+    Run `call`, and if it has not finished after `hedge_delay()`, start an
+    identical second call (budget permitting). The first successful result
+    wins and the other call is cancelled. If one call fails, the other one's
+    outcome is awaited.
+
+    `call(record)` says whether the call should record its own latency. While
+    hedging, the calls don't: one sample per request is recorded here, timed
+    from the first call's start. When the duplicate wins, that sample is a
+    lower bound on the first call's latency (it was cancelled unfinished), so
+    slow calls still count and the percentile does not drift down.
+    """
+    if not settings.llm_hedge:
+        return await call(True)
+    _hedge_budget.earn()
+    t0 = time.perf_counter()
+    tasks = [asyncio.ensure_future(call(False))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay())
+        if not done and _hedge_budget.spend():
+            upstream_stats.hedges_sent += 1
+            logger.info("[LLM] upstream call is slow — sending a hedged duplicate")
+            tasks.append(asyncio.ensure_future(call(False)))
+            pending, winner = set(tasks), None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+            if winner is None:
+                raise tasks[0].exception()
+            if winner is tasks[1]:
+                upstream_stats.hedges_won += 1
+            result = winner.result()
+        else:
+            if not done:
+                upstream_stats.hedges_over_budget += 1
+            result = await tasks[0]
+        upstream_stats.record(time.perf_counter() - t0)
+        return result
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+_client: AsyncOpenAI | None = None
+_client_pid: int | None = None  # process that created _client
+
 
 def _get_client() -> AsyncOpenAI | None:
+    """
+    Process-wide client: one keep-alive connection pool, explicit timeouts, retries done here.
+
+    Created on first use, in the process that uses it. A client inherited
+    across a fork (src.serve) would share the master's connection pool, so a
+    worker always builds its own.
+    """
+    global _client, _client_pid
     if not settings.gpt_oss_api_key:
         return None
-    return AsyncOpenAI(
-        base_url=settings.gpt_oss_url,
-        api_key=settings.gpt_oss_api_key,
-    )
+    if _client is None or _client_pid != os.getpid():
+        _client_pid = os.getpid()
+        limits = httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive,
+            keepalive_expiry=settings.llm_keepalive_expiry_s,
+        )
+        timeout = httpx.Timeout(settings.llm_read_timeout_s, connect=settings.llm_connect_timeout_s)
+        try:
+            http_client = httpx.AsyncClient(http2=settings.llm_http2, limits=limits, timeout=timeout)
+        except ImportError:
+            logger.warning("[LLM] HTTP/2 requested but 'h2' is not installed — using HTTP/1.1")
+            http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        _client = AsyncOpenAI(
+            base_url=settings.gpt_oss_url,
+            api_key=settings.gpt_oss_api_key,
+            http_client=http_client,
+            max_retries=0,  # see _with_retries
+        )
+    return _client
+
+
+async def aclose():
+    """Close the shared client's connection pool (FastAPI lifespan shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    """Full-jitter exponential backoff, stretched to honour Retry-After on 429/503."""
+    delay = random.uniform(0, min(settings.llm_retry_max_s, settings.llm_retry_base_s * 2 ** attempt))
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            delay = max(delay, min(float(retry_after), settings.llm_retry_max_s))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+async def _with_retries(call: Callable[[], Awaitable], record: bool = True, retry_read_timeouts: bool = True):
+    """
+    Run an upstream call with bounded retries on connection errors and 408/429/5xx.
+
+    With retry_read_timeouts=False a read timeout is raised at once: a completion
+    that ran out the whole read timeout would most likely do so again, and
+    re-sending it only multiplies latency and upstream load.
+    """
+    for attempt in range(settings.llm_max_retries + 1):
+        upstream_stats.requests += 1
+        t0 = time.perf_counter()
+        try:
+            result = await call()
+        except APITimeoutError as e:
+            # openai raises APITimeoutError for every httpx timeout; connect and
+            # pool timeouts say nothing about the completion and are retried
+            if not retry_read_timeouts and isinstance(e.__cause__, httpx.ReadTimeout):
+                upstream_stats.errors += 1
+                raise
+            error = e
+        except APIConnectionError as e:
+            error = e
+        except APIStatusError as e:
+            if e.status_code not in RETRYABLE_STATUS:
+                upstream_stats.errors += 1
+                raise
+            error = e
+        else:
+            latency = time.perf_counter() - t0
+            if record:
+                upstream_stats.record(latency)
+            logger.info(f"[LLM] upstream call {latency:.2f}s (attempt {attempt + 1})")
+            return result
+
+        upstream_stats.errors += 1
+        if attempt == settings.llm_max_retries:
+            raise error
+        delay = _retry_delay(attempt, error)
+        upstream_stats.retries += 1
+        logger.warning(f"[LLM] upstream error ({error.__class__.__name__}); retry in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+
+async def _complete(client: AsyncOpenAI, messages: list[dict], record: bool = True) -> str:
+    response = await _with_retries(lambda: client.chat.completions.create(
+        model=settings.gpt_oss_model,
+        messages=messages,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+        response_format={"type": "json_object"},
+    ), record=record, retry_read_timeouts=False)
+    return response.choices[0].message.content
 
 
 def _mock_diagnoses(chunks: list[dict], top_n: int = 3) -> list[dict]:
@@ -38,17 +285,116 @@ def _mock_diagnoses(chunks: list[dict], top_n: int = 3) -> list[dict]:
     return diagnoses
 
 
+def _cache_key(messages: list[dict]) -> str:
+    system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    user = "\n".join(m["content"] for m in messages if m["role"] != "system")
+    return make_key(settings.gpt_oss_model, system, user, TEMPERATURE, MAX_TOKENS)
+
+
+async def _cache_lookup(messages: list[dict], use_cache: bool) -> tuple[str | None, str | None]:
+    """Return (cache key, cached completion). With use_cache=False the read is skipped but
+    the key is still returned so the fresh completion overwrites the entry."""
+    cache = get_llm_cache()
+    if cache is None:
+        return None, None
+    key = _cache_key(messages)
+    raw = await run_in_thread(cache.get, key) if use_cache else None
+    return key, raw
+
+
+async def _cache_store(key: str | None, raw: str):
+    cache = get_llm_cache()
+    if cache is not None and key is not None:
+        await run_in_thread(cache.put, key, settings.gpt_oss_model, raw)
+
+
+class DiagnosisStreamParser:
+    """
+    Incremental parser for streamed `{"diagnoses": [{...}, {...}]}` completions.
+
+    Tracks JSON nesting (string/escape aware) and returns each object inside the
+    "diagnoses" (or "results") array as soon as its closing brace arrives, so
+    diagnoses can be forwarded before the completion ends. A bare top-level
+    list also works. Other arrays are skipped, as `LLMClient.diagnose` does.
+    """
+
+    ITEM_KEYS = ("diagnoses", "results")
+
+    def __init__(self):
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item: list[str] | None = None
+        self._key: list[str] = []  # last string seen directly in the top-level object
+        self._item_array = False  # the open top-level array is one of ITEM_KEYS
+        self.raw = ""
+
+    def _in_item_array(self) -> bool:
+        return self._stack == ["["] or (self._stack == ["{", "["] and self._item_array)
+
+    def feed(self, text: str) -> list[dict]:
+        self.raw += text
+        done: list[dict] = []
+        for ch in text:
+            if self._item is not None:
+                self._item.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    continue
+                if self._stack == ["{"]:
+                    self._key.append(ch)
+                continue
+            if ch == '"':
+                self._in_string = True
+                if self._stack == ["{"]:
+                    self._key = []
+            elif ch in "{[":
+                if ch == "{" and self._item is None and self._in_item_array():
+                    self._item = [ch]
+                if ch == "[" and self._stack == ["{"]:
+                    # A value array follows its key, so the last top-level string names it
+                    self._item_array = "".join(self._key) in self.ITEM_KEYS
+                self._stack.append(ch)
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if ch == "}" and self._item is not None and self._in_item_array():
+                    try:
+                        obj = json.loads("".join(self._item))
+                        if isinstance(obj, dict):
+                            done.append(obj)
+                    except ValueError:
+                        pass
+                    self._item = None
+        return done
+
+
 class LLMClient:
     """Wrapper around the gpt-oss OpenAI-compatible API."""
 
-    def __init__(self):
-        self._client = _get_client()
+    @property
+    def _client(self) -> AsyncOpenAI | None:
+        # Looked up per call, not in __init__: RAGPipeline (and so LLMClient) is
+        # built at import time, which under src.serve is the master, before the fork
+        return _get_client()
+
+    async def diagnose(
+        self, prompt: str, chunks: list[dict], top_n: int = 5, use_cache: bool = True
+    ) -> tuple[list[dict], bool]:
+        """
+        Send prompt to LLM and return (parsed diagnosis dicts, fallback).
 
-    async def diagnose(self, prompt: str, chunks: list[dict], top_n: int = 5) -> list[dict]:
-        """Send prompt to LLM and return parsed list of diagnosis dicts."""
+        fallback is True when the diagnoses come from `_mock_diagnoses` (no API
+        key, or an unparseable completion) rather than from the model, so
+        callers know not to cache them.
+        """
         if self._client is None:
             logger.warning("[LLM] No API key — running in mock mode")
-            return _mock_diagnoses(chunks, top_n)
+            return _mock_diagnoses(chunks, top_n), True
 
         from src.rag.prompt import SYSTEM_PROMPT
         messages = [
@@ -56,26 +402,105 @@ class LLMClient:
             {"role": "user", "content": prompt},
         ]
 
-        response = await self._client.chat.completions.create(
-            model=settings.gpt_oss_model,
-            messages=messages,
-            temperature=0.1,
-            max_tokens=1024,
-            response_format={"type": "json_object"},
-        )
-        raw = response.choices[0].message.content
+        key, raw = await _cache_lookup(messages, use_cache)
+        from_cache = raw is not None
+        if from_cache:
+            logger.info("[LLM] completion cache hit")
+        else:
+            raw = await _hedged(lambda record: _complete(self._client, messages, record))
 
         try:
             data = json.loads(raw)
+            if not from_cache:
+                await _cache_store(key, raw)
             if isinstance(data, list):
-                return data
-            return data.get("diagnoses", data.get("results", []))
+                return data, False
+            return data.get("diagnoses", data.get("results", [])), False
         except Exception as e:
             logger.warning(f"Failed to parse LLM response: {e}\nRaw: {raw}")
-            return _mock_diagnoses(chunks, top_n)
+            return _mock_diagnoses(chunks, top_n), True
 
+    async def diagnose_stream(
+        self, prompt: str, chunks: list[dict], top_n: int = 5, use_cache: bool = True,
+        outcome: dict | None = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Stream the completion and yield each diagnosis dict as soon as it is complete.
 
-async def complete(messages: list[dict], chunks: list[dict]) -> str:
+        If given, `outcome["fallback"]` is set to True when the stream did not
+        come from a well-formed completion (mock mode or unparseable JSON), as
+        the second value of `diagnose` does.
+
+        Consumers close the stream once they have `top_n` diagnoses, so the
+        upstream latency and the completion cache entry (the first `top_n`
+        diagnoses) are written before the top_n-th one is yielded.
+        """
+        outcome = {} if outcome is None else outcome
+        outcome["fallback"] = False
+        if self._client is None:
+            logger.warning("[LLM] No API key — running in mock mode")
+            outcome["fallback"] = True
+            for d in _mock_diagnoses(chunks, top_n):
+                yield d
+            return
+
+        from src.rag.prompt import SYSTEM_PROMPT
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+        key, raw = await _cache_lookup(messages, use_cache)
+        if raw is not None:
+            logger.info("[LLM] completion cache hit")
+            for d in DiagnosisStreamParser().feed(raw):
+                yield d
+            return
+
+        parser = DiagnosisStreamParser()
+        items: list[dict] = []
+        recorded = False
+        t0 = time.perf_counter()
+        # Only opening the stream is retried; once tokens flow, errors propagate
+        stream = await _with_retries(lambda: self._client.chat.completions.create(
+            model=settings.gpt_oss_model,
+            messages=messages,
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+            response_format={"type": "json_object"},
+            stream=True,
+        ), record=False)
+        try:
+            async for event in stream:
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if delta:
+                    for d in parser.feed(delta):
+                        items.append(d)
+                        if len(items) == top_n:
+                            recorded = True
+                            upstream_stats.record(time.perf_counter() - t0)
+                            await _cache_store(key, json.dumps({"diagnoses": items}, ensure_ascii=False))
+                        yield d
+        finally:
+            # Releases the upstream connection when the consumer stops early (top_n reached, deadline, disconnect)
+            await stream.close()
+        if not recorded:
+            upstream_stats.record(time.perf_counter() - t0)
+
+        try:
+            json.loads(parser.raw)
+            await _cache_store(key, parser.raw)
+        except ValueError as e:
+            logger.warning(f"Failed to parse streamed LLM response: {e}\nRaw: {parser.raw}")
+            outcome["fallback"] = True
+            if not items:
+                for d in _mock_diagnoses(chunks, top_n):
+                    yield d
+
+
+async def complete(messages: list[dict], chunks: list[dict], use_cache: bool = True) -> str:
     """Legacy function interface for backward compatibility."""
     client = _get_client()
 
@@ -83,11 +508,14 @@ async def complete(messages: list[dict], chunks: list[dict]) -> str:
         logger.warning("[LLM] No API key — running in mock mode")
         return json.dumps({"diagnoses": _mock_diagnoses(chunks)}, ensure_ascii=False)
 
-    response = await client.chat.completions.create(
-        model=settings.gpt_oss_model,
-        messages=messages,
-        temperature=0.1,
-        max_tokens=1024,
-        response_format={"type": "json_object"},
-    )
-    return response.choices[0].message.content
+    key, raw = await _cache_lookup(messages, use_cache)
+    if raw is not None:
+        return raw
+
+    raw = await _hedged(lambda record: _complete(client, messages, record))
+    try:
+        json.loads(raw)
+        await _cache_store(key, raw)
+    except (TypeError, ValueError):
+        pass  # never cache completions the caller will fail to parse
+    return raw
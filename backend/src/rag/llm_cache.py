@@ -0,0 +1,138 @@
+"""Persistent LLM completion cache shared by all worker processes.
+
+Completions are stored in SQLite (WAL mode, so readers never block the single
+writer and several uvicorn workers can share one file) keyed by a hash of
+everything that determines the model output: model, system prompt, user
+prompt, temperature and max_tokens. When the file grows past the size limit,
+the least recently used entries are deleted.
+
+All methods are blocking; call them through `executor.run_in_thread`.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key         TEXT PRIMARY KEY,
+    model       TEXT NOT NULL,
+    response    TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at);
+"""
+
+# Check the total size every N writes rather than on every put
+_EVICT_CHECK_EVERY = 32
+
+
+def make_key(model: str, system: str, user: str, temperature: float, max_tokens: int) -> str:
+    payload = json.dumps([model, system, user, temperature, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: Path | None = None, max_mb: float | None = None):
+        self.path = path or settings.llm_cache_path
+        self.max_bytes = int((settings.llm_cache_max_mb if max_mb is None else max_mb) * 2**20)
+        self._local = threading.local()  # one connection per executor thread
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> str | None:
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"[LLM cache] read failed: {e}")
+            self.misses += 1
+            return None
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self.stores += 1
+            self._writes += 1
+            if self._writes % _EVICT_CHECK_EVERY == 0:
+                self._evict(conn)
+        except sqlite3.Error as e:
+            logger.warning(f"[LLM cache] write failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Delete least recently used rows until the payload is under 90% of the limit."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT key, size FROM completions ORDER BY accessed_at").fetchall()
+            doomed = []
+            for key, size in rows:
+                if total <= target:
+                    break
+                doomed.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM completions WHERE key = ?", doomed)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.evictions += len(doomed)
+        logger.info(f"[LLM cache] evicted {len(doomed)} entries")
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+_cache: LLMCache | None = None
+
+
+def get_llm_cache() -> LLMCache | None:
+    """Get singleton LLMCache, or None when disabled (LLM_CACHE_ENABLED=false)."""
+    global _cache
+    if _cache is None and settings.llm_cache_enabled:
+        _cache = LLMCache()
+    return _cache
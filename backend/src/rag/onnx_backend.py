@@ -0,0 +1,238 @@
+"""ONNX Runtime inference backend for the embedder and the cross-encoder.
+
+Selected with INFERENCE_BACKEND=onnx. On first use each Hugging Face model is
+exported to ONNX (and, with ONNX_QUANTIZE=true, dynamically quantized to int8
+weights) under settings.onnx_dir/<model>/; later loads only open the file.
+Workers load models after the fork (src.serve), so the first export takes a
+lock file and writes to a temporary directory that is renamed into place:
+other workers wait for it and never see a half-written model.
+
+The classes mirror the parts of SentenceTransformer.encode and
+CrossEncoder.predict that the pipeline uses, so Embedder and
+CrossEncoderReranker call them unchanged:
+
+  * OnnxEmbedder     — mean pooling over the attention mask + L2 norm (E5)
+  * OnnxCrossEncoder — single-logit relevance score through a sigmoid,
+                       matching CrossEncoder's default for num_labels == 1
+
+Needs `onnxruntime` (and `onnx` + torch/transformers for the export):
+    uv sync --extra onnx
+"""
+import fcntl
+import inspect
+import json
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+META_FILE = "export.json"
+OPSET = 17
+
+
+def model_dir(model_name: str) -> Path:
+    """Export directory for a model, e.g. data/onnx/intfloat--multilingual-e5-base."""
+    return settings.onnx_dir / re.sub(r"[^\w.-]+", "--", model_name.strip("/"))
+
+
+def _max_length(tokenizer) -> int:
+    # Tokenizers without a limit report a huge sentinel value
+    return min(int(getattr(tokenizer, "model_max_length", 512) or 512), 512)
+
+
+def export(model_name: str, kind: str, quantize: bool = True) -> Path:
+    """
+    Export a Hugging Face encoder to ONNX with dynamic batch/sequence axes.
+
+    kind="embedder" exports mean-pooled token embeddings; kind="reranker"
+    exports sequence-classification logits. Returns the export directory.
+    """
+    out_dir = model_dir(model_name)
+    tmp_dir = out_dir.with_name(f".{out_dir.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    try:
+        _export_to(model_name, kind, quantize, tmp_dir)
+        out_dir.mkdir(exist_ok=True)
+        # Model files last: their existence is what marks the export as done
+        model_files = {MODEL_FILE, QUANTIZED_FILE}
+        for path in sorted(tmp_dir.iterdir(), key=lambda p: (p.name in model_files, p.name)):
+            os.replace(path, out_dir / path.name)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return out_dir
+
+
+def _export_to(model_name: str, kind: str, quantize: bool, out_dir: Path):
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if kind == "embedder":
+        model = AutoModel.from_pretrained(model_name)
+    elif kind == "reranker":
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    else:
+        raise ValueError(f"Unknown model kind '{kind}' (expected 'embedder' or 'reranker')")
+    model.eval()
+
+    sample = tokenizer(["query: пример", "passage: пример текста"], padding=True, return_tensors="pt")
+    input_names = [n for n in tokenizer.model_input_names if n in sample]
+
+    class _Wrapper(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            kwargs = dict(zip(input_names, inputs))
+            out = self.model(**kwargs)
+            if kind == "reranker":
+                return out.logits
+            hidden = out.last_hidden_state
+            mask = kwargs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            return (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+    output_name = "logits" if kind == "reranker" else "sentence_embedding"
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in input_names}
+    dynamic_axes[output_name] = {0: "batch"}
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False  # TorchScript exporter: dynamic_axes, no onnxscript dependency
+    logger.info(f"Exporting {kind} '{model_name}' to ONNX → {model_dir(model_name)}")
+    with torch.no_grad():
+        torch.onnx.export(
+            _Wrapper(),
+            tuple(sample[n] for n in input_names),
+            str(out_dir / MODEL_FILE),
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=OPSET,
+            **kwargs,
+        )
+    tokenizer.save_pretrained(out_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info("Quantizing ONNX weights to int8 (dynamic quantization)...")
+        quantize_dynamic(str(out_dir / MODEL_FILE), str(out_dir / QUANTIZED_FILE), weight_type=QuantType.QInt8)
+
+    (out_dir / META_FILE).write_text(json.dumps({
+        "model": model_name,
+        "kind": kind,
+        "input_names": input_names,
+        "output_name": output_name,
+        "opset": OPSET,
+        "quantized": quantize,
+    }, indent=2), encoding="utf-8")
+
+
+def _export_once(model_name: str, kind: str, quantize: bool, path: Path):
+    """Export unless `path` exists; concurrent workers wait on one export instead of racing."""
+    out_dir = model_dir(model_name)
+    out_dir.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_dir.with_name(f".{out_dir.name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not path.exists():
+            export(model_name, kind, quantize=quantize)
+
+
+def _session(model_name: str, kind: str, quantized: bool | None):
+    """(tokenizer, InferenceSession), exporting the model first if needed."""
+    import onnxruntime as ort
+    from transformers import AutoTokenizer
+
+    quantized = settings.onnx_quantize if quantized is None else quantized
+    out_dir = model_dir(model_name)
+    path = out_dir / (QUANTIZED_FILE if quantized else MODEL_FILE)
+    if not path.exists():
+        _export_once(model_name, kind, quantized, path)
+
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if settings.onnx_intra_op_threads > 0:
+        opts.intra_op_num_threads = settings.onnx_intra_op_threads
+    opts.inter_op_num_threads = settings.onnx_inter_op_threads
+    session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+    logger.info(f"ONNX {kind} loaded: {path.name} (intra_op_threads={opts.intra_op_num_threads or 'auto'})")
+    return AutoTokenizer.from_pretrained(out_dir), session
+
+
+class _OnnxModel:
+    def __init__(self, model_name: str, kind: str, quantized: bool | None = None):
+        self.tokenizer, self.session = _session(model_name, kind, quantized)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.max_length = _max_length(self.tokenizer)
+
+    def _run(self, *texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer(
+            *texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        feeds = {n: enc[n].astype("int64") for n in self.input_names}
+        return self.session.run(None, feeds)[0]
+
+
+class OnnxEmbedder(_OnnxModel):
+    """Drop-in for SentenceTransformer.encode on an E5 (mean-pooling) model."""
+
+    def __init__(self, model_name: str, quantized: bool | None = None):
+        super().__init__(model_name, "embedder", quantized)
+
+    def encode(
+        self,
+        sentences: list[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        # Length-sorted batches pad less; results are put back in input order
+        order = np.argsort([len(s) for s in sentences], kind="stable")
+        out = None
+        for start in range(0, len(sentences), batch_size):
+            idx = order[start:start + batch_size]
+            vecs = self._run([sentences[i] for i in idx])
+            if out is None:
+                out = np.empty((len(sentences), vecs.shape[1]), dtype="float32")
+            out[idx] = vecs
+        if out is None:
+            return np.empty((0, 0), dtype="float32")
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Drop-in for CrossEncoder.predict on a single-logit relevance model."""
+
+    def __init__(self, model_name: str, quantized: bool | None = None):
+        super().__init__(model_name, "reranker", quantized)
+
+    def predict(
+        self,
+        sentences: list[tuple[str, str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        scores = np.empty(len(sentences), dtype="float32")
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            logits = self._run([q for q, _ in batch], [p for _, p in batch])
+            scores[start:start + len(batch)] = logits[:, 0]
+        return 1.0 / (1.0 + np.exp(-scores))
+
+    def score_features(self, features: dict[str, np.ndarray]) -> np.ndarray:
+        """Scores for an already tokenized and padded batch (see chunk_tokens.pad_batch)."""
+        logits = self.session.run(None, {n: features[n] for n in self.input_names})[0]
+        return 1.0 / (1.0 + np.exp(-logits[:, 0]))
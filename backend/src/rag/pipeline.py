@@ -1,15 +1,25 @@
-"""Orchestrates: embed → hybrid retrieve → rerank → prompt → LLM → parse."""
+"""Orchestrates: embed → hybrid retrieve → rerank → compress → prompt → LLM → parse."""
+import asyncio
 import json
 import logging
+from typing import AsyncIterator
+
+import numpy as np
 
 from src.config import settings, TOP_K, TOP_N_DIAG
 from src.models import Diagnosis, DiagnoseResponse
-from src.rag.embedder import get_embedder
+from src.rag.embedder import get_embedder, get_query_batcher
 from src.rag.vectorstore import get_vectorstore
 from src.rag.bm25 import get_bm25
 from src.rag.retriever import HybridRetriever, hybrid_search, aggregate_by_protocol
 from src.rag.prompt import build_prompt
-from src.rag.llm import LLMClient
+from src.rag.llm import LLMClient, upstream_stats
+from src.rag.cache import ResponseCache
+from src.rag.compression import get_prompt_compressor
+from src.rag.llm_cache import get_llm_cache
+from src.rag.executor import run_in_thread
+from src.rag.fallback import rank_icd_codes
+from src.rag.timing import span
 
 logger = logging.getLogger(__name__)
 
@@ -19,16 +29,23 @@ class RAGPipeline:
 
     def __init__(self):
         self.embedder = None
+        self.query_batcher = None
         self.vs = None
         self.bm25 = None
         self.retriever: HybridRetriever | None = None
+        self.compressor = None
         self.llm = LLMClient()
+        self.cache = ResponseCache()
         self._ready = False
         self._reranker = None
+        self._late: set[asyncio.Task] = set()  # LLM calls still running after their deadline
+        self.degraded = 0
+        self.late_finished = 0
+        self.late_cancelled = 0
         if settings.use_reranker:
             try:
-                from src.rag.reranker import CrossEncoderReranker
-                self._reranker = CrossEncoderReranker()
+                from src.rag.reranker import get_rerank_scheduler
+                self._reranker = get_rerank_scheduler()
                 logger.info("Cross-encoder reranker initialized.")
             except Exception as e:
                 logger.warning(f"Failed to initialize reranker: {e}. Continuing without reranker.")
@@ -39,7 +56,9 @@ class RAGPipeline:
             self.vs = get_vectorstore()
             self.bm25 = get_bm25()
             self.embedder = get_embedder()
-            if self.vs.index is not None and self.bm25.bm25 is not None:
+            self.query_batcher = get_query_batcher()
+            self.compressor = get_prompt_compressor()
+            if self.vs.index is not None and self.bm25.is_loaded():
                 self.retriever = HybridRetriever(self.vs, self.bm25)
                 self._ready = True
                 logger.info("RAG pipeline ready (FAISS + BM25 loaded).")
@@ -52,67 +71,390 @@ class RAGPipeline:
     def is_ready(self) -> bool:
         return self._ready
 
-    async def diagnose(self, symptoms: str, top_n: int = TOP_N_DIAG) -> DiagnoseResponse:
-        """Main diagnosis method."""
-        if not self._ready:
-            raise RuntimeError("Pipeline not initialized — indexes not loaded.")
+    def stats(self) -> dict:
+        """Cache, upstream LLM and batching-queue counters for GET /stats."""
+        out = {"response_cache": self.cache.stats(), "llm_upstream": upstream_stats.stats()}
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            out["llm_cache"] = llm_cache.stats()
+        if self.query_batcher is not None:
+            out["embed_batcher"] = self.query_batcher.stats()
+        if self._reranker is not None:
+            out["rerank_scheduler"] = self._reranker.stats()
+        if self.compressor is not None:
+            out["prompt_compression"] = self.compressor.stats()
+        out["deadline"] = {
+            "default_s": settings.request_deadline_s,
+            "degraded": self.degraded,
+            "late_llm_max": settings.request_deadline_late_llm_max,
+            "late_llm_in_flight": len(self._late),
+            "late_llm_finished": self.late_finished,
+            "late_llm_cancelled": self.late_cancelled,
+        }
+        return out
 
-        q_vec = self.embedder.encode_query(symptoms)
-        chunks = self.retriever.search(symptoms, q_vec, k=TOP_K)
+    async def _retrieve(self, symptoms: str, q_vec) -> list[dict]:
+        """Hybrid retrieval → cross-encoder re-ranking → protocol aggregation."""
+        chunks = await self.retriever.asearch(symptoms, q_vec, k=TOP_K)
         logger.info(f"Retrieved {len(chunks)} chunks for query (before re-ranking).")
 
         if self._reranker is not None:
             try:
-                chunks = self._reranker.rerank(symptoms, chunks, top_k=TOP_K)
+                with span("rerank"):
+                    chunks = await self._reranker.rerank(symptoms, chunks, top_k=TOP_K)
                 logger.info(f"Chunks re-ranked with cross-encoder (top {len(chunks)} chunks).")
             except Exception as exc:
                 logger.warning(f"Reranker failed, falling back to hybrid ranking only: {exc}")
 
-        chunks = aggregate_by_protocol(chunks, top_protocols=5)
+        with span("aggregate"):
+            # Only the aggregated survivors are materialised as chunk dicts
+            chunks = aggregate_by_protocol(chunks, top_protocols=5).chunks()
         logger.info(f"After protocol aggregation: {len(chunks)} chunks.")
+        return chunks
+
+    async def diagnose(
+        self,
+        symptoms: str,
+        top_n: int = TOP_N_DIAG,
+        use_cache: bool = True,
+        deadline_s: float | None = None,
+    ) -> DiagnoseResponse:
+        """
+        Main diagnosis method. use_cache=False skips cache reads (results are still stored).
+
+        deadline_s (default settings.request_deadline_s, 0 = none) bounds the whole
+        request: if the LLM has not answered by then, a retrieval-only answer
+        flagged `degraded` is returned instead, and the LLM call is cancelled
+        (or left to finish, up to settings.request_deadline_late_llm_max calls).
+        """
+        if not self._ready:
+            raise RuntimeError("Pipeline not initialized — indexes not loaded.")
+        deadline = _deadline(deadline_s)
+
+        with span("cache"):
+            cached = self.cache.get(symptoms, top_n) if use_cache else None
+        if cached is not None:
+            logger.info("Response cache hit.")
+            return cached
+
+        with span("embed"):
+            q_vec = await self.query_batcher.encode_query(symptoms)
+        with span("cache"):
+            cached = self.cache.get_similar(q_vec, top_n) if use_cache else None
+        if cached is not None:
+            logger.info("Response cache hit (near-duplicate query).")
+            return cached
+
+        chunks = await self._retrieve(symptoms, q_vec)
+        return await self._answer_by(symptoms, q_vec, chunks, top_n, use_cache, deadline)
+
+    async def _answer_by(
+        self, symptoms: str, q_vec, chunks: list[dict], top_n: int, use_cache: bool, deadline: float | None
+    ) -> DiagnoseResponse:
+        """`answer`, or the retrieval-only fallback if the LLM misses the (event-loop clock) deadline."""
+        if deadline is None:
+            return await self.answer(symptoms, q_vec, chunks, top_n, use_cache)
+
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining > 0:
+            task = asyncio.ensure_future(self.answer(symptoms, q_vec, chunks, top_n, use_cache))
+            try:
+                done, _ = await asyncio.wait({task}, timeout=remaining)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            if done:
+                return task.result()
+            # The request's admission slot is released with the fallback answer, so
+            # only a bounded number of late LLM calls may keep running (to warm the caches)
+            if len(self._late) < settings.request_deadline_late_llm_max:
+                self._late.add(task)
+                task.add_done_callback(self._late_done)
+            else:
+                task.cancel()
+                self.late_cancelled += 1
+
+        self.degraded += 1
+        logger.warning("LLM missed the deadline — answering from retrieval only.")
+        with span("fallback"):
+            response = retrieval_diagnoses(symptoms, chunks, top_n)
+        response.degraded = True
+        return response
+
+    def _late_done(self, task: asyncio.Task):
+        self._late.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Late LLM call failed: {task.exception()}")
+        else:
+            self.late_finished += 1
 
-        prompt = build_prompt(symptoms, chunks, top_n=top_n)
-        raw_diagnoses = await self.llm.diagnose(prompt, chunks, top_n=top_n)
+    def prompt_chunks(self, q_vec, chunks: list[dict]) -> list[dict]:
+        """Chunks as they go into the prompt: query-relevant sentences only when compression is on."""
+        if self.compressor is None:
+            return chunks
+        with span("compress"):
+            return self.compressor.compress(q_vec, chunks)
+
+    async def answer(
+        self, symptoms: str, q_vec, chunks: list[dict], top_n: int, use_cache: bool
+    ) -> DiagnoseResponse:
+        """
+        Prompt → LLM → parsed diagnoses for already-retrieved chunks. The response
+        is cached only when it came from the model, not from the mock fallback.
+        """
+        prompt_chunks = self.prompt_chunks(q_vec, chunks)
+        with span("prompt"):
+            prompt = build_prompt(symptoms, prompt_chunks, top_n=top_n)
+        with span("llm"):
+            raw_diagnoses, fallback = await self.llm.diagnose(prompt, chunks, top_n=top_n, use_cache=use_cache)
 
         diagnoses = []
         for i, d in enumerate(raw_diagnoses[:top_n]):
-            try:
-                diagnoses.append(Diagnosis(
-                    rank=d.get("rank", i + 1),
-                    diagnosis=str(d.get("diagnosis", "Неизвестный диагноз")),
-                    icd10_code=str(d.get("icd10_code", "Z99")),
-                    explanation=str(d.get("explanation", "")),
-                ))
-            except Exception as exc:
-                logger.warning(f"Skipping malformed diagnosis entry: {exc}")
+            diagnosis = _to_diagnosis(d, i)
+            if diagnosis is not None:
+                diagnoses.append(diagnosis)
+
+        response = DiagnoseResponse(diagnoses=diagnoses)
+        if not fallback:
+            self.cache.put(symptoms, top_n, q_vec, response)
+        return response
 
-        return DiagnoseResponse(diagnoses=diagnoses)
+    async def retrieve_batch(self, queries: list[str]) -> tuple[np.ndarray, list[list[dict]]]:
+        """
+        Vectorised retrieval for many queries: one embedding call, one FAISS
+        matrix search, one sparse BM25 product and one cross-encoder pass.
+        Returns (query embeddings, aggregated chunks per query).
+        """
+        with span("embed"):
+            q_vecs = await run_in_thread(self.embedder.encode, queries, is_query=True)
+        chunk_lists = await self.retriever.asearch_batch(queries, q_vecs, k=TOP_K)
+        if self._reranker is not None:
+            with span("rerank"):
+                chunk_lists = await self._reranker.rerank_batch(queries, chunk_lists, top_k=TOP_K)
+        with span("aggregate"):
+            return q_vecs, [aggregate_by_protocol(chunks, top_protocols=5).chunks() for chunks in chunk_lists]
+
+    async def diagnose_batch(
+        self,
+        symptoms_list: list[str],
+        top_n: int = TOP_N_DIAG,
+        use_cache: bool = True,
+        deadline_s: float | None = None,
+    ) -> list[DiagnoseResponse | Exception]:
+        """
+        Diagnose many cases: batched retrieval for all exact cache misses, a
+        near-duplicate cache lookup with their query embeddings, then LLM
+        calls fanned out under `batch_llm_concurrency`. Results are in input
+        order; a failed item is returned as its exception. The deadline counts
+        from the start of the batch, and items past it get retrieval-only answers.
+        """
+        if not self._ready:
+            raise RuntimeError("Pipeline not initialized — indexes not loaded.")
+        deadline = _deadline(deadline_s)
+
+        results: list[DiagnoseResponse | Exception | None] = [None] * len(symptoms_list)
+        todo: list[int] = []
+        for i, symptoms in enumerate(symptoms_list):
+            if not symptoms or not symptoms.strip():
+                results[i] = ValueError("symptoms must not be empty.")
+                continue
+            cached = self.cache.get(symptoms, top_n) if use_cache else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                todo.append(i)
+        if not todo:
+            return results
+
+        queries = [symptoms_list[i] for i in todo]
+        q_vecs, chunk_lists = await self.retrieve_batch(queries)
+        logger.info(f"Batch retrieval done for {len(todo)} queries.")
+
+        semaphore = asyncio.Semaphore(settings.batch_llm_concurrency)
+
+        async def _one(slot: int, i: int):
+            cached = self.cache.get_similar(q_vecs[slot], top_n) if use_cache else None
+            if cached is not None:
+                results[i] = cached
+                return
+            async with semaphore:
+                try:
+                    results[i] = await self._answer_by(
+                        symptoms_list[i], q_vecs[slot], chunk_lists[slot], top_n, use_cache, deadline
+                    )
+                except Exception as e:
+                    logger.warning(f"Batch item {i} failed: {e}")
+                    results[i] = e
+
+        await asyncio.gather(*[_one(slot, i) for slot, i in enumerate(todo)])
+        return results
+
+    async def diagnose_stream(
+        self,
+        symptoms: str,
+        top_n: int = TOP_N_DIAG,
+        use_cache: bool = True,
+        deadline_s: float | None = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Streaming variant of `diagnose`. Yields events:
+          {"event": "candidates", "protocols": [...]}   — right after retrieval
+          {"event": "diagnosis", "diagnosis": {...}}     — as each one is parsed from the LLM stream
+          {"event": "degraded", "reason": "deadline"}    — the LLM missed the deadline
+          {"event": "done", "diagnoses": [...], "cached": bool, "degraded": bool}
+
+        After a "degraded" event the LLM stream is cancelled and the diagnoses
+        it has not sent yet come from the retrieval-only fallback.
+        """
+        if not self._ready:
+            raise RuntimeError("Pipeline not initialized — indexes not loaded.")
+        deadline = _deadline(deadline_s)
+
+        with span("cache"):
+            cached = self.cache.get(symptoms, top_n) if use_cache else None
+        q_vec = None
+        if cached is None:
+            with span("embed"):
+                q_vec = await self.query_batcher.encode_query(symptoms)
+            with span("cache"):
+                cached = self.cache.get_similar(q_vec, top_n) if use_cache else None
+        if cached is not None:
+            for d in cached.diagnoses:
+                yield {"event": "diagnosis", "diagnosis": d.model_dump()}
+            yield {
+                "event": "done",
+                "diagnoses": [d.model_dump() for d in cached.diagnoses],
+                "cached": True,
+                "degraded": False,
+            }
+            return
+
+        chunks = await self._retrieve(symptoms, q_vec)
+        yield {"event": "candidates", "protocols": protocol_candidates(chunks)}
+
+        prompt_chunks = self.prompt_chunks(q_vec, chunks)
+        with span("prompt"):
+            prompt = build_prompt(symptoms, prompt_chunks, top_n=top_n)
+        diagnoses: list[Diagnosis] = []
+        outcome: dict = {}
+        missed = False
+        stream = self.llm.diagnose_stream(prompt, chunks, top_n=top_n, use_cache=use_cache, outcome=outcome)
+        try:
+            with span("llm"):  # includes time the client takes to consume events
+                while len(diagnoses) < top_n:
+                    remaining = None if deadline is None else deadline - asyncio.get_running_loop().time()
+                    if remaining is not None and remaining <= 0:
+                        missed = True
+                        break
+                    try:
+                        d = await asyncio.wait_for(anext(stream), remaining)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        missed = True
+                        break
+                    diagnosis = _to_diagnosis(d, len(diagnoses))
+                    if diagnosis is not None:
+                        diagnoses.append(diagnosis)
+                        yield {"event": "diagnosis", "diagnosis": diagnosis.model_dump()}
+        finally:
+            await stream.aclose()
+
+        if missed:
+            self.degraded += 1
+            logger.warning("LLM stream missed the deadline — completing from retrieval only.")
+            yield {"event": "degraded", "reason": "deadline"}
+            with span("fallback"):
+                fallback = retrieval_diagnoses(symptoms, chunks, top_n).diagnoses
+            seen = {d.icd10_code for d in diagnoses}
+            for d in fallback:
+                if len(diagnoses) >= top_n:
+                    break
+                if d.icd10_code in seen:
+                    continue
+                diagnoses.append(d.model_copy(update={"rank": len(diagnoses) + 1}))
+                yield {"event": "diagnosis", "diagnosis": diagnoses[-1].model_dump()}
+        elif not outcome.get("fallback"):
+            self.cache.put(symptoms, top_n, q_vec, DiagnoseResponse(diagnoses=diagnoses))
+        yield {
+            "event": "done",
+            "diagnoses": [d.model_dump() for d in diagnoses],
+            "cached": False,
+            "degraded": missed,
+        }
+
+
+def _to_diagnosis(d: dict, i: int) -> Diagnosis | None:
+    """Coerce one raw LLM diagnosis dict into the response model (None if malformed)."""
+    try:
+        return Diagnosis(
+            rank=d.get("rank", i + 1),
+            diagnosis=str(d.get("diagnosis", "Неизвестный диагноз")),
+            icd10_code=str(d.get("icd10_code", "Z99")),
+            explanation=str(d.get("explanation", "")),
+        )
+    except Exception as exc:
+        logger.warning(f"Skipping malformed diagnosis entry: {exc}")
+        return None
+
+
+def protocol_candidates(chunks: list[dict]) -> list[dict]:
+    """Protocol-level view of aggregated chunks (order preserved) for the streaming endpoint."""
+    seen: dict[str, dict] = {}
+    for c in chunks:
+        pid = c["protocol_id"]
+        if pid not in seen:
+            seen[pid] = {
+                "protocol_id": pid,
+                "source_file": c.get("source_file", ""),
+                "icd_codes": list(c.get("icd_codes", [])),
+                "score": float(c.get("protocol_rank_score", 0.0)),
+            }
+    return list(seen.values())
+
+
+def _deadline(deadline_s: float | None) -> float | None:
+    """Absolute event-loop time for a relative deadline (None when disabled)."""
+    deadline_s = settings.request_deadline_s if deadline_s is None else deadline_s
+    if deadline_s <= 0:
+        return None
+    return asyncio.get_running_loop().time() + deadline_s
+
+
+def retrieval_diagnoses(symptoms: str, chunks: list[dict], top_n: int = TOP_N_DIAG) -> DiagnoseResponse:
+    """Diagnoses straight from retrieval, no LLM (see fallback.rank_icd_codes)."""
+    diagnoses = []
+    for i, d in enumerate(rank_icd_codes(symptoms, chunks, top_n)):
+        diagnosis = _to_diagnosis(d, i)
+        if diagnosis is not None:
+            diagnoses.append(diagnosis)
+    return DiagnoseResponse(diagnoses=diagnoses)
 
 
-async def diagnose(symptoms: str | None) -> DiagnoseResponse:
+async def diagnose(symptoms: str | None, use_cache: bool = True) -> DiagnoseResponse:
     """Legacy function interface - uses singleton pipeline."""
     symptoms = symptoms or ""
-    embedder = get_embedder()
-    query_embedding = embedder.encode_query(symptoms)
+    query_embedding = await get_query_batcher().encode_query(symptoms)
 
-    chunks = hybrid_search(symptoms, query_embedding)
+    chunks = await run_in_thread(hybrid_search, symptoms, query_embedding)
 
     if settings.use_reranker:
         try:
-            from src.rag.reranker import CrossEncoderReranker
-            reranker = CrossEncoderReranker()
-            chunks = reranker.rerank(symptoms, chunks, top_k=TOP_K)
+            from src.rag.reranker import get_rerank_scheduler
+            chunks = await get_rerank_scheduler().rerank(symptoms, chunks, top_k=TOP_K)
             logger.debug("Legacy path: chunks re-ranked with cross-encoder.")
         except Exception as _exc:
             logger.warning(f"[Pipeline] Legacy reranker failed, ignoring: {_exc}")
 
-    chunks = aggregate_by_protocol(chunks, top_protocols=5)
+    chunks = aggregate_by_protocol(chunks, top_protocols=5).chunks()
 
     from src.rag.prompt import build_prompt_messages
-    messages = build_prompt_messages(symptoms, chunks)
+    compressor = get_prompt_compressor()
+    prompt_chunks = compressor.compress(query_embedding, chunks) if compressor is not None else chunks
+    messages = build_prompt_messages(symptoms, prompt_chunks)
 
     from src.rag import llm
-    raw = await llm.complete(messages, chunks)
+    raw = await llm.complete(messages, chunks, use_cache=use_cache)
 
     try:
         data = json.loads(raw)
@@ -1,7 +1,11 @@
 """Cross-encoder re-ranker for improving retrieval accuracy."""
 import logging
 
+import numpy as np
+
 from src.config import settings
+from src.rag.candidates import Candidates
+from src.rag.executor import run_in_thread
 
 logger = logging.getLogger(__name__)
 
@@ -15,12 +19,26 @@ class CrossEncoderReranker:
     def __init__(self):
         self._model = None
         self._device = None
+        self.backend: str | None = None  # "torch" | "onnx" once loaded
+        self._template = None  # special-token layout of a (query, chunk) pair
+        self.pairs_scored = 0
+        self.pairs_pretokenized = 0
 
     def _load(self):
         """Lazy load the cross-encoder model."""
         if self._model is not None:
             return
-        
+
+        if settings.inference_backend == "onnx":
+            try:
+                from src.rag.onnx_backend import OnnxCrossEncoder
+                self._model = OnnxCrossEncoder(settings.reranker_model)
+                self._device = "cpu"
+                self.backend = "onnx"
+                return
+            except Exception as e:
+                logger.warning(f"ONNX cross-encoder unavailable ({e}); falling back to PyTorch.")
+
         try:
             from sentence_transformers import CrossEncoder
             import torch
@@ -28,6 +46,7 @@ class CrossEncoderReranker:
             self._device = "cuda" if torch.cuda.is_available() else "cpu"
             logger.info(f"Loading cross-encoder model '{settings.reranker_model}' on device={self._device}...")
             self._model = CrossEncoder(settings.reranker_model, device=self._device)
+            self.backend = "torch"
             logger.info("Cross-encoder model loaded.")
         except ImportError:
             logger.warning("sentence-transformers not available for reranker. Install with: pip install sentence-transformers")
@@ -36,17 +55,17 @@ class CrossEncoderReranker:
             logger.warning(f"Failed to load cross-encoder: {e}. Reranking disabled.")
             self._model = None
 
-    def rerank(self, query: str, chunks: list[dict], top_k: int) -> list[dict]:
+    def rerank(self, query: str, chunks: Candidates, top_k: int) -> Candidates:
         """
         Re-rank chunks using cross-encoder.
         
         Args:
             query: User query/symptoms
-            chunks: List of retrieved chunks (from hybrid search)
+            chunks: Retrieved candidates (from hybrid search)
             top_k: Number of top chunks to return after re-ranking
             
         Returns:
-            Re-ranked list of chunks, sorted by cross-encoder score (descending)
+            Re-ranked candidates with a 'reranker' score, sorted by it (descending)
         """
         if not chunks:
             return chunks
@@ -58,31 +77,172 @@ class CrossEncoderReranker:
             return chunks[:top_k]
         
         try:
-            # Prepare query-chunk pairs for cross-encoder
-            # Handle both 'chunk' and 'text' field names
-            chunk_texts = [
-                c.get("chunk", c.get("text", ""))
-                for c in chunks
-            ]
-            
-            # Cross-encoder expects list of (query, passage) pairs
-            pairs = [(query, text) for text in chunk_texts]
-            
-            # Get relevance scores (higher = more relevant)
-            scores = self._model.predict(pairs)
-            
-            # Combine scores with original chunks and sort
-            scored_chunks = [
-                {**chunk, "reranker_score": float(score)}
-                for chunk, score in zip(chunks, scores)
-            ]
-            
-            # Sort by reranker score (descending)
-            scored_chunks.sort(key=lambda x: x["reranker_score"], reverse=True)
-            
-            logger.debug(f"Re-ranked {len(chunks)} chunks, returning top {top_k}")
-            return scored_chunks[:top_k]
-            
+            scores = self.score([(query, chunks)])[0]
+            return self.apply_scores(chunks, scores, top_k)
         except Exception as e:
             logger.warning(f"Reranking failed: {e}. Returning original ranking.")
             return chunks[:top_k]
+
+    def _passage_ids(self, chunks: Candidates, i: int, tokens) -> np.ndarray | list[int]:
+        """Precomputed token ids for a candidate from the index bundle, else tokenize its text."""
+        if tokens is not None:
+            self.pairs_pretokenized += 1
+            return tokens.get(int(chunks.rows[i]))
+        return self._model.tokenizer(chunks.text(i), add_special_tokens=False, verbose=False)["input_ids"]
+
+    def _forward(self, features: dict[str, np.ndarray]) -> np.ndarray:
+        """Relevance scores (higher = more relevant) for one padded batch."""
+        if self.backend == "onnx":
+            return self._model.score_features(features)
+        import torch
+
+        model = self._model.model
+        with torch.inference_mode():
+            logits = model(**{k: torch.from_numpy(v).to(model.device) for k, v in features.items()}).logits
+            # Same activation CrossEncoder.predict applies (sigmoid for single-logit models)
+            activation = getattr(self._model, "activation_fn", None) or getattr(
+                self._model, "default_activation_function", None
+            )
+            if activation is not None:
+                logits = activation(logits)
+        return logits[:, 0].float().cpu().numpy()
+
+    def score(self, requests: list[tuple[str, Candidates]]) -> list[np.ndarray | None]:
+        """
+        Score the (query, chunk) pairs of several requests at once.
+
+        Only queries are tokenized here: chunk token ids come precomputed from
+        the index bundle (see chunk_tokens.py). Pairs from all requests are
+        merged and sorted by token length, so each batch of at most
+        `rerank_batch_pairs` pads only to its own longest pair. Scores are then
+        split back per request. Returns None per request when the model is
+        unavailable.
+        """
+        from src.rag.chunk_tokens import PairTemplate, get_chunk_tokens, max_pair_length, pad_batch
+
+        self._load()
+        if self._model is None:
+            return [None] * len(requests)
+        tokenizer = self._model.tokenizer
+        if self._template is None:
+            self._template = PairTemplate.from_tokenizer(tokenizer)
+        max_length = getattr(self._model, "max_length", None)
+        if not isinstance(max_length, int):
+            max_length = max_pair_length(tokenizer)
+        tokens = get_chunk_tokens()
+
+        seqs: list[list[int]] = []
+        types: list[list[int] | None] = []
+        owners: list[tuple[int, int]] = []
+        for r, (query, chunks) in enumerate(requests):
+            q_ids = tokenizer(query, add_special_tokens=False, verbose=False)["input_ids"]
+            # Token rows are only valid for the chunk store they were built from
+            chunk_tokens = tokens if tokens is not None and len(tokens) == len(chunks.store) else None
+            for j in range(len(chunks)):
+                ids, tt = self._template.build(q_ids, self._passage_ids(chunks, j, chunk_tokens), max_length)
+                seqs.append(ids)
+                types.append(tt)
+                owners.append((r, j))
+        out = [np.zeros(len(chunks), dtype="float32") for _, chunks in requests]
+
+        input_names = list(getattr(self._model, "input_names", None) or tokenizer.model_input_names)
+        order = sorted(range(len(seqs)), key=lambda i: len(seqs[i]))
+        batch_size = max(1, settings.rerank_batch_pairs)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            features = pad_batch(
+                [seqs[i] for i in idx], [types[i] for i in idx], tokenizer.pad_token_id or 0, input_names
+            )
+            for i, score in zip(idx, self._forward(features)):
+                r, j = owners[i]
+                out[r][j] = score
+        self.pairs_scored += len(seqs)
+        return out
+
+    @staticmethod
+    def apply_scores(chunks: Candidates, scores: np.ndarray, top_k: int) -> Candidates:
+        """Attach cross-encoder scores to the candidates and return the top_k by score."""
+        order = np.argsort(-np.asarray(scores, dtype="float64"), kind="stable")[:top_k]
+        logger.debug(f"Re-ranked {len(chunks)} chunks, returning top {top_k}")
+        return chunks.with_score("reranker", scores).take(order)
+
+
+class RerankScheduler:
+    """
+    Shared scheduler that merges the rerank pairs of all in-flight requests.
+
+    Requests arriving within `rerank_max_wait_ms` of each other (up to
+    `rerank_max_requests`) are scored in one `CrossEncoderReranker.score` call,
+    trading a few ms of latency for much higher cross-encoder throughput.
+    """
+
+    def __init__(
+        self,
+        reranker: CrossEncoderReranker,
+        max_requests: int | None = None,
+        max_wait_ms: float | None = None,
+    ):
+        from src.rag.batching import MicroBatcher
+
+        self.reranker = reranker
+        self._batcher = MicroBatcher(
+            reranker.score,
+            max_batch_size=max_requests or settings.rerank_max_requests,
+            max_wait_ms=settings.rerank_max_wait_ms if max_wait_ms is None else max_wait_ms,
+            name="rerank",
+        )
+
+    async def rerank(self, query: str, chunks: Candidates, top_k: int) -> Candidates:
+        """Async counterpart of `CrossEncoderReranker.rerank` going through the shared queue."""
+        if not chunks:
+            return chunks
+        try:
+            scores = await self._batcher.submit((query, chunks))
+        except Exception as e:
+            logger.warning(f"Reranking failed: {e}. Returning original ranking.")
+            return chunks[:top_k]
+        if scores is None:
+            logger.debug("Reranker model not available, returning original ranking.")
+            return chunks[:top_k]
+        return self.reranker.apply_scores(chunks, scores, top_k)
+
+    async def rerank_batch(
+        self, queries: list[str], chunk_lists: list[Candidates], top_k: int
+    ) -> list[Candidates]:
+        """Re-rank an already-batched set of requests in one `score` call, bypassing the queue."""
+        try:
+            scores = await run_in_thread(self.reranker.score, list(zip(queries, chunk_lists)))
+        except Exception as e:
+            logger.warning(f"Batch reranking failed: {e}. Returning original ranking.")
+            return [chunks[:top_k] for chunks in chunk_lists]
+        return [
+            chunks[:top_k] if s is None else self.reranker.apply_scores(chunks, s, top_k)
+            for chunks, s in zip(chunk_lists, scores)
+        ]
+
+    def stats(self) -> dict:
+        return {
+            **self._batcher.stats(),
+            "pairs_scored": self.reranker.pairs_scored,
+            "pairs_pretokenized": self.reranker.pairs_pretokenized,
+        }
+
+
+_reranker: CrossEncoderReranker | None = None
+_scheduler: RerankScheduler | None = None
+
+
+def get_reranker() -> CrossEncoderReranker:
+    """Get singleton CrossEncoderReranker instance."""
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker()
+    return _reranker
+
+
+def get_rerank_scheduler() -> RerankScheduler:
+    """Get singleton RerankScheduler wrapping the singleton reranker."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RerankScheduler(get_reranker())
+    return _scheduler
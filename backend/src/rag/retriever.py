@@ -1,92 +1,183 @@
-"""Hybrid retriever: FAISS (dense) + BM25 (sparse) fused via Reciprocal Rank Fusion."""
+"""Hybrid retriever: FAISS (dense) + BM25 (sparse) fused via Reciprocal Rank Fusion.
+
+Fusion and protocol aggregation are vectorised over integer chunk rows and
+protocol rows (see candidates.py), so a whole batch of queries is fused with
+a few NumPy calls instead of per-chunk dict updates."""
+import asyncio
 import logging
-from collections import defaultdict
 
 import numpy as np
 
 from src.config import settings
 from src.rag.bm25 import BM25Index
+from src.rag.candidates import Candidates
+from src.rag.timing import span, timed
 from src.rag.vectorstore import VectorStore
 
 logger = logging.getLogger(__name__)
 
 RRF_K = 60  # RRF constant — standard value from the 2009 paper
+FUSION_MODES = ("rrf", "minmax", "zscore")
+POOLING_MODES = ("max", "sum", "mean_top_m")
 
 
-def _rrf_score(rank: int, k: int = RRF_K) -> float:
-    """Calculate Reciprocal Rank Fusion score."""
+def _rrf_score(rank, k: int = RRF_K):
+    """Calculate Reciprocal Rank Fusion score (works on rank arrays too)."""
     return 1.0 / (k + rank + 1)
 
 
-def reciprocal_rank_fusion(
-    dense_results: list[dict],
-    sparse_results: list[dict],
+def _normalise(scores: np.ndarray, segments: np.ndarray, n_segments: int, mode: str) -> np.ndarray:
+    """Per-segment (one retriever's list for one query) min-max or z-score normalisation."""
+    if mode == "minmax":
+        lo = np.full(n_segments, np.inf)
+        hi = np.full(n_segments, -np.inf)
+        np.minimum.at(lo, segments, scores)
+        np.maximum.at(hi, segments, scores)
+        lo, width = lo[segments], (hi - lo)[segments]
+        return np.divide(scores - lo, width, out=np.ones_like(scores), where=width > 0)
+    counts = np.maximum(np.bincount(segments, minlength=n_segments), 1)
+    mean = (np.bincount(segments, weights=scores, minlength=n_segments) / counts)[segments]
+    std = np.sqrt(np.bincount(segments, weights=(scores - mean) ** 2, minlength=n_segments) / counts)[segments]
+    return np.divide(scores - mean, std, out=np.zeros_like(scores), where=std > 0)
+
+
+def fuse_batch(
+    dense_batch: list[Candidates],
+    sparse_batch: list[Candidates],
     top_k: int,
     k: int = RRF_K,
-) -> list[dict]:
+    mode: str = "rrf",
+    weights: tuple[float, float] = (1.0, 1.0),
+) -> list[Candidates]:
     """
-    Merge two ranked lists using RRF.
-    Deduplicates by (protocol_id, chunk_index/chunk_idx).
-    Returns top_k fused results sorted by descending RRF score.
+    Fuse the dense and sparse candidate lists of many queries in one pass.
+
+    Every (query, chunk row) pair gets the weighted sum of its per-retriever
+    contributions with one segment reduction (`np.add.reduceat`):
+      * rrf    — 1 / (k + rank + 1), Reciprocal Rank Fusion (score name 'rrf');
+      * minmax — retriever score min-max scaled to [0, 1] per query (score name 'fused');
+      * zscore — retriever score standardised per query (score name 'fused').
+    A chunk missing from one list contributes 0 for it. Results are sorted by
+    descending fused score; ties keep first-seen order (dense list first, then
+    sparse), as the dict-based RRF did. Returns top_k candidates per query.
     """
-    scores: dict[str, float] = {}
-    items: dict[str, dict] = {}
-
-    for rank, chunk in enumerate(dense_results):
-        chunk_idx = chunk.get("chunk_index", chunk.get("chunk_idx", 0))
-        key = f"{chunk['protocol_id']}:{chunk_idx}"
-        scores[key] = scores.get(key, 0.0) + _rrf_score(rank, k)
-        items[key] = chunk
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Unknown fusion mode {mode!r} (expected one of {FUSION_MODES})")
+    lists = [c for pair in zip(dense_batch, sparse_batch) for c in pair]  # q0 dense, q0 sparse, q1 dense, ...
+    store = next((c.store for c in lists if c.store is not None), None)
+    n_queries = len(dense_batch)
+    lengths = np.array([len(c) for c in lists], dtype="int64")
+    segments = np.repeat(np.arange(len(lists)), lengths)
+    if not len(segments):
+        return [Candidates(store, np.empty(0, dtype="int64"), {"rrf": np.empty(0)}) for _ in range(n_queries)]
+
+    rows = np.concatenate([c.rows for c in lists])
+    list_starts = np.cumsum(lengths) - lengths
+    ranks = np.arange(len(rows)) - list_starts[segments]
+    if mode == "rrf":
+        contrib = _rrf_score(ranks, k)
+        name = "rrf"
+    else:
+        score_names = ("dense", "sparse")
+        raw = np.concatenate([
+            np.asarray(c.scores[score_names[i % 2]], dtype="float64") for i, c in enumerate(lists)
+        ])
+        contrib = _normalise(raw, segments, len(lists), mode)
+        name = "fused"
+    w_dense, w_sparse = weights
+    if (w_dense, w_sparse) != (1.0, 1.0):
+        contrib = contrib * np.where(segments % 2 == 0, w_dense, w_sparse)
+
+    # One slot per (query, row). A stable sort keeps each slot's entries in list
+    # order, so sums run dense-then-sparse and `first` is the first-seen position.
+    query = segments // 2
+    keys = query * (int(rows.max()) + 1) + rows
+    by_key = np.argsort(keys, kind="stable")
+    sorted_keys = keys[by_key]
+    slot_starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    fused = np.add.reduceat(contrib[by_key], slot_starts)
+    first = by_key[slot_starts]
+    slot_query = query[first]
+    order = np.lexsort((first, -fused, slot_query))
+
+    counts = np.bincount(slot_query, minlength=n_queries)
+    results = []
+    for start, end in zip(np.cumsum(counts) - counts, np.cumsum(counts)):
+        top = order[start:end][:top_k]
+        results.append(Candidates(store, rows[first[top]], {name: fused[top]}))
+    return results
 
-    for rank, chunk in enumerate(sparse_results):
-        chunk_idx = chunk.get("chunk_index", chunk.get("chunk_idx", 0))
-        key = f"{chunk['protocol_id']}:{chunk_idx}"
-        scores[key] = scores.get(key, 0.0) + _rrf_score(rank, k)
-        if key not in items:
-            items[key] = chunk
 
-    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
-    return [{**items[k], "rrf_score": s} for k, s in ranked]
+def reciprocal_rank_fusion(
+    dense_results: Candidates,
+    sparse_results: Candidates,
+    top_k: int,
+    k: int = RRF_K,
+    mode: str = "rrf",
+    weights: tuple[float, float] = (1.0, 1.0),
+) -> Candidates:
+    """
+    Merge two ranked candidate lists (RRF by default, see `fuse_batch`).
+    Deduplicates by chunk-store row (one row per protocol_id/chunk_index).
+    Returns top_k fused candidates sorted by descending score.
+    """
+    return fuse_batch([dense_results], [sparse_results], top_k, k=k, mode=mode, weights=weights)[0]
 
 
-def aggregate_by_protocol(chunks: list[dict], top_protocols: int = 5) -> list[dict]:
+def aggregate_by_protocol(
+    candidates: Candidates,
+    top_protocols: int = 5,
+    pooling: str | None = None,
+    top_m: int | None = None,
+) -> Candidates:
     """
-    Aggregate chunk-level scores by protocol_id.
-    Returns chunks re-ordered so that chunks from the highest-scoring protocols
+    Aggregate chunk-level scores by protocol.
+
+    The protocol score pools its chunks' scores (cross-encoder if re-ranked,
+    else fusion), per `pooling` (default settings.protocol_pooling):
+      * max        — best chunk, ties broken by the sum (the original ranking);
+      * sum        — sum over chunks, ties broken by the best chunk;
+      * mean_top_m — mean of the best `top_m` chunks, ties broken by the best chunk.
+    Returns candidates re-ordered so that chunks from the highest-scoring protocols
     come first, preserving intra-protocol chunk ordering by score.
     """
-    protocol_data: dict[str, dict] = defaultdict(
-        lambda: {"total_score": 0.0, "max_score": 0.0, "chunk_count": 0, "chunks": []}
-    )
-
-    for c in chunks:
-        pid = c["protocol_id"]
-        score = c.get("reranker_score", c.get("rrf_score", 0.0))
-        protocol_data[pid]["total_score"] += score
-        protocol_data[pid]["max_score"] = max(protocol_data[pid]["max_score"], score)
-        protocol_data[pid]["chunk_count"] += 1
-        protocol_data[pid]["chunks"].append(c)
-
-    ranked_protocols = sorted(
-        protocol_data.items(),
-        key=lambda x: (x[1]["max_score"], x[1]["total_score"]),
-        reverse=True,
-    )[:top_protocols]
-
-    result: list[dict] = []
-    for pid, data in ranked_protocols:
-        sorted_chunks = sorted(
-            data["chunks"],
-            key=lambda c: c.get("reranker_score", c.get("rrf_score", 0.0)),
-            reverse=True,
-        )
-        for c in sorted_chunks:
-            c["protocol_rank_score"] = data["max_score"]
-        result.extend(sorted_chunks)
-
+    pooling = pooling or settings.protocol_pooling
+    if pooling not in POOLING_MODES:
+        raise ValueError(f"Unknown protocol pooling {pooling!r} (expected one of {POOLING_MODES})")
+    scores = np.asarray(candidates.rank_scores(), dtype="float64")
+    protocols, first, inverse = np.unique(candidates.protocols(), return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    n = len(protocols)
+
+    total = np.zeros(n)
+    np.add.at(total, inverse, scores)
+    best = np.zeros(n)  # floor of 0.0, as the dict-based version had
+    np.maximum.at(best, inverse, scores)
+    if pooling == "max":
+        pooled, tiebreak = best, total
+    elif pooling == "sum":
+        pooled, tiebreak = total, best
+    else:
+        top_m = top_m or settings.protocol_pool_top_m
+        by_protocol = np.lexsort((-scores, inverse))  # protocol-major, best chunk first
+        starts = np.searchsorted(inverse[by_protocol], np.arange(n))
+        within = np.arange(len(scores)) - starts[inverse[by_protocol]]
+        kept = by_protocol[within < top_m]
+        top_sum = np.zeros(n)
+        np.add.at(top_sum, inverse[kept], scores[kept])
+        pooled, tiebreak = top_sum / np.minimum(np.bincount(inverse, minlength=n), top_m), best
+
+    ranked = np.lexsort((first, -tiebreak, -pooled))[:top_protocols]
+    place = np.full(n, n)
+    place[ranked] = np.arange(len(ranked))
+    chunk_place = place[inverse]
+    order = np.lexsort((-scores, chunk_place))  # stable: ties keep retrieval order
+    order = order[chunk_place[order] < n]
+
+    result = candidates.take(order).with_score("protocol_rank", pooled[inverse[order]])
     logger.debug(
-        f"Protocol aggregation: {len(chunks)} chunks → "
-        f"{len(ranked_protocols)} protocols → {len(result)} chunks"
+        f"Protocol aggregation: {len(candidates)} chunks → "
+        f"{len(ranked)} protocols → {len(result)} chunks"
     )
     return result
 
@@ -98,16 +189,52 @@ class HybridRetriever:
         self.vs = vector_store
         self.bm25 = bm25_index
 
-    def search(self, query: str, query_embedding: np.ndarray, k: int) -> list[dict]:
+    @staticmethod
+    def fuse(dense_batch: list[Candidates], sparse_batch: list[Candidates], k: int) -> list[Candidates]:
+        """`fuse_batch` with the fusion mode, RRF constant and retriever weights from settings."""
+        return fuse_batch(
+            dense_batch,
+            sparse_batch,
+            top_k=k,
+            k=settings.rrf_k,
+            mode=settings.fusion_mode,
+            weights=(settings.fusion_dense_weight, settings.fusion_sparse_weight),
+        )
+
+    def search(self, query: str, query_embedding: np.ndarray, k: int) -> Candidates:
         """Perform hybrid search and return fused results."""
         dense_results = self.vs.search(query_embedding, top_k=k)
         sparse_results = self.bm25.search(query, top_k=k)
-        fused = reciprocal_rank_fusion(dense_results, sparse_results, top_k=k, k=settings.rrf_k)
+        fused = self.fuse([dense_results], [sparse_results], k)[0]
         logger.debug(f"Hybrid search: {len(dense_results)} dense + {len(sparse_results)} sparse → {len(fused)} fused")
         return fused
 
+    async def asearch(self, query: str, query_embedding: np.ndarray, k: int) -> Candidates:
+        """Async hybrid search: dense and sparse retrieval run concurrently on the executors."""
+        from src.rag.executor import run_bm25_search, run_in_thread
+
+        dense_results, sparse_results = await asyncio.gather(
+            timed("dense", run_in_thread(self.vs.search, query_embedding, top_k=k)),
+            timed("sparse", run_bm25_search(self.bm25, query, top_k=k)),
+        )
+        with span("fusion"):
+            fused = self.fuse([dense_results], [sparse_results], k)[0]
+        logger.debug(f"Hybrid search: {len(dense_results)} dense + {len(sparse_results)} sparse → {len(fused)} fused")
+        return fused
+
+    async def asearch_batch(self, queries: list[str], query_embeddings: np.ndarray, k: int) -> list[Candidates]:
+        """Hybrid search for many queries: one FAISS matrix search + one sparse BM25 product."""
+        from src.rag.executor import run_in_thread
+
+        dense_batch, sparse_batch = await asyncio.gather(
+            timed("dense", run_in_thread(self.vs.search_batch, query_embeddings, top_k=k)),
+            timed("sparse", run_in_thread(self.bm25.search_batch, queries, top_k=k)),
+        )
+        with span("fusion"):
+            return self.fuse(dense_batch, sparse_batch, k)
+
 
-def hybrid_search(query: str, query_embedding: np.ndarray, top_k: int | None = None) -> list[dict]:
+def hybrid_search(query: str, query_embedding: np.ndarray, top_k: int | None = None) -> Candidates:
     """Convenience function for hybrid search using singleton instances."""
     from src.rag.vectorstore import get_vectorstore
     from src.rag.bm25 import get_bm25
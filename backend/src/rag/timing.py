@@ -0,0 +1,144 @@
+"""Per-stage latency spans for the diagnosis pipeline.
+
+Each stage (embed, dense, sparse, fusion, rerank, aggregate, prompt, llm, ...)
+is wrapped in `span(stage)`. A span is observed in two places:
+
+  * a process-wide Prometheus histogram, rendered in text exposition format
+    by `render_metrics()` for GET /metrics;
+  * the current request's `RequestTimings` (held in a ContextVar, so it follows
+    the request through awaits and child tasks), which main.py turns into a
+    `Server-Timing` header and, with TIMING_LOG=true, one JSON log line.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, TypeVar
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds; spans range from sub-millisecond (fusion) to tens of seconds (LLM)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Minimal Prometheus histogram (cumulative buckets, _sum, _count) with labels."""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...], buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: dict[tuple[str, ...], list] = {}  # labels → [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                labels = ",".join(f'{n}="{v}"' for n, v in zip(self.labelnames, key))
+                sep = "," if labels else ""
+                for bound, c in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {c}')
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "diagnose_stage_seconds", "Time spent in each diagnosis pipeline stage.", ("stage",)
+)
+request_seconds = Histogram(
+    "http_request_duration_seconds", "End-to-end HTTP request latency.", ("method", "path", "status")
+)
+
+
+class RequestTimings:
+    """Stage durations of one request; repeated stages are summed."""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total_s: float | None = None) -> str:
+        """Value for the `Server-Timing` response header (durations in ms)."""
+        parts = [f"{stage};dur={s * 1000:.1f}" for stage, s in self.stages.items()]
+        if total_s is not None:
+            parts.append(f"total;dur={total_s * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self) -> dict[str, float]:
+        return {stage: round(s * 1000, 2) for stage, s in self.stages.items()}
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> RequestTimings:
+    """Attach a fresh RequestTimings to the current context (call once per request)."""
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current() -> RequestTimings | None:
+    return _current.get()
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block; works around `await`s as well as plain code."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        stage_seconds.observe(elapsed, stage=stage)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+async def timed(stage: str, awaitable: Awaitable[T]) -> T:
+    """`await` under a span — for awaitables passed to asyncio.gather."""
+    with span(stage):
+        return await awaitable
+
+
+def log_request(method: str, path: str, status: int, total_s: float, timings: RequestTimings):
+    """One JSON line per request with its stage breakdown (only when TIMING_LOG=true)."""
+    if not settings.timing_log:
+        return
+    logger.info(json.dumps({
+        "method": method,
+        "path": path,
+        "status": status,
+        "total_ms": round(total_s * 1000, 2),
+        "stages_ms": timings.as_dict(),
+    }))
+
+
+def render_metrics() -> str:
+    """All histograms in Prometheus text exposition format."""
+    return "\n".join(stage_seconds.render() + request_seconds.render()) + "\n"
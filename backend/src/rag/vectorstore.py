@@ -7,59 +7,192 @@ import faiss
 import numpy as np
 
 from src.config import settings
+from src.rag.candidates import Candidates
+from src.rag.chunkstore import ChunkStore, get_chunkstore, replacing, update_manifest
 
 logger = logging.getLogger(__name__)
 
 
+def _read_index_mmap(path: Path):
+    """Read a FAISS index with mmap so its vectors are paged in on demand."""
+    try:
+        return faiss.read_index(str(path), faiss.IO_FLAG_MMAP)
+    except RuntimeError as e:
+        logger.info(f"mmap read not supported for this index type ({e}); reading into memory.")
+        return faiss.read_index(str(path))
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+def _ivf_nlist(n_vectors: int) -> int:
+    if settings.ivf_nlist > 0:
+        return settings.ivf_nlist
+    # ~4·sqrt(n), but keep ≥39 training points per centroid as FAISS recommends
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+
+def make_index(dim: int, n_vectors: int, index_type: str | None = None):
+    """Create an untrained inner-product FAISS index of the configured type."""
+    index_type = index_type or settings.faiss_index_type
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dim)  # cosine (vecs already normalized)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+        return index
+    if index_type in ("ivf_flat", "ivf_pq"):
+        quantizer = faiss.IndexFlatIP(dim)
+        nlist = _ivf_nlist(n_vectors)
+        if index_type == "ivf_flat":
+            return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexIVFPQ(
+            quantizer, dim, nlist, settings.pq_m, settings.pq_nbits, faiss.METRIC_INNER_PRODUCT
+        )
+    raise ValueError(f"Unknown faiss_index_type '{index_type}' (expected one of {INDEX_TYPES})")
+
+
+def base_index(index):
+    """The index inside an IndexIDMap/IndexIDMap2 wrapper (or the index itself)."""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def apply_search_params(index):
+    """Set query-time knobs (efSearch, nprobe) from settings on a built or loaded index."""
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = settings.hnsw_ef_search
+    try:
+        faiss.extract_index_ivf(index).nprobe = settings.ivf_nprobe
+    except RuntimeError:
+        pass  # not an IVF index
+
+
+def index_type_of(index) -> str:
+    index = base_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
 class VectorStore:
     def __init__(self):
         self.index = None
-        self.metadata: list[dict] = []
+        self.metadata: ChunkStore | None = None
+
+    def build(self, embeddings: np.ndarray, metadata: ChunkStore | list[dict], index_type: str | None = None):
+        """Build (and train, for IVF types) a FAISS index from embeddings and metadata.
+
+        Vectors are added under their chunk ids through an IndexIDMap2, so an
+        incremental update can later delete them by id."""
+        n, dim = embeddings.shape
+        if not isinstance(metadata, ChunkStore):
+            metadata = ChunkStore.from_chunks(metadata)
+        ids = metadata.ids
+        self.index = self._make_id_index(embeddings, ids, index_type)
+        self.metadata = metadata
+        logger.info(f"FAISS {index_type_of(self.index)} index built: {self.index.ntotal} vectors (dim={dim})")
+
+    @staticmethod
+    def _make_id_index(embeddings: np.ndarray, ids: np.ndarray, index_type: str | None):
+        n, dim = embeddings.shape
+        base = make_index(dim, n, index_type)
+        if not base.is_trained:
+            logger.info(f"Training {index_type_of(base)} index on {n} vectors...")
+            base.train(embeddings)
+        index = faiss.IndexIDMap2(base)
+        index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+        apply_search_params(index)
+        return index
+
+    def update(self, remove_ids: np.ndarray, embeddings: np.ndarray, ids: np.ndarray, metadata: ChunkStore):
+        """
+        Incremental update in place: delete vectors by chunk id, add new ones.
 
-    def build(self, embeddings: np.ndarray, metadata: list[dict]):
-        """Build FAISS index from embeddings and metadata."""
-        dim = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dim)  # cosine (vecs already normalized)
-        self.index.add(embeddings)
+        HNSW graphs cannot delete; for them the graph is rebuilt from the stored
+        vectors that remain (no re-embedding). IVF types keep their trained
+        quantizer, so heavy corpus drift calls for a periodic full rebuild.
+        """
+        if not isinstance(self.index, faiss.IndexIDMap2):
+            raise ValueError("Incremental updates need an IndexIDMap2 index — run a full build first.")
+        remove_ids = np.asarray(remove_ids, dtype="int64")
+        if len(remove_ids):
+            try:
+                self.index.remove_ids(remove_ids)
+            except RuntimeError:
+                logger.info(f"{index_type_of(self.index)} index cannot remove ids; rebuilding from stored vectors.")
+                old_ids = faiss.vector_to_array(self.index.id_map)
+                keep = ~np.isin(old_ids, remove_ids)
+                vectors = base_index(self.index).reconstruct_n(0, self.index.ntotal)[keep]
+                self.index = self._make_id_index(vectors, old_ids[keep], index_type_of(self.index))
+        if len(embeddings):
+            self.index.add_with_ids(np.ascontiguousarray(embeddings, dtype="float32"), np.asarray(ids, dtype="int64"))
         self.metadata = metadata
-        logger.info(f"FAISS index built: {self.index.ntotal} vectors (dim={dim})")
+        logger.info(
+            f"FAISS index updated: -{len(remove_ids)} +{len(embeddings)} vectors → {self.index.ntotal}"
+        )
 
     def save(self):
-        """Save FAISS index and metadata to disk."""
+        """Save the FAISS index into the index bundle (chunk metadata is saved by ChunkStore)."""
         index_path = settings.index_dir / "faiss.index"
-        meta_path = settings.index_dir / "metadata.pkl"
         index_path.parent.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self.index, str(index_path))
-        with open(meta_path, "wb") as f:
-            pickle.dump(self.metadata, f)
+        with replacing(index_path) as tmp:
+            faiss.write_index(self.index, str(tmp))
+        update_manifest("faiss", {
+            "file": index_path.name,
+            "ntotal": int(self.index.ntotal),
+            "dim": int(self.index.d),
+            "index_type": index_type_of(self.index),
+            "id_map": isinstance(self.index, faiss.IndexIDMap2),
+        })
         logger.info(f"FAISS index saved → {index_path}")
 
-    def load(self) -> bool:
-        """Load FAISS index and metadata from disk."""
+    def load(self, mmap: bool = True, store: ChunkStore | None = None) -> bool:
+        """Load FAISS index (memory-mapped unless it is about to be modified) and chunk
+        metadata from the index bundle. `store` replaces the process-wide mapped
+        ChunkStore (index_corpus.py passes an in-memory copy it is about to rewrite).
+
+        Falls back to the legacy faiss.index + metadata.pkl layout."""
         index_path = settings.index_dir / "faiss.index"
-        meta_path = settings.index_dir / "metadata.pkl"
-        if not index_path.exists() or not meta_path.exists():
+        if not index_path.exists():
             return False
-        self.index = faiss.read_index(str(index_path))
-        with open(meta_path, "rb") as f:
-            self.metadata = pickle.load(f)
-        logger.info(f"FAISS index loaded: {self.index.ntotal} vectors")
+        store = store if store is not None else get_chunkstore()
+        if store is not None:
+            self.index = _read_index_mmap(index_path) if mmap else faiss.read_index(str(index_path))
+            self.metadata = store
+        else:
+            meta_path = settings.index_dir / "metadata.pkl"
+            if not meta_path.exists():
+                return False
+            self.index = faiss.read_index(str(index_path))
+            with open(meta_path, "rb") as f:
+                self.metadata = ChunkStore.from_chunks(pickle.load(f))
+            logger.info("Loaded legacy metadata.pkl — rebuild with index_corpus.py for the mmap bundle.")
+        apply_search_params(self.index)
+        logger.info(f"FAISS {index_type_of(self.index)} index loaded: {self.index.ntotal} vectors")
         return True
 
-    def search(self, query_embedding: np.ndarray, top_k: int) -> list[dict]:
-        """Returns list of chunk dicts with added 'score' and 'dense_rank' fields."""
+    def search(self, query_embedding: np.ndarray, top_k: int) -> Candidates:
+        """Top-k chunk rows with their 'dense' (inner product) scores."""
+        return self.search_batch(query_embedding.reshape(1, -1), top_k)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, top_k: int) -> list[Candidates]:
+        """Search many queries with one matrix `index.search` call."""
         if self.index is None:
             raise RuntimeError("FAISS index not loaded. Call load() first.")
-        query = query_embedding.reshape(1, -1).astype("float32")
-        scores, indices = self.index.search(query, top_k)
+        queries = np.ascontiguousarray(query_embeddings, dtype="float32")
+        scores, indices = self.index.search(queries, top_k)
+        rows = self.metadata.rows(indices)
         results = []
-        for rank, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < 0:
-                continue
-            chunk = dict(self.metadata[idx])
-            chunk["dense_score"] = float(score)
-            chunk["dense_rank"] = rank
-            results.append(chunk)
+        for q_scores, q_rows in zip(scores, rows):
+            found = q_rows >= 0  # FAISS pads with -1 when fewer than top_k vectors match
+            results.append(Candidates(self.metadata, q_rows[found], {"dense": q_scores[found]}))
         return results
 
 
@@ -0,0 +1,216 @@
+"""Preload-then-fork multi-worker server.
+
+`uvicorn --workers N` starts N fresh interpreters, and each one loads its own
+models, FAISS index and chunk store: RSS grows N× and every worker pays the cold
+start. Instead, this master process loads the read-only assets once, then forks
+the workers:
+
+  * model weights and Python objects built at startup are shared copy-on-write
+    (`gc.freeze()` right before forking keeps the garbage collector from
+    touching, and so copying, those pages);
+  * the index bundle (FAISS, chunk columns, BM25, reranker tokens) is
+    memory-mapped, so all workers read the same page cache;
+  * torch/FAISS/ONNX thread pools are sized to cores ÷ workers, so N workers
+    do not oversubscribe the CPU.
+
+Everything that must not cross a fork is created in each worker: thread pools
+and SQLite connections in its lifespan, the asyncio loop by uvicorn, and the
+upstream HTTP client on the worker's first LLM call (`llm._get_client`, which
+also rebuilds a client it finds was created in another process). The master
+binds the socket, supervises the workers and re-forks any that die;
+SIGTERM/SIGINT shut all of them down gracefully.
+
+    python -m src.serve --workers 4 --host 0.0.0.0 --port 8080
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from src.config import settings
+
+logger = logging.getLogger("src.serve")
+
+_THREAD_ENV = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))  # respects taskset / container CPU sets
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def threads_per_worker(workers: int) -> int:
+    if settings.torch_threads_per_worker > 0:
+        return settings.torch_threads_per_worker
+    return max(1, cpu_count() // max(1, workers))
+
+
+def limit_threads(n: int):
+    """Cap torch, FAISS and ONNX Runtime intra-op threads for this process."""
+    for var in _THREAD_ENV:
+        os.environ[var] = str(n)
+    import torch
+    torch.set_num_threads(n)
+    try:
+        import faiss
+        faiss.omp_set_num_threads(n)
+    except ImportError:
+        pass
+    if settings.onnx_intra_op_threads == 0:
+        settings.onnx_intra_op_threads = n  # sessions are created after the fork
+
+
+def _can_preload_models() -> tuple[bool, str]:
+    if settings.inference_backend == "onnx":
+        # ONNX Runtime starts its thread pools when a session is created; threads do not survive a fork
+        return False, "ONNX Runtime sessions are created per worker"
+    import torch
+    if torch.cuda.is_available():
+        return False, "CUDA cannot be initialised before fork"
+    return True, ""
+
+
+def preload():
+    """Load indexes and model weights in the master; returns the ASGI app."""
+    from src import main
+    from src.rag.chunk_tokens import get_chunk_tokens
+    from src.rag.embedder import get_embedder
+
+    t0 = time.time()
+    if not main.pipeline_instance.load_indexes():
+        logger.warning("Indexes not loaded in the master; workers will start in degraded mode.")
+    if settings.use_reranker:
+        get_chunk_tokens()
+    ok, reason = _can_preload_models()
+    if ok:
+        # Weights only: no forward pass runs in the master, so no intra-op thread pool exists at fork
+        get_embedder()._load()
+        if settings.use_reranker:
+            from src.rag.reranker import get_reranker
+            get_reranker()._load()
+    else:
+        logger.info(f"Models load in each worker ({reason}); indexes are still shared.")
+    logger.info(f"Master preload done in {time.time() - t0:.1f}s")
+    return main.app
+
+
+def bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, threads: int, args) -> int:
+    """Child process body: size thread pools, then serve on the inherited socket."""
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    limit_threads(threads)
+    config = uvicorn.Config(
+        app,
+        log_level=args.log_level,
+        timeout_keep_alive=args.timeout_keep_alive,
+        lifespan="on",
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+    return 0
+
+
+def fork_worker(app, sock: socket.socket, threads: int, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = run_worker(app, sock, threads, args)
+        except BaseException:
+            logger.exception("Worker crashed")
+        finally:
+            os._exit(code)
+    logger.info(f"Worker {pid} started ({threads} threads)")
+    return pid
+
+
+def supervise(app, sock: socket.socket, workers: int, threads: int, args):
+    """Fork the workers, re-fork any that die, and stop them all on SIGTERM/SIGINT."""
+    children: set[int] = set()
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        if not stopping:
+            logger.info(f"Received {signal.Signals(signum).name}; stopping {len(children)} workers...")
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        children.add(fork_worker(app, sock, threads, args))
+
+    restarts: list[float] = []
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if stopping:
+            continue
+        logger.warning(f"Worker {pid} exited (status {os.waitstatus_to_exitcode(status)}); re-forking.")
+        now = time.monotonic()
+        restarts = [t for t in restarts if now - t < 60] + [now]
+        if len(restarts) > 2 * workers:
+            logger.error("Workers keep dying; giving up.")
+            stop(signal.SIGTERM, None)
+            continue
+        children.add(fork_worker(app, sock, threads, args))
+    logger.info("All workers stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preload models and indexes once, then fork uvicorn workers")
+    parser.add_argument("--host", default=settings.serve_host)
+    parser.add_argument("--port", type=int, default=settings.serve_port)
+    parser.add_argument("-w", "--workers", type=int, default=settings.serve_workers,
+                        help="Worker processes (0 = one per CPU core)")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--timeout-keep-alive", type=int, default=5)
+    args = parser.parse_args()
+
+    workers = args.workers if args.workers > 0 else cpu_count()
+    threads = threads_per_worker(workers)
+    if not hasattr(os, "fork"):
+        sys.exit("Preload-then-fork needs os.fork(); use `uvicorn src.main:app` on this platform.")
+
+    # The master only loads weights; keep it single-threaded so no OpenMP pool exists at fork time
+    for var in _THREAD_ENV:
+        os.environ.setdefault(var, "1")
+    gc.disable()  # no collections while the long-lived objects are built
+    app = preload()
+    sock = bind(args.host, args.port)
+    gc.collect()
+    gc.freeze()  # move everything built so far to the permanent generation: no COW from GC in workers
+    logger.info(f"Serving on {args.host}:{args.port} with {workers} workers × {threads} threads")
+    supervise(app, sock, workers, threads, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""AdmissionController: in-flight limit, priority lanes, 429/503 shedding with Retry-After."""
+import asyncio
+
+import pytest
+
+from src.rag import admission as admission_module
+from src.rag.admission import AdmissionController, AdmissionRejected, lane_for
+
+
+def _controller(max_in_flight=2, bulk_max=1, queue=(4, 4), timeouts=(1.0, 1.0)) -> AdmissionController:
+    return AdmissionController(
+        max_in_flight=max_in_flight,
+        bulk_max_in_flight=bulk_max,
+        queue_limits={"interactive": queue[0], "bulk": queue[1]},
+        queue_timeouts_s={"interactive": timeouts[0], "bulk": timeouts[1]},
+    )
+
+
+def test_queue_full_is_429_with_retry_after():
+    async def run():
+        ctl = _controller(max_in_flight=1, queue=(1, 1))
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctl.acquire()
+        ctl.release()
+        await waiter
+        return exc.value, ctl.stats()
+
+    err, stats = asyncio.run(run())
+    assert err.status_code == 429 and err.retry_after >= 1
+    lane = stats["lanes"]["interactive"]
+    assert lane["rejected_queue_full"] == 1 and lane["admitted_after_wait"] == 1
+
+
+def test_queue_timeout_is_503():
+    async def run():
+        ctl = _controller(max_in_flight=1, timeouts=(0.02, 0.02))
+        await ctl.acquire()
+        with pytest.raises(AdmissionRejected) as exc:
+            await ctl.acquire()
+        return exc.value, ctl.stats()
+
+    err, stats = asyncio.run(run())
+    assert err.status_code == 503 and err.retry_after >= 1
+    assert stats["lanes"]["interactive"]["rejected_timeout"] == 1
+    assert stats["lanes"]["interactive"]["queue_depth"] == 0
+
+
+def test_timed_out_waiters_free_their_queue_places():
+    async def run():
+        ctl = _controller(max_in_flight=1, queue=(2, 2), timeouts=(0.05, 0.05))
+        await ctl.acquire()
+        results = await asyncio.gather(ctl.acquire(), ctl.acquire(), return_exceptions=True)
+        assert [r.status_code for r in results] == [503, 503]
+        assert ctl.stats()["lanes"]["interactive"]["queue_depth"] == 0
+        # The timed-out futures are still in the deque; the next request must queue, not get a 429
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        assert ctl.stats()["lanes"]["interactive"]["queue_depth"] == 1
+        ctl.release()
+        await waiter
+        ctl.release()
+        # With the slot free again, a request is admitted at once past the dead entries
+        await asyncio.wait_for(ctl.acquire(), 0.01)
+        return ctl.stats()
+
+    stats = asyncio.run(run())
+    lane = stats["lanes"]["interactive"]
+    assert lane["rejected_queue_full"] == 0 and lane["rejected_timeout"] == 2 and lane["admitted_after_wait"] == 1
+
+
+def test_cancelled_waiters_free_their_queue_places():
+    async def run():
+        ctl = _controller(max_in_flight=1, queue=(1, 1))
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        waiter = asyncio.ensure_future(ctl.acquire())  # the only queue place is free again
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        ctl.release()
+        await waiter
+
+    asyncio.run(run())
+
+
+def test_interactive_is_served_before_bulk():
+    async def run():
+        ctl = _controller(max_in_flight=1, bulk_max=1)
+        order = []
+        await ctl.acquire("interactive")
+
+        async def wait(lane):
+            await ctl.acquire(lane)
+            order.append(lane)
+
+        tasks = [asyncio.ensure_future(wait("bulk")), asyncio.ensure_future(wait("interactive"))]
+        await asyncio.sleep(0.01)
+        ctl.release("interactive")
+        await asyncio.sleep(0.01)
+        ctl.release(order[0])
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "bulk"]
+
+
+def test_bulk_cap_keeps_headroom_for_interactive():
+    async def run():
+        ctl = _controller(max_in_flight=2, bulk_max=1, timeouts=(1.0, 0.02))
+        await ctl.acquire("bulk")
+        with pytest.raises(AdmissionRejected):
+            await ctl.acquire("bulk")  # the second bulk slot is never granted
+        await ctl.acquire("interactive")
+        return ctl.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 2
+    assert stats["lanes"]["bulk"]["running"] == 1 and stats["lanes"]["interactive"]["running"] == 1
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        ctl = _controller(max_in_flight=1)
+        await ctl.acquire()
+        waiter = asyncio.ensure_future(ctl.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        ctl.release()
+        return ctl.stats()
+
+    stats = asyncio.run(run())
+    assert stats["in_flight"] == 0 and stats["lanes"]["interactive"]["abandoned"] == 1
+
+
+def test_retry_after_grows_with_queue():
+    async def run():
+        ctl = _controller(max_in_flight=1, queue=(64, 64), timeouts=(10, 10))
+        ctl._service_s = 2.0
+        await ctl.acquire()
+        empty = ctl.retry_after()
+        waiters = [asyncio.ensure_future(ctl.acquire()) for _ in range(5)]
+        await asyncio.sleep(0)
+        busy = ctl.retry_after()
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return empty, busy
+
+    empty, busy = asyncio.run(run())
+    assert empty == 2 and busy == 12
+
+
+def test_disabled_admits_everything():
+    async def run():
+        ctl = _controller(max_in_flight=0)
+        for _ in range(100):
+            await ctl.acquire()
+        return ctl.stats()
+
+    assert asyncio.run(run())["enabled"] is False
+
+
+def test_lane_for():
+    assert lane_for(None) == "interactive"
+    assert lane_for(" BULK ") == "bulk"
+    assert lane_for("urgent", default="bulk") == "bulk"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+    from src.main import app
+
+    ctl = _controller(max_in_flight=1, queue=(0, 0))
+    monkeypatch.setattr(admission_module, "_controller", ctl)
+    asyncio.run(ctl.acquire())  # hold the only slot
+    return TestClient(app)  # no lifespan: nothing is loaded
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/diagnose", {"symptoms": "кашель"}),
+    ("/diagnose/stream", {"symptoms": "кашель"}),
+])
+def test_http_429_carries_retry_after(client, path, body):
+    resp = client.post(path, json=body)
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) >= 1
+    assert "queue is full" in resp.json()["detail"]
+
+
+def test_http_503_after_queue_timeout(monkeypatch):
+    from fastapi.testclient import TestClient
+    from src.main import app
+
+    ctl = _controller(max_in_flight=1, queue=(1, 1), timeouts=(0.05, 0.05))
+    monkeypatch.setattr(admission_module, "_controller", ctl)
+    asyncio.run(ctl.acquire())
+    resp = TestClient(app).post("/diagnose", json={"symptoms": "кашель"})
+    assert resp.status_code == 503
+    assert int(resp.headers["Retry-After"]) >= 1
@@ -0,0 +1,81 @@
+"""CSR BM25 engine vs rank_bm25.BM25Okapi: same scores, same top-k."""
+import random
+
+import numpy as np
+import pytest
+from rank_bm25 import BM25Okapi
+
+from src.rag.bm25 import BM25Index, _tokenize
+
+# Small vocabulary so terms repeat within and across documents; "i10" and
+# "пациент" occur in most documents and get a negative (floored) IDF
+COMMON = ["i10", "пациент"]
+WORDS = ["боль", "кашель", "температура", "j45.0", "одышка", "сыпь", "головная", "тошнота", "k29.7", "отёк"]
+
+
+@pytest.fixture(scope="module")
+def corpus() -> list[str]:
+    rng = random.Random(0)
+    docs = []
+    for _ in range(200):
+        words = rng.choices(WORDS, k=rng.randint(3, 40)) + rng.sample(COMMON, k=rng.randint(1, 2))
+        rng.shuffle(words)
+        docs.append(" ".join(words).capitalize() + ".")
+    return docs
+
+
+@pytest.fixture(scope="module")
+def engines(corpus):
+    tokenized = [_tokenize(d) for d in corpus]
+    index = BM25Index()
+    index.fit(tokenized)
+    return index, BM25Okapi(tokenized)
+
+
+QUERIES = [
+    "боль кашель",
+    "температура температура одышка",  # repeated term counts twice
+    "J45.0, сыпь!",
+    "пациент i10",  # only floored-IDF terms
+    "неизвестное слово",  # no term in the vocabulary
+]
+
+
+def _dense_scores(index: BM25Index, query: str) -> np.ndarray:
+    return np.asarray((index._query_matrix([query]) @ index.weights).todense()).ravel()
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_scores_match_okapi(engines, query):
+    index, okapi = engines
+    expected = okapi.get_scores(_tokenize(query))
+    np.testing.assert_allclose(_dense_scores(index, query), expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_top_k_matches_okapi(engines, query):
+    index, okapi = engines
+    expected = okapi.get_scores(_tokenize(query))
+    (docs, scores), = index.search_rows([query], top_k=10)
+
+    positive = np.sort(expected[expected > 0])[::-1][:10]
+    np.testing.assert_allclose(scores, positive, rtol=1e-5)
+    np.testing.assert_allclose(expected[docs], scores, rtol=1e-5)
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_batch_equals_single(engines):
+    index, _ = engines
+    batch = index.search_rows(QUERIES, top_k=10)
+    for query, (docs, scores) in zip(QUERIES, batch):
+        (single_docs, single_scores), = index.search_rows([query], top_k=10)
+        np.testing.assert_array_equal(docs, single_docs)
+        np.testing.assert_array_equal(scores, single_scores)
+
+
+def test_from_okapi_matches_fit(corpus, engines):
+    index, okapi = engines
+    chunks = [{"protocol_id": f"p{i}", "chunk": text} for i, text in enumerate(corpus)]
+    converted = BM25Index.from_okapi(okapi, chunks)
+    for query in QUERIES:
+        np.testing.assert_allclose(_dense_scores(converted, query), _dense_scores(index, query), rtol=1e-6)
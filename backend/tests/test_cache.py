@@ -0,0 +1,171 @@
+"""ResponseCache (TTL, LRU, near-duplicate lookup, top_n keys) and what the pipeline stores in it."""
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.config import settings
+from src.models import DiagnoseResponse, Diagnosis
+from src.rag import cache as cache_module
+from src.rag.cache import ResponseCache
+
+
+def _response(code: str) -> DiagnoseResponse:
+    return DiagnoseResponse(diagnoses=[Diagnosis(rank=1, diagnosis="d", icd10_code=code, explanation="")])
+
+
+def _unit(*values: float) -> np.ndarray:
+    v = np.asarray(values, dtype="float32")
+    return v / np.linalg.norm(v)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+
+def test_exact_hit_on_normalised_text():
+    cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0)
+    cache.put("Кашель, температура.", 5, None, _response("J06.9"))
+    hit = cache.get("  кашель,   ТЕМПЕРАТУРА!", 5)
+    assert hit is not None and hit.diagnoses[0].icd10_code == "J06.9"
+    assert cache.stats()["hits"] == 1
+
+
+def test_top_n_is_part_of_the_key():
+    cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0.9)
+    cache.put("кашель", 5, _unit(1, 0), _response("J06.9"))
+    assert cache.get("кашель", 3) is None
+    assert cache.get_similar(_unit(1, 0), 3) is None
+    assert cache.get("кашель", 5) is not None
+    assert cache.get_similar(_unit(1, 0), 5) is not None
+
+
+def test_ttl_expiry(clock):
+    cache = ResponseCache(max_entries=8, ttl_s=10, similarity=0)
+    cache.put("кашель", 5, None, _response("J06.9"))
+    clock.now += 9
+    assert cache.get("кашель", 5) is not None
+    clock.now += 2
+    assert cache.get("кашель", 5) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_keeps_recently_used():
+    cache = ResponseCache(max_entries=2, ttl_s=60, similarity=0)
+    cache.put("a", 5, None, _response("A00"))
+    cache.put("b", 5, None, _response("B00"))
+    assert cache.get("a", 5) is not None  # "a" becomes most recent
+    cache.put("c", 5, None, _response("C00"))
+    assert cache.get("b", 5) is None
+    assert cache.get("a", 5) is not None and cache.get("c", 5) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_near_duplicate_threshold():
+    cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0.95)
+    cache.put("боль в груди", 5, _unit(1, 0, 0), _response("I20.0"))
+    cache.put("сыпь", 5, _unit(0, 1, 0), _response("L50.0"))
+    hit = cache.get_similar(_unit(1, 0.1, 0), 5)  # cosine ≈ 0.995
+    assert hit is not None and hit.diagnoses[0].icd10_code == "I20.0"
+    assert cache.get_similar(_unit(1, 1, 0), 5) is None  # cosine ≈ 0.71
+    stats = cache.stats()
+    assert stats["semantic_hits"] == 1 and stats["semantic_misses"] == 1
+
+
+def test_every_lookup_is_counted():
+    cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0.95)
+    cache.put("боль в груди", 5, _unit(1, 0), _response("I20.0"))
+    # Pipeline order: exact lookup first, near-duplicate lookup only on an exact miss
+    assert cache.get("боль в груди", 5) is not None
+    assert cache.get("боли в груди", 5) is None and cache.get_similar(_unit(1, 0.05), 5) is not None
+    assert cache.get("сыпь", 5) is None and cache.get_similar(_unit(0, 1), 5) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["semantic_hits"], stats["semantic_misses"]) == (1, 2, 1, 1)
+    assert stats["hit_rate"] == round(2 / 3, 4)
+
+
+def test_near_duplicate_disabled_and_expired(clock):
+    off = ResponseCache(max_entries=8, ttl_s=60, similarity=0)
+    off.put("кашель", 5, _unit(1, 0), _response("J06.9"))
+    assert off.get_similar(_unit(1, 0), 5) is None
+
+    cache = ResponseCache(max_entries=8, ttl_s=10, similarity=0.9)
+    cache.put("кашель", 5, _unit(1, 0), _response("J06.9"))
+    clock.now += 11
+    assert cache.get_similar(_unit(1, 0), 5) is None
+
+
+def test_hits_are_copies():
+    cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0)
+    cache.put("кашель", 5, None, _response("J06.9"))
+    cache.get("кашель", 5).diagnoses.clear()
+    assert len(cache.get("кашель", 5).diagnoses) == 1
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(max_entries=0, ttl_s=60, similarity=0.9)
+    cache.put("кашель", 5, _unit(1, 0), _response("J06.9"))
+    assert cache.get("кашель", 5) is None
+    assert cache.stats()["entries"] == 0
+
+
+class _FakeLLM:
+    def __init__(self, fallback: bool):
+        self.fallback = fallback
+
+    async def diagnose(self, prompt, chunks, top_n=5, use_cache=True):
+        return [{"rank": 1, "diagnosis": "d", "icd10_code": "J06.9", "explanation": ""}], self.fallback
+
+
+@pytest.mark.parametrize("fallback, cached", [(False, True), (True, False)])
+def test_pipeline_caches_only_model_answers(monkeypatch, fallback, cached):
+    from src.rag.pipeline import RAGPipeline
+
+    monkeypatch.setattr(settings, "use_reranker", False)
+    pipeline = RAGPipeline()
+    pipeline.cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0)
+    pipeline.llm = _FakeLLM(fallback)
+    chunks = [{"protocol_id": "p1", "source_file": "p1.pdf", "icd_codes": ["J06.9"], "chunk": "Кашель."}]
+
+    response = asyncio.run(pipeline.answer("кашель", _unit(1, 0), chunks, top_n=5, use_cache=True))
+    assert response.diagnoses[0].icd10_code == "J06.9"
+    assert (pipeline.cache.get("кашель", 5) is not None) is cached
+
+
+def test_batch_uses_and_counts_the_cache(monkeypatch):
+    from src.rag.pipeline import RAGPipeline
+
+    monkeypatch.setattr(settings, "use_reranker", False)
+    pipeline = RAGPipeline()
+    pipeline._ready = True
+    pipeline.cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0.95)
+    pipeline.cache.put("кашель", 5, _unit(1, 0), _response("J06.9"))
+    pipeline.cache.put("сыпь", 5, _unit(0, 1), _response("L50.0"))
+    answered = []
+
+    async def retrieve_batch(queries):
+        return [_unit(0, 1), _unit(1, 1)], [[], []]
+
+    async def answer_by(symptoms, q_vec, chunks, top_n, use_cache, deadline):
+        answered.append(symptoms)
+        return _response("R69")
+
+    pipeline.retrieve_batch = retrieve_batch
+    pipeline._answer_by = answer_by
+    results = asyncio.run(pipeline.diagnose_batch(["Кашель", "сыпь на коже", "что-то ещё"], top_n=5))
+    # Exact hit, near-duplicate hit, and one case that reaches the LLM
+    assert [r.diagnoses[0].icd10_code for r in results] == ["J06.9", "L50.0", "R69"]
+    assert answered == ["что-то ещё"]
+    stats = pipeline.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["semantic_hits"], stats["semantic_misses"]) == (1, 2, 1, 1)
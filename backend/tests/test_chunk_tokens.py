@@ -0,0 +1,61 @@
+"""PairTemplate: the same ids, token types and truncation as the fast tokenizer encoding the pair itself."""
+import pytest
+
+from src.rag.chunk_tokens import PairTemplate, truncate_pair
+
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+WORDS = [f"w{i}" for i in range(64)]
+
+
+def _tokenizer(pair_template: str, special: list[str]):
+    """In-memory word-level fast tokenizer with a BERT- or XLM-R-style pair template."""
+    from tokenizers import Tokenizer, models, pre_tokenizers, processors
+
+    vocab = {token: i for i, token in enumerate(["[UNK]", "[PAD]"] + special + WORDS)}
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tok.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tok.post_processor = processors.TemplateProcessing(
+        single=f"{special[0]} $A {special[-1]}",
+        pair=pair_template,
+        special_tokens=[(t, vocab[t]) for t in special],
+    )
+    return transformers.PreTrainedTokenizerFast(tokenizer_object=tok, unk_token="[UNK]", pad_token="[PAD]")
+
+
+TOKENIZERS = {
+    "bert": lambda: _tokenizer("[CLS] $A [SEP] $B:1 [SEP]:1", ["[CLS]", "[SEP]"]),
+    "xlmr": lambda: _tokenizer("<s> $A </s> </s> $B </s>", ["<s>", "</s>"]),
+}
+
+
+def _text(n: int, offset: int) -> str:
+    return " ".join(WORDS[(offset + i) % len(WORDS)] for i in range(n))
+
+
+@pytest.mark.parametrize("family", list(TOKENIZERS))
+def test_build_matches_tokenizer(family):
+    tokenizer = TOKENIZERS[family]()
+    template = PairTemplate.from_tokenizer(tokenizer)
+    for max_length in (16, 17):
+        # Query shorter, longer and equal; both sides over half the budget; one side alone over it
+        for len_q in (1, 3, 7, 8, 9, 12, 30):
+            for len_p in (1, 3, 7, 8, 9, 12, 30):
+                query, passage = _text(len_q, 0), _text(len_p, 5)
+                expected = tokenizer(query, passage, truncation="longest_first", max_length=max_length)
+                q_ids = tokenizer(query, add_special_tokens=False)["input_ids"]
+                p_ids = tokenizer(passage, add_special_tokens=False)["input_ids"]
+                ids, types = template.build(q_ids, p_ids, max_length)
+                assert ids == expected["input_ids"], (len_q, len_p, max_length)
+                if "token_type_ids" in expected:
+                    assert types == expected["token_type_ids"]
+
+
+def test_truncate_pair():
+    assert truncate_pair(3, 4, 10) == (3, 4)  # fits
+    assert truncate_pair(3, 20, 13) == (3, 10)  # only the longer side is cut
+    assert truncate_pair(20, 3, 13) == (10, 3)
+    assert truncate_pair(9, 9, 13) == (6, 7)  # tie: the odd token goes to the second
+    assert truncate_pair(12, 9, 13) == (7, 6)  # query longer: the odd token goes to the query
+    assert truncate_pair(9, 12, 13) == (6, 7)
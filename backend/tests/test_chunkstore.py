@@ -0,0 +1,40 @@
+"""Index bundle writes: atomic replacement under a live mapping, and chunk signatures."""
+import numpy as np
+
+from src.rag.chunkstore import ChunkStore, matches_chunks, read_manifest
+
+
+def _chunks(texts: list[str]) -> list[dict]:
+    return [{"protocol_id": f"p{i // 2}", "chunk": t, "chunk_index": i % 2} for i, t in enumerate(texts)]
+
+
+def test_rewrite_keeps_mapped_store_readable(tmp_path):
+    ChunkStore.from_chunks(_chunks(["первый", "второй", "третий"])).save(tmp_path)
+    mapped = ChunkStore.load(tmp_path)
+    assert isinstance(mapped.offsets, np.memmap)
+
+    ChunkStore.from_chunks(_chunks(["другой текст"] * 5)).save(tmp_path)
+    # The old mapping still sees the old, intact files; a fresh load sees the new ones
+    assert [mapped.text(i) for i in range(len(mapped))] == ["первый", "второй", "третий"]
+    assert len(ChunkStore.load(tmp_path)) == 5
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_load_without_mmap(tmp_path):
+    ChunkStore.from_chunks(_chunks(["a", "b"])).save(tmp_path)
+    store = ChunkStore.load(tmp_path, mmap=False)
+    assert not isinstance(store.offsets, np.memmap)
+    assert store[1]["chunk"] == "b"
+
+
+def test_signature_tracks_content(tmp_path):
+    base = ChunkStore.from_chunks(_chunks(["один", "два"]))
+    assert base.signature() == ChunkStore.from_chunks(_chunks(["один", "два"])).signature()
+    assert base.signature() != ChunkStore.from_chunks(_chunks(["один", "три"])).signature()  # same lengths
+    assert base.signature() != ChunkStore.from_chunks(_chunks(["один", "два"]), ids=np.array([0, 7])).signature()
+
+    base.save(tmp_path)
+    assert read_manifest(tmp_path)["chunks"]["signature"] == base.signature()
+    assert matches_chunks({"chunks_signature": base.signature()}, tmp_path)
+    assert not matches_chunks({"chunks_signature": "stale"}, tmp_path)
+    assert not matches_chunks({}, tmp_path)  # built before signatures were recorded
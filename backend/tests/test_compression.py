@@ -0,0 +1,129 @@
+"""Prompt compression: sentence splitting, and what PromptCompressor keeps within its token budget."""
+import numpy as np
+import pytest
+
+from src.rag.compression import GAP, MAX_SENTENCE_WORDS, PromptCompressor, SentenceIndex, split_sentences
+
+# Topic axes of the fake embedding: a sentence points along the first topic word it contains
+TOPICS = ["кашель", "сыпь", "боль"]
+
+
+class _Embedder:
+    def encode(self, texts, is_query=False):
+        vectors = np.full((len(texts), len(TOPICS) + 1), 0.0, dtype="float32")
+        for i, text in enumerate(texts):
+            hits = [j for j, topic in enumerate(TOPICS) if topic in text]
+            vectors[i, hits[0] if hits else len(TOPICS)] = 1.0
+        return vectors
+
+
+class _Tokenizer:
+    """One token per word."""
+
+    def __call__(self, texts, add_special_tokens=False, verbose=False):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+def _query(topic: str) -> np.ndarray:
+    return _Embedder().encode([topic])[0]
+
+
+def _pieces(text: str) -> list[str]:
+    return [text[lo:hi] for lo, hi in split_sentences(text)]
+
+
+def test_split_on_sentence_ends_and_line_breaks():
+    text = "Первое предложение про кашель. Второе предложение про сыпь!\nТретье предложение без точки"
+    assert _pieces(text) == [
+        "Первое предложение про кашель.", "Второе предложение про сыпь!", "Третье предложение без точки",
+    ]
+
+
+def test_decimals_and_icd_codes_are_not_boundaries():
+    text = "Назначить 2.5 мг при коде J45.0 дважды в день. Контроль через неделю у врача."
+    assert _pieces(text) == ["Назначить 2.5 мг при коде J45.0 дважды в день.", "Контроль через неделю у врача."]
+
+
+def test_short_pieces_join_their_neighbours():
+    # A heading joins the next sentence; a short tail joins the previous one
+    text = "Лечение.\nНазначают ингаляционные препараты ежедневно. Итог."
+    assert _pieces(text) == ["Лечение.\nНазначают ингаляционные препараты ежедневно. Итог."]
+    assert _pieces("Коротко.") == ["Коротко."]
+
+
+def test_run_on_text_is_cut_into_windows():
+    words = [f"слово{i}" for i in range(MAX_SENTENCE_WORDS * 2 + 5)]
+    pieces = _pieces(" ".join(words))
+    assert [len(p.split()) for p in pieces] == [MAX_SENTENCE_WORDS, MAX_SENTENCE_WORDS, 5]
+    assert " ".join(pieces) == " ".join(words)
+
+
+CHUNKS = [
+    # p1: about cough, with one rash sentence in the middle
+    "Первый абзац описывает кашель подробно. Второй абзац описывает кашель иначе. "
+    "Третий абзац описывает сыпь на коже. Четвёртый абзац снова про кашель ночью.",
+    # p2: nothing about cough
+    "Здесь описана боль в груди пациента. Здесь описана сыпь на руках пациента.",
+    # p3: nothing relevant at all
+    "Организационные вопросы работы отделения.",
+]
+
+
+@pytest.fixture
+def index() -> SentenceIndex:
+    return SentenceIndex.build(CHUNKS, _Embedder(), _Tokenizer(), "fake")
+
+
+def _chunks() -> list[dict]:
+    return [
+        {"protocol_id": f"p{i + 1}", "chunk_row": i, "chunk": text, "text": text}
+        for i, text in enumerate(CHUNKS)
+    ]
+
+
+def test_index_layout(index):
+    assert len(index) == 3 and index.offsets.tolist() == [0, 4, 6, 7]
+    assert index.tokens.tolist() == [5, 5, 6, 6, 6, 6, 4]
+
+
+def test_budget_and_gap_joining(index):
+    compressor = PromptCompressor(index, token_budget=16, min_per_protocol=0)
+    out = compressor.compress(_query("кашель"), _chunks()[:1])
+    # The three cough sentences (16 tokens); sentences 1-2 are adjacent, 4 follows a gap
+    assert out[0]["chunk"] == (
+        "Первый абзац описывает кашель подробно. Второй абзац описывает кашель иначе."
+        + GAP + "Четвёртый абзац снова про кашель ночью."
+    )
+    assert out[0]["text"] == out[0]["chunk"]
+    stats = compressor.stats()
+    assert stats["context_tokens_in"] == 22 and stats["context_tokens_out"] == 16
+
+
+def test_each_protocol_keeps_its_best_sentences(index):
+    compressor = PromptCompressor(index, token_budget=10, min_per_protocol=1)
+    out = compressor.compress(_query("кашель"), _chunks())
+    # The budget only fits two sentences, but every protocol keeps its best one
+    assert [c["protocol_id"] for c in out] == ["p1", "p2", "p3"]
+    assert out[0]["chunk"].startswith("Первый абзац") and out[2]["chunk"] == CHUNKS[2]
+    assert compressor.stats()["context_tokens_out"] == 5 + 6 + 4
+
+
+def test_best_sentence_kept_over_budget(index):
+    compressor = PromptCompressor(index, token_budget=0, min_per_protocol=0)
+    out = compressor.compress(_query("сыпь"), _chunks()[:2])
+    assert [c["chunk"] for c in out] == ["Третий абзац описывает сыпь на коже.", "Здесь описана сыпь на руках пациента."]
+
+
+def test_empty_chunks_are_dropped(index):
+    # min_per_protocol counts per protocol: p1's second chunk loses to its first
+    chunks = _chunks()[:2]
+    chunks[1]["protocol_id"] = "p1"
+    out = PromptCompressor(index, token_budget=0, min_per_protocol=1).compress(_query("кашель"), chunks)
+    assert len(out) == 1 and out[0]["chunk_row"] == 0
+
+
+def test_unindexed_chunks_pass_through(index):
+    chunks = _chunks() + [{"protocol_id": "p4", "chunk": "Без индекса."}]
+    compressor = PromptCompressor(index, token_budget=1, min_per_protocol=0)
+    assert compressor.compress(_query("кашель"), chunks) is chunks
+    assert compressor.stats()["requests"] == 0
@@ -0,0 +1,141 @@
+"""Request deadline: retrieval-only fallback, and what happens to the LLM call that missed it."""
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.config import settings
+from src.rag.cache import ResponseCache
+
+CHUNKS = [
+    {"protocol_id": "p1", "source_file": "Астма.pdf", "icd_codes": ["J45.0"], "chunk": "Свистящее дыхание.",
+     "protocol_rank_score": 1.0},
+    {"protocol_id": "p2", "source_file": "Бронхит.pdf", "icd_codes": ["J20.9"], "chunk": "Кашель.",
+     "protocol_rank_score": 0.5},
+]
+
+
+class _SlowLLM:
+    def __init__(self, delay_s: float):
+        self.delay_s = delay_s
+        self.started = 0
+        self.cancelled = 0
+        self.finished = 0
+
+    async def diagnose(self, prompt, chunks, top_n=5, use_cache=True):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delay_s)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.finished += 1
+        return [{"rank": 1, "diagnosis": "Астма", "icd10_code": "J45.0", "explanation": "LLM"}], False
+
+    async def diagnose_stream(self, prompt, chunks, top_n=5, use_cache=True, outcome=None):
+        self.started += 1
+        try:
+            yield {"rank": 1, "diagnosis": "Бронхит", "icd10_code": "J20.9", "explanation": "LLM"}
+            await asyncio.sleep(self.delay_s)
+            yield {"rank": 2, "diagnosis": "Астма", "icd10_code": "J45.0", "explanation": "LLM"}
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        self.finished += 1
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    from src.rag.pipeline import RAGPipeline
+
+    monkeypatch.setattr(settings, "use_reranker", False)
+    p = RAGPipeline()
+    p.cache = ResponseCache(max_entries=8, ttl_s=60, similarity=0)
+    return p
+
+
+def _answer_by(pipeline, deadline_s: float):
+    async def run():
+        deadline = asyncio.get_running_loop().time() + deadline_s
+        response = await pipeline._answer_by("кашель", np.zeros(2), CHUNKS, 3, True, deadline)
+        await asyncio.sleep(0.05)  # let cancellations / late calls settle
+        return response
+    return asyncio.run(run())
+
+
+def test_answer_within_deadline(pipeline):
+    pipeline.llm = _SlowLLM(0.0)
+    response = _answer_by(pipeline, 1.0)
+    assert not response.degraded and response.diagnoses[0].explanation == "LLM"
+
+
+def test_missed_deadline_cancels_llm_call(monkeypatch, pipeline):
+    monkeypatch.setattr(settings, "request_deadline_late_llm_max", 0)
+    pipeline.llm = _SlowLLM(10.0)
+    response = _answer_by(pipeline, 0.02)
+    assert response.degraded
+    assert [d.icd10_code for d in response.diagnoses][:2] == ["J45.0", "J20.9"]
+    assert pipeline.llm.cancelled == 1
+    assert pipeline.late_cancelled == 1 and not pipeline._late
+
+
+def test_late_llm_calls_are_capped(monkeypatch, pipeline):
+    monkeypatch.setattr(settings, "request_deadline_late_llm_max", 1)
+    pipeline.llm = _SlowLLM(0.2)
+
+    async def run():
+        deadline = asyncio.get_running_loop().time() + 0.02
+        responses = await asyncio.gather(*[
+            pipeline._answer_by(f"кашель {i}", np.zeros(2), CHUNKS, 3, True, deadline) for i in range(3)
+        ])
+        assert len(pipeline._late) == 1
+        await asyncio.sleep(0.3)
+        return responses
+
+    responses = asyncio.run(run())
+    assert all(r.degraded for r in responses)
+    assert pipeline.llm.finished == 1 and pipeline.llm.cancelled == 2
+    assert pipeline.late_finished == 1 and not pipeline._late
+
+
+def _stream(pipeline, deadline_s: float) -> list[dict]:
+    pipeline._ready = True
+
+    async def retrieve(symptoms, q_vec):
+        return CHUNKS
+
+    class _Batcher:
+        async def encode_query(self, symptoms):
+            return np.zeros(2, dtype="float32")
+
+    pipeline._retrieve = retrieve
+    pipeline.query_batcher = _Batcher()
+
+    async def run():
+        events = [e async for e in pipeline.diagnose_stream("кашель", top_n=3, deadline_s=deadline_s)]
+        await asyncio.sleep(0.05)
+        return events
+    return asyncio.run(run())
+
+
+def test_stream_deadline_falls_back(pipeline):
+    pipeline.llm = _SlowLLM(10.0)
+    events = _stream(pipeline, 0.05)
+    kinds = [e["event"] for e in events]
+    assert kinds[:3] == ["candidates", "diagnosis", "degraded"]
+    done = events[-1]
+    assert done["event"] == "done" and done["degraded"]
+    # The streamed LLM diagnosis is kept; the fallback fills the rest without repeating it
+    codes = [d["icd10_code"] for d in done["diagnoses"]]
+    assert codes[0] == "J20.9" and codes.count("J20.9") == 1 and "J45.0" in codes
+    assert [d["rank"] for d in done["diagnoses"]] == list(range(1, len(codes) + 1))
+    assert pipeline.llm.cancelled == 1
+    assert pipeline.cache.get("кашель", 3) is None
+
+
+def test_stream_without_deadline(pipeline):
+    pipeline.llm = _SlowLLM(0.0)
+    events = _stream(pipeline, 0)
+    done = events[-1]
+    assert not done["degraded"]
+    assert [d["icd10_code"] for d in done["diagnoses"]] == ["J20.9", "J45.0"]
@@ -0,0 +1,71 @@
+"""Hedged LLM calls: cold-start delay, and latency samples when the duplicate wins."""
+import asyncio
+
+import pytest
+
+from src.config import settings
+from src.rag import llm
+from src.rag.llm import HedgeBudget, UpstreamStats
+
+
+@pytest.fixture
+def stats(monkeypatch) -> UpstreamStats:
+    stats = UpstreamStats()
+    monkeypatch.setattr(llm, "upstream_stats", stats)
+    monkeypatch.setattr(llm, "_hedge_budget", HedgeBudget(ratio=1.0))
+    monkeypatch.setattr(settings, "llm_hedge", True)
+    monkeypatch.setattr(settings, "llm_hedge_min_samples", 3)
+    monkeypatch.setattr(settings, "llm_hedge_min_delay_s", 0.0)
+    return stats
+
+
+def test_cold_start_uses_the_configured_delay(monkeypatch, stats):
+    monkeypatch.setattr(settings, "llm_hedge_cold_delay_s", 30.0)
+    assert llm.hedge_delay() == 30.0
+    for latency in (0.1, 0.2):
+        stats.record(latency)
+    assert llm.hedge_delay() == 30.0
+    stats.record(0.3)
+    assert llm.hedge_delay() == 0.3
+
+
+def _calls(delays: list[float], log: list):
+    """call(record) factory: the n-th call takes delays[n]; log holds (record, outcome)."""
+    async def call(record: bool):
+        delay = delays[len(log)]
+        entry = [record, "running"]
+        log.append(entry)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            entry[1] = "cancelled"
+            raise
+        entry[1] = "done"
+        return delay
+    return call
+
+
+def test_hedge_win_records_first_call_elapsed(monkeypatch, stats):
+    monkeypatch.setattr(settings, "llm_hedge_cold_delay_s", 0.05)
+    log = []
+    assert asyncio.run(llm._hedged(_calls([10.0, 0.05], log))) == 0.05
+    assert [entry[1] for entry in log] == ["cancelled", "done"]
+    assert [entry[0] for entry in log] == [False, False]  # the calls record nothing themselves
+    assert stats.hedges_sent == 1 and stats.hedges_won == 1
+    # One sample, from the first call's start: at least the hedge delay plus the duplicate's time
+    assert len(stats.latencies) == 1 and stats.latencies[0] >= 0.1
+
+
+def test_fast_call_is_recorded_once(monkeypatch, stats):
+    monkeypatch.setattr(settings, "llm_hedge_cold_delay_s", 1.0)
+    log = []
+    asyncio.run(llm._hedged(_calls([0.01], log)))
+    assert len(log) == 1 and stats.hedges_sent == 0
+    assert len(stats.latencies) == 1 and stats.latencies[0] < 1.0
+
+
+def test_disabled_hedging_lets_the_call_record(monkeypatch, stats):
+    monkeypatch.setattr(settings, "llm_hedge", False)
+    log = []
+    asyncio.run(llm._hedged(_calls([0.0], log)))
+    assert log == [[True, "done"]] and not stats.latencies
@@ -0,0 +1,100 @@
+"""LLMClient.diagnose_stream: a stream closed at top_n still warms the completion cache and the upstream stats."""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from src.rag import llm
+from src.rag.llm import LLMClient, UpstreamStats
+
+DIAGNOSES = [
+    {"rank": i + 1, "diagnosis": f"Диагноз {i + 1}", "icd10_code": f"J0{i}.0", "explanation": ""} for i in range(4)
+]
+
+
+class _Stream:
+    """Completion streamed in small deltas; counts how far it was read."""
+
+    def __init__(self, text: str):
+        self.deltas = [text[i:i + 7] for i in range(0, len(text), 7)]
+        self.sent = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.sent == len(self.deltas):
+            raise StopAsyncIteration
+        self.sent += 1
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=self.deltas[self.sent - 1]))])
+
+    async def close(self):
+        self.closed = True
+
+
+class _Cache:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, model, raw):
+        self.entries[key] = raw
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    stream = _Stream(json.dumps({"diagnoses": DIAGNOSES}, ensure_ascii=False))
+
+    async def create(**kwargs):
+        return stream
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    cache = _Cache()
+    monkeypatch.setattr(llm, "_get_client", lambda: client)
+    monkeypatch.setattr(llm, "get_llm_cache", lambda: cache)
+    monkeypatch.setattr(llm, "upstream_stats", UpstreamStats())
+    return stream, cache
+
+
+def _consume(top_n: int, use_cache: bool = True) -> list[dict]:
+    """Read the stream the way RAGPipeline.diagnose_stream does: stop and close at top_n."""
+    async def run():
+        stream = LLMClient().diagnose_stream("prompt", [], top_n=top_n, use_cache=use_cache)
+        out = []
+        try:
+            while len(out) < top_n:
+                try:
+                    out.append(await anext(stream))
+                except StopAsyncIteration:
+                    break
+        finally:
+            await stream.aclose()
+        return out
+    return asyncio.run(run())
+
+
+def test_closed_at_top_n_still_caches_and_records(setup):
+    stream, cache = setup
+    assert _consume(top_n=2) == DIAGNOSES[:2]
+    assert stream.closed and stream.sent < len(stream.deltas)  # the rest of the completion was never read
+    assert len(llm.upstream_stats.latencies) == 1
+    (raw,) = cache.entries.values()
+    assert json.loads(raw) == {"diagnoses": DIAGNOSES[:2]}
+
+    # The next identical request is served from the completion cache
+    stream.sent = 0
+    assert _consume(top_n=2) == DIAGNOSES[:2]
+    assert stream.sent == 0
+
+
+def test_full_stream_caches_the_raw_completion(setup):
+    stream, cache = setup
+    assert _consume(top_n=5) == DIAGNOSES
+    assert stream.sent == len(stream.deltas)
+    assert len(llm.upstream_stats.latencies) == 1
+    (raw,) = cache.entries.values()
+    assert json.loads(raw) == {"diagnoses": DIAGNOSES}
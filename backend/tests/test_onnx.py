@@ -0,0 +1,81 @@
+"""ONNX backend parity with PyTorch (SentenceTransformer / CrossEncoder) on a tiny random BERT."""
+import numpy as np
+import pytest
+
+from src.config import settings
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+sentence_transformers = pytest.importorskip("sentence_transformers")
+
+from src.rag import onnx_backend  # noqa: E402
+from src.rag.onnx_backend import OnnxCrossEncoder, OnnxEmbedder  # noqa: E402
+
+WORDS = "query passage кашель температура сыпь боль в груди одышка у пациента ребёнка ночью".split()
+QUERIES = ["query: кашель ночью", "query: сыпь у ребёнка", "query: боль в груди и одышка"]
+PASSAGES = [
+    "passage: кашель и температура у пациента",
+    "passage: сыпь",
+    "passage: боль в груди одышка ночью у пациента ребёнка кашель",
+]
+
+
+def _save_model(path, head: bool):
+    torch.manual_seed(0)
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", ":"] + WORDS
+    (path / "vocab.txt").write_text("\n".join(vocab), encoding="utf-8")
+    tokenizer = transformers.BertTokenizerFast(vocab_file=str(path / "vocab.txt"), do_lower_case=False)
+    config = transformers.BertConfig(
+        vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=64, max_position_embeddings=64, num_labels=1,
+    )
+    cls = transformers.BertForSequenceClassification if head else transformers.BertModel
+    cls(config).save_pretrained(path)
+    tokenizer.model_max_length = 64
+    tokenizer.save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    root = tmp_path_factory.mktemp("models")
+    (root / "emb").mkdir()
+    (root / "ce").mkdir()
+    return _save_model(root / "emb", head=False), _save_model(root / "ce", head=True)
+
+
+@pytest.fixture
+def onnx_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "onnx_dir", tmp_path / "onnx")
+    return settings.onnx_dir
+
+
+def test_embedder_parity(models, onnx_dir):
+    emb_model, _ = models
+    ref = sentence_transformers.SentenceTransformer(emb_model, device="cpu")
+    texts = QUERIES + PASSAGES
+    expected = ref.encode(texts, normalize_embeddings=True)
+
+    fp32 = OnnxEmbedder(emb_model, quantized=False).encode(texts, batch_size=2)
+    np.testing.assert_allclose(np.sum(fp32 * expected, axis=1), 1.0, atol=1e-5)
+    int8 = OnnxEmbedder(emb_model, quantized=True).encode(texts, batch_size=2)
+    assert np.sum(int8 * expected, axis=1).min() > 0.95
+
+
+def test_cross_encoder_parity(models, onnx_dir):
+    _, ce_model = models
+    ref = sentence_transformers.CrossEncoder(ce_model, device="cpu")
+    pairs = [(q, p) for q in QUERIES for p in PASSAGES]
+    expected = ref.predict(pairs, show_progress_bar=False)
+    scores = OnnxCrossEncoder(ce_model, quantized=False).predict(pairs, batch_size=4)
+    np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+
+def test_export_is_renamed_into_place(models, onnx_dir):
+    emb_model, _ = models
+    out_dir = onnx_backend.export(emb_model, "embedder", quantize=False)
+    assert (out_dir / onnx_backend.MODEL_FILE).exists() and (out_dir / onnx_backend.META_FILE).exists()
+    # Nothing is left behind but the export directory (and the lock file of later loads)
+    assert [p.name for p in onnx_dir.iterdir()] == [out_dir.name]
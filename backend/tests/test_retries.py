@@ -0,0 +1,66 @@
+"""Upstream retries: a read timeout of a completion is final, connect and pool timeouts are retried."""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APITimeoutError
+
+from src.config import settings
+from src.rag import llm
+from src.rag.llm import UpstreamStats
+
+REQUEST = httpx.Request("POST", "http://upstream/v1/chat/completions")
+
+
+class _Client:
+    """AsyncOpenAI stand-in whose completions time out with `cause` `failures` times, then answer."""
+
+    def __init__(self, cause: Exception, failures: int):
+        self.cause = cause
+        self.failures = failures
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            try:
+                raise self.cause
+            except httpx.TimeoutException as err:
+                raise APITimeoutError(request=REQUEST) from err  # as openai's client does
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{"diagnoses": []}'))])
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm, "upstream_stats", UpstreamStats())
+    monkeypatch.setattr(settings, "llm_max_retries", 2)
+    monkeypatch.setattr(settings, "llm_retry_base_s", 0.0)
+
+
+def test_read_timeout_is_not_retried():
+    client = _Client(httpx.ReadTimeout("read", request=REQUEST), failures=1)
+    with pytest.raises(APITimeoutError):
+        asyncio.run(llm._complete(client, []))
+    assert client.calls == 1 and llm.upstream_stats.retries == 0
+
+
+@pytest.mark.parametrize("cause", [
+    httpx.ConnectTimeout("connect", request=REQUEST),
+    httpx.PoolTimeout("pool"),
+])
+def test_connect_and_pool_timeouts_are_retried(cause):
+    client = _Client(cause, failures=2)
+    assert asyncio.run(llm._complete(client, [])) == '{"diagnoses": []}'
+    assert client.calls == 3 and llm.upstream_stats.retries == 2
+
+
+def test_read_timeout_retried_when_allowed():
+    client = _Client(httpx.ReadTimeout("read", request=REQUEST), failures=1)
+
+    async def run():
+        return await llm._with_retries(lambda: client.create())
+
+    asyncio.run(run())
+    assert client.calls == 2
@@ -0,0 +1,144 @@
+"""Vectorised fusion and protocol aggregation vs the dict-based versions they replaced."""
+import random
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from src.rag.candidates import Candidates
+from src.rag.chunkstore import ChunkStore
+from src.rag.retriever import RRF_K, aggregate_by_protocol, fuse_batch, reciprocal_rank_fusion
+
+N_CHUNKS = 120
+N_PROTOCOLS = 15
+
+
+@pytest.fixture(scope="module")
+def store() -> ChunkStore:
+    rng = random.Random(0)
+    chunks = [
+        {"protocol_id": f"p{rng.randrange(N_PROTOCOLS)}", "chunk": f"фрагмент {i}", "chunk_index": i}
+        for i in range(N_CHUNKS)
+    ]
+    return ChunkStore.from_chunks(chunks)
+
+
+def _old_rrf(dense: Candidates, sparse: Candidates, top_k: int, k: int = RRF_K, weights=(1.0, 1.0)):
+    """reciprocal_rank_fusion before vectorisation (plus per-retriever weights)."""
+    scores: dict[int, float] = {}
+    for results, weight in zip((dense, sparse), weights):
+        for rank, row in enumerate(results.rows.tolist()):
+            contrib = 1.0 / (k + rank + 1)
+            if weights != (1.0, 1.0):
+                contrib = contrib * weight
+            scores[row] = scores.get(row, 0.0) + contrib
+    rows = np.fromiter(scores.keys(), dtype="int64", count=len(scores))
+    fused = np.fromiter(scores.values(), dtype="float64", count=len(scores))
+    order = np.argsort(-fused, kind="stable")[:top_k]
+    return rows[order], fused[order]
+
+
+def _old_aggregate(candidates: Candidates, top_protocols: int):
+    """aggregate_by_protocol before vectorisation (max pooling, ties broken by the sum)."""
+    scores = candidates.rank_scores()
+    protocol_data = defaultdict(lambda: {"total_score": 0.0, "max_score": 0.0, "positions": []})
+    for i, (protocol, score) in enumerate(zip(candidates.protocols().tolist(), scores.tolist())):
+        data = protocol_data[protocol]
+        data["total_score"] += score
+        data["max_score"] = max(data["max_score"], score)
+        data["positions"].append(i)
+    ranked = sorted(protocol_data.values(), key=lambda d: (d["max_score"], d["total_score"]), reverse=True)
+    order, protocol_rank = [], []
+    for data in ranked[:top_protocols]:
+        positions = sorted(data["positions"], key=lambda i: scores[i], reverse=True)
+        order.extend(positions)
+        protocol_rank.extend([data["max_score"]] * len(positions))
+    return candidates.rows[order], np.array(protocol_rank, dtype="float64")
+
+
+def _ranked(rng: random.Random, store: ChunkStore, name: str, n: int) -> Candidates:
+    rows = np.array(rng.sample(range(N_CHUNKS), n), dtype="int64")
+    scores = np.sort(np.array([rng.random() for _ in range(n)]))[::-1]
+    return Candidates(store, rows, {name: scores})
+
+
+def _batch(seed: int, store: ChunkStore, n_queries: int):
+    rng = random.Random(seed)
+    # Small pools give many rows shared by both lists; equal lengths give equal-rank ties
+    dense = [_ranked(rng, store, "dense", rng.randint(0, 25)) for _ in range(n_queries)]
+    sparse = [_ranked(rng, store, "sparse", rng.choice([0, len(d), rng.randint(1, 25)])) for d in dense]
+    return dense, sparse
+
+
+@pytest.mark.parametrize("weights", [(1.0, 1.0), (0.7, 1.3)])
+@pytest.mark.parametrize("seed", range(20))
+def test_rrf_matches_dict_version(store, seed, weights):
+    dense_batch, sparse_batch = _batch(seed, store, n_queries=8)
+    fused_batch = fuse_batch(dense_batch, sparse_batch, top_k=20, weights=weights)
+    assert len(fused_batch) == len(dense_batch)
+    for dense, sparse, fused in zip(dense_batch, sparse_batch, fused_batch):
+        rows, scores = _old_rrf(dense, sparse, top_k=20, weights=weights)
+        np.testing.assert_array_equal(fused.rows, rows)
+        np.testing.assert_array_equal(fused.scores["rrf"], scores)
+        single = reciprocal_rank_fusion(dense, sparse, top_k=20, weights=weights)
+        np.testing.assert_array_equal(single.rows, rows)
+
+
+def test_rrf_ties_keep_first_seen_order(store):
+    dense = Candidates(store, np.array([5, 6]), {"dense": np.array([0.9, 0.8])})
+    sparse = Candidates(store, np.array([7, 8]), {"sparse": np.array([3.0, 2.0])})
+    # Rank 0 of each list ties, as does rank 1: dense comes first within each tie
+    fused = reciprocal_rank_fusion(dense, sparse, top_k=4)
+    assert fused.rows.tolist() == [5, 7, 6, 8]
+
+
+def test_empty_batch(store):
+    empty = Candidates(store, np.empty(0, dtype="int64"), {"dense": np.empty(0)})
+    assert [len(c) for c in fuse_batch([empty, empty], [empty, empty], top_k=5)] == [0, 0]
+
+
+@pytest.mark.parametrize("mode", ["minmax", "zscore"])
+def test_score_fusion_modes(store, mode):
+    dense = Candidates(store, np.array([1, 2, 3]), {"dense": np.array([0.9, 0.5, 0.1])})
+    sparse = Candidates(store, np.array([3, 4]), {"sparse": np.array([12.0, 4.0])})
+    fused = reciprocal_rank_fusion(dense, sparse, top_k=5, mode=mode)
+    assert set(fused.rows.tolist()) == {1, 2, 3, 4} and "fused" in fused.scores
+    assert np.all(np.diff(fused.scores["fused"]) <= 0)
+    with pytest.raises(ValueError):
+        reciprocal_rank_fusion(dense, sparse, top_k=5, mode="borda")
+
+
+@pytest.mark.parametrize("score_name", ["rrf", "reranker"])
+@pytest.mark.parametrize("seed", range(20))
+def test_max_pooling_matches_dict_version(store, seed, score_name):
+    rng = random.Random(seed)
+    n = rng.randint(1, 40)
+    rows = np.array(rng.sample(range(N_CHUNKS), n), dtype="int64")
+    # Few distinct values force ties on both the best chunk and the sum; the
+    # cross-encoder's negative scores exercise the 0.0 floor of the max
+    values = [0.5, 0.25, 0.0] if score_name == "rrf" else [2.0, 1.0, -1.0, -3.0]
+    candidates = Candidates(store, rows, {score_name: np.array([rng.choice(values) for _ in range(n)])})
+
+    result = aggregate_by_protocol(candidates, top_protocols=5, pooling="max")
+    old_rows, old_rank = _old_aggregate(candidates, top_protocols=5)
+    np.testing.assert_array_equal(result.rows, old_rows)
+    np.testing.assert_array_equal(result.scores["protocol_rank"], old_rank)
+
+
+def test_other_poolings(store):
+    # Protocol rows: chunk i belongs to protocol store.protocol[i]; pick two protocols with 3 chunks each
+    by_protocol = defaultdict(list)
+    for row in range(N_CHUNKS):
+        by_protocol[int(store.protocol[row])].append(row)
+    a, b = [rows[:3] for rows in by_protocol.values() if len(rows) >= 3][:2]
+    # a: one strong chunk; b: three decent ones
+    candidates = Candidates(store, np.array(a + b), {"reranker": np.array([0.9, 0.1, 0.1, 0.5, 0.5, 0.5])})
+
+    assert aggregate_by_protocol(candidates, pooling="max").rows[0] == a[0]
+    summed = aggregate_by_protocol(candidates, pooling="sum")
+    assert summed.rows[0] == b[0] and summed.scores["protocol_rank"][0] == pytest.approx(1.5)
+    mean2 = aggregate_by_protocol(candidates, pooling="mean_top_m", top_m=2)
+    assert mean2.rows[0] == a[0] and mean2.scores["protocol_rank"][0] == pytest.approx(0.5)
+    assert mean2.scores["protocol_rank"][-1] == pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        aggregate_by_protocol(candidates, pooling="median")
@@ -0,0 +1,58 @@
+"""DiagnosisStreamParser: diagnoses come out as soon as their object closes, whatever the chunking."""
+import json
+
+import pytest
+
+from src.rag.llm import DiagnosisStreamParser
+
+DIAGNOSES = [
+    {"rank": 1, "diagnosis": "Бронхиальная астма", "icd10_code": "J45.0", "explanation": "Свист {не скобка} и \"кавычки\""},
+    {"rank": 2, "diagnosis": "ХОБЛ", "icd10_code": "J44.9", "explanation": "Слеш \\ и ]["},
+    {"rank": 3, "diagnosis": "Бронхит", "icd10_code": "J20.9", "explanation": "", "extra": {"nested": [1, {"a": 2}]}},
+]
+
+
+def _feed(text: str, size: int) -> list[list[dict]]:
+    parser = DiagnosisStreamParser()
+    return [parser.feed(text[i:i + size]) for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 10_000])
+def test_object_wrapper_any_chunking(size):
+    text = json.dumps({"diagnoses": DIAGNOSES}, ensure_ascii=False)
+    out = [d for batch in _feed(text, size) for d in batch]
+    assert out == DIAGNOSES
+
+
+def test_bare_list():
+    text = json.dumps(DIAGNOSES, ensure_ascii=False)
+    assert [d for batch in _feed(text, 3) for d in batch] == DIAGNOSES
+
+
+def test_each_item_emitted_when_its_brace_closes():
+    text = json.dumps({"diagnoses": DIAGNOSES[:2]}, ensure_ascii=False)
+    first_end = text.index("}, {") + 1
+    parser = DiagnosisStreamParser()
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [DIAGNOSES[0]]
+    assert parser.feed(text[first_end:]) == [DIAGNOSES[1]]
+    assert parser.raw == text
+
+
+def test_nested_objects_outside_the_item_array_are_ignored():
+    text = json.dumps({"meta": {"model": "x"}, "diagnoses": [DIAGNOSES[0]], "note": [{"not": "an item"}]})
+    # Only objects directly inside the top-level array count as diagnoses
+    out = [d for batch in _feed(text, 5) for d in batch]
+    assert out == [DIAGNOSES[0]]
+
+
+def test_truncated_stream_keeps_completed_items_only():
+    text = json.dumps({"diagnoses": DIAGNOSES}, ensure_ascii=False)
+    cut = text.index('"rank": 3') + 5
+    out = [d for batch in _feed(text[:cut], 4) for d in batch]
+    assert out == DIAGNOSES[:2]
+
+
+def test_results_key_also_accepted():
+    text = json.dumps({"results": DIAGNOSES[:1]}, ensure_ascii=False)
+    assert [d for batch in _feed(text, 3) for d in batch] == DIAGNOSES[:1]
@@ -1,10 +1,11 @@
 import { useState } from "react";
 import SymptomForm from "./SymptomForm";
 import ResultsList from "./ResultsList";
-import type { DiagnoseResponse } from "./types";
+import type { DiagnoseResponse, ProtocolCandidate } from "./types";
 
 export default function App() {
   const [result, setResult] = useState<DiagnoseResponse | null>(null);
+  const [candidates, setCandidates] = useState<ProtocolCandidate[]>([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
@@ -56,6 +57,7 @@ export default function App() {
       <div style={{ marginBottom: "32px" }}>
         <SymptomForm
           onResult={setResult}
+          onCandidates={setCandidates}
           onLoading={setLoading}
           onError={setError}
         />
@@ -83,6 +85,25 @@ export default function App() {
         </div>
       )}
 
+      {/* Candidate protocols from retrieval, shown until the first diagnosis streams in */}
+      {loading && candidates.length > 0 && !result?.diagnoses.length && (
+        <div style={{
+          marginTop: "16px",
+          color: "var(--text-muted)",
+          fontSize: "13px",
+          lineHeight: 1.6,
+        }}>
+          {candidates.map((c) => (
+            <div key={c.protocol_id}>
+              {c.source_file.replace(".pdf", "")}{" "}
+              <span style={{ fontFamily: "'DM Mono', monospace" }}>
+                {c.icd_codes.slice(0, 5).join(", ")}
+              </span>
+            </div>
+          ))}
+        </div>
+      )}
+
       {/* Error */}
       {error && (
         <div style={{
@@ -99,7 +120,7 @@ export default function App() {
       )}
 
       {/* Results */}
-      {result && !loading && (
+      {result && (!loading || result.diagnoses.length > 0) && (
         <ResultsList data={result} />
       )}
 
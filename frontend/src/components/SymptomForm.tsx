@@ -1,13 +1,14 @@
 import { useState } from "react";
-import type { DiagnoseResponse } from "./types";
+import type { DiagnoseResponse, Diagnosis, ProtocolCandidate, StreamEvent } from "./types";
 
 interface Props {
   onResult: (data: DiagnoseResponse) => void;
+  onCandidates: (protocols: ProtocolCandidate[]) => void;
   onLoading: (loading: boolean) => void;
   onError: (err: string | null) => void;
 }
 
-export default function SymptomForm({ onResult, onLoading, onError }: Props) {
+export default function SymptomForm({ onResult, onCandidates, onLoading, onError }: Props) {
   const [symptoms, setSymptoms] = useState("");
   const [loading, setLoading] = useState(false);
 
@@ -17,17 +18,43 @@ export default function SymptomForm({ onResult, onLoading, onError }: Props) {
     setLoading(true);
     onLoading(true);
     onError(null);
+    onCandidates([]);
+    onResult({ diagnoses: [] });
 
     try {
-      const res = await fetch("/diagnose", {
+      // NDJSON stream: candidate protocols first, then each diagnosis as it is ready
+      const res = await fetch("/diagnose/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ symptoms }),
       });
 
-      if (!res.ok) throw new Error(`HTTP ${res.status}`);
-      const data: DiagnoseResponse = await res.json();
-      onResult(data);
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      const diagnoses: Diagnosis[] = [];
+      let buffer = "";
+
+      const handle = (line: string) => {
+        if (!line.trim()) return;
+        const ev = JSON.parse(line) as StreamEvent;
+        if (ev.event === "candidates") onCandidates(ev.protocols);
+        else if (ev.event === "diagnosis") {
+          diagnoses.push(ev.diagnosis);
+          onResult({ diagnoses: [...diagnoses] });
+        } else if (ev.event === "done") onResult({ diagnoses: ev.diagnoses, degraded: ev.degraded });
+        else if (ev.event === "error") throw new Error(ev.detail);
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split("\n");
+        buffer = lines.pop() ?? "";
+        lines.forEach(handle);
+      }
+      handle(buffer);
     } catch (e: unknown) {
       onError(e instanceof Error ? e.message : "Ошибка запроса");
     } finally {
@@ -7,4 +7,19 @@ export interface Diagnosis {
 
 export interface DiagnoseResponse {
   diagnoses: Diagnosis[];
+  degraded?: boolean; // answered from retrieval only (the LLM missed the deadline)
 }
+
+export interface ProtocolCandidate {
+  protocol_id: string;
+  source_file: string;
+  icd_codes: string[];
+  score: number;
+}
+
+export type StreamEvent =
+  | { event: "candidates"; protocols: ProtocolCandidate[] }
+  | { event: "diagnosis"; diagnosis: Diagnosis }
+  | { event: "degraded"; reason: string }
+  | { event: "done"; diagnoses: Diagnosis[]; cached: boolean; degraded: boolean }
+  | { event: "error"; detail: string };